@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request
 from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
+import httpx
 import requests
 from config import settings
 
@@ -69,6 +70,43 @@ async def save_image(
         raise HTTPException(status_code=500, detail=f"Error saving image: {str(e)}")
 
 
+# SAVE IMAGES - Bulk upload images and store their embeddings
+@image_router.post("/save-images")
+async def save_images(request: Request):
+    """
+    Save many images in one request (see `/img/save-images` on the image service).
+    
+    Multipart form fields:
+    - tenant_id: The tenant ID to associate with the images
+    - images + style_numbers: repeated file fields with one style number (layout_code) each, or
+    - archive (+ optional manifest): a zip of images and a `filename,style_number` CSV
+    
+    The multipart body is streamed through to the image service as it arrives
+    instead of being parsed and buffered here.
+    
+    Returns:
+        Per-item status array with image_id / error for every image
+    """
+    headers = {"content-type": request.headers.get("content-type", "")}
+    image_save_url = f"{settings.IMAGE_SIMILARITY_SERVICE_URL}/img/save-images"
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(600.0, connect=10.0)) as client:
+            response = await client.post(image_save_url, content=request.stream(), headers=headers)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="Image service timed out")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=500, detail=f"Error saving images: {str(e)}")
+
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = response.text
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    return JSONResponse(content=response.json())
+
+
 # SEARCH AND STORE - Find similar images AND store the new image
 @image_router.post("/search-and-store")
 async def search_and_store(
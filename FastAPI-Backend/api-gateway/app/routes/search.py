@@ -282,6 +282,11 @@ async def search_images_with_obs(
     style_number: str = Form(..., description="Style number for the new image"),
     top_k: int = Form(10, description="Number of similar images to return"),
     store_image: bool = Form(True, description="Whether to store the new image"),
+    group_by_style: bool = Form(False, description="Return only the best image per (tenant, style)"),
+    retrieval: str = Form("exact", description="exact | binary | pq | sharded (see the image service)"),
+    image_ids: Optional[List[int]] = Form(None, description="Only search these image ids (repeat per value)"),
+    style_numbers: Optional[List[str]] = Form(None, description="Only search these style numbers"),
+    tenant_ids: Optional[List[str]] = Form(None, description="Only search these tenants"),
 ):
     """
     Complete workflow: Search for similar images and fetch their OBs.
@@ -299,6 +304,9 @@ async def search_images_with_obs(
         style_number: Style number (layout_code) for the new image
         top_k: Number of similar images to return (default: 10)
         store_image: Whether to store the new image (default: True)
+        group_by_style: Collapse images of the same style so each OB is fetched once
+        retrieval: Image search mode, passed through ("exact", "binary", "pq" or "sharded")
+        image_ids, style_numbers, tenant_ids: Optional allow-lists, passed through
         
     Returns:
         Similar images with their OB data
@@ -318,12 +326,19 @@ async def search_images_with_obs(
                 "style_number": style_number,
                 "tenant_id": tenant_id,
                 "top_k": top_k,
+                "group_by_style": group_by_style,
+                "retrieval": retrieval,
             }
             img_url = f"{settings.IMAGE_SIMILARITY_SERVICE_URL}/img/search-and-store"
         else:
             # Use find-similar-tenants endpoint (search only)
-            data = {"top_k": top_k}
+            data = {"top_k": top_k, "group_by_style": group_by_style, "retrieval": retrieval}
             img_url = f"{settings.IMAGE_SIMILARITY_SERVICE_URL}/search/find-similar-tenants"
+
+        # lists go out as repeated form fields
+        for name, values in (("image_ids", image_ids), ("style_numbers", style_numbers), ("tenant_ids", tenant_ids)):
+            if values is not None:
+                data[name] = values
         
         response = requests.post(img_url, files=files, data=data, timeout=180)
         response.raise_for_status()
@@ -1,10 +1,15 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.routes.status import status_router
 from app.routes.image import image_router
 from app.routes.search import router as search_router
+from app.routes.jobs import jobs_router
+from app.routes.embeddings import embeddings_router
+from app.utils import metrics
 from config import settings
-import boto3
 
 
 ALLOWED_ORIGINS = [settings.CLIENT_URL]
@@ -18,12 +23,39 @@ def create_app():
         description="API for style classification",
     )
 
-    s3_client = boto3.client(
-        "s3",
-        aws_access_key_id=settings.AWS_ACCESS_KEY,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        region_name=settings.AWS_REGION,
-    )
+    max_request_bytes = int(settings.MAX_REQUEST_MB) * 1024 * 1024
+
+    @app.middleware("http")
+    async def limit_request_size(request: Request, call_next):
+        # reject oversized uploads before the body is read or spooled
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_request_bytes:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Request body exceeds the {settings.MAX_REQUEST_MB} MB limit"},
+            )
+        return await call_next(request)
+
+    if settings.METRICS_ENABLED:
+        @app.middleware("http")
+        async def time_request(request: Request, call_next):
+            # stages recorded while serving the request are returned as Server-Timing
+            token = metrics.begin_request()
+            metrics.REQUESTS_IN_FLIGHT.inc()
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+            finally:
+                elapsed = time.perf_counter() - started
+                metrics.REQUESTS_IN_FLIGHT.dec()
+                stages = metrics.end_request(token)
+                metrics.REQUEST_SECONDS.observe(
+                    elapsed, method=request.method, route=metrics.route_label(request.scope), status=status,
+                )
+            response.headers["Server-Timing"] = metrics.server_timing(stages, elapsed)
+            return response
 
     app.add_middleware(
         CORSMiddleware,
@@ -37,5 +69,7 @@ def create_app():
     app.include_router(status_router)
     app.include_router(image_router, prefix="/img")
     app.include_router(search_router, prefix="/img")
+    app.include_router(jobs_router, prefix="/img")
+    app.include_router(embeddings_router, prefix="/img")
 
     return app
@@ -0,0 +1,221 @@
+# app/database/binary_quantization.py
+"""
+Sign-bit quantization of the stored embeddings for retrieval='binary' searches.
+
+fvector_pg.feature_bits holds one bit per dimension (1 where the component is
+positive): 96 bytes for a 768-dim vector instead of ~3 KB. Searches shortlist rows
+by Hamming distance on these bits and rerank the shortlist by exact cosine on
+feature_vector (`pg_connect._binary_shortlist`).
+
+Steps, each safe to re-run:
+    enable       add feature_bits bit(dim) and a trigger that fills it on insert/update
+    backfill     fill feature_bits for existing rows, one short transaction per id range
+    build_index  HNSW (bit_hamming_ops) index on feature_bits, pgvector >= 0.7 only;
+                 without it the shortlist is a sequential bit_count scan
+    benchmark    recall@k and latency of binary retrieval against exact search
+    disable      drop the column, trigger and index
+"""
+
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from app.database.pg_connect import get_conn, pgvector_version, rebuild_catalog_stats, search_similar_vectors, update_in_id_ranges
+
+
+BITS_COLUMN = 'feature_bits'
+BITS_INDEX = 'idx_fvector_bits_hnsw'
+SIGN_BITS_FUNCTION = 'fvector_sign_bits'
+SYNC_FUNCTION = 'fvector_pg_sync_bits'
+
+
+class BinaryIndexError(Exception):
+    """Raised when a step cannot run in the table's current state."""
+
+
+def _has_column() -> bool:
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = 'fvector_pg'::regclass AND attname = %s AND NOT attisdropped
+                """, (BITS_COLUMN,))
+                return cur.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def status() -> Dict:
+    """Whether the column exists, rows still to backfill, and whether the HNSW index is valid."""
+    result = {'enabled': _has_column(), 'pgvector': '%d.%d' % pgvector_version()}
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if result['enabled']:
+                    cur.execute(f"""
+                    SELECT count(*) FROM fvector_pg
+                    WHERE feature_vector IS NOT NULL AND {BITS_COLUMN} IS NULL
+                    """)
+                    result['pending_rows'] = cur.fetchone()[0]
+                cur.execute("""
+                SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = %s
+                """, (BITS_INDEX,))
+                row = cur.fetchone()
+                result['index'] = None if row is None else ('valid' if row[0] else 'invalid')
+    finally:
+        conn.close()
+    return result
+
+
+def enable(dim: int):
+    """Add the feature_bits column and the trigger that computes it for every write."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                CREATE OR REPLACE FUNCTION {SIGN_BITS_FUNCTION}(v real[]) RETURNS varbit
+                LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+                    SELECT string_agg(CASE WHEN x > 0 THEN '1' ELSE '0' END, '' ORDER BY i)::varbit
+                    FROM unnest(v) WITH ORDINALITY AS t(x, i)
+                $$;
+                ALTER TABLE fvector_pg ADD COLUMN IF NOT EXISTS {BITS_COLUMN} bit({dim});
+                CREATE OR REPLACE FUNCTION {SYNC_FUNCTION}() RETURNS trigger AS $$
+                BEGIN
+                    NEW.{BITS_COLUMN} := {SIGN_BITS_FUNCTION}(NEW.feature_vector::real[])::bit({dim});
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON fvector_pg;
+                CREATE TRIGGER {SYNC_FUNCTION} BEFORE INSERT OR UPDATE OF feature_vector ON fvector_pg
+                    FOR EACH ROW EXECUTE FUNCTION {SYNC_FUNCTION}();
+                """)
+    finally:
+        conn.close()
+
+
+def backfill(dim: int, batch_size: int = 5000, on_batch: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Compute feature_bits for existing rows in id ranges of `batch_size`
+    (`pg_connect.update_in_id_ranges`). Until it finishes, rows without bits
+    sort last in the shortlist and are effectively not searchable in binary mode.
+
+    Returns:
+        Number of rows updated
+    """
+    if not _has_column():
+        raise BinaryIndexError("run enable first")
+    return update_in_id_ranges(
+        f"{BITS_COLUMN} = {SIGN_BITS_FUNCTION}(feature_vector::real[])::bit({dim})",
+        f"{BITS_COLUMN} IS NULL AND feature_vector IS NOT NULL",
+        batch_size, on_batch,
+    )
+
+
+def build_index(m: int = 16, ef_construction: int = 64):
+    """Build the HNSW Hamming index concurrently (pgvector >= 0.7); an invalid leftover is rebuilt."""
+    if pgvector_version() < (0, 7):
+        raise BinaryIndexError("an HNSW index on bits needs pgvector >= 0.7 (installed: %d.%d); "
+                               "binary retrieval works without it" % pgvector_version())
+    conn = get_conn()
+    try:
+        conn.autocommit = True  # CREATE INDEX CONCURRENTLY cannot run in a transaction
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+            """, (BITS_INDEX,))
+            row = cur.fetchone()
+            if row is not None and not row[0]:
+                cur.execute(f"DROP INDEX CONCURRENTLY {BITS_INDEX}")
+            cur.execute(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {BITS_INDEX} ON fvector_pg
+            USING hnsw ({BITS_COLUMN} bit_hamming_ops) WITH (m = %s, ef_construction = %s)
+            """, (m, ef_construction))
+    finally:
+        conn.close()
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 2) if samples else 0.0
+
+
+def benchmark(queries: int = 100, top_k: int = 10, factors: tuple = (1, 2, 5, 10, 20)) -> Dict:
+    """
+    Recall@k and latency of binary retrieval for each rerank factor, on the stored data.
+
+    Uses `queries` random stored vectors as queries; ground truth is the exact top_k
+    (the query row itself excluded). Timings are end to end through
+    `search_similar_vectors`, so they include the round trip.
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                SELECT id, feature_vector::text FROM fvector_pg
+                WHERE {BITS_COLUMN} IS NOT NULL
+                ORDER BY random() LIMIT %s
+                """, (queries,))
+                samples = cur.fetchall()
+    finally:
+        conn.close()
+
+    modes = ['exact'] + [f'binary_x{f}' for f in factors]
+    timings = {mode: [] for mode in modes}
+    recalls = {mode: [] for mode in modes}
+
+    def run(vector, query_id, **kwargs):
+        started = time.perf_counter()
+        rows = search_similar_vectors(vector, top_k=top_k + 1, **kwargs)
+        elapsed = time.perf_counter() - started
+        return [r['id'] for r in rows if r['id'] != query_id][:top_k], elapsed
+
+    for query_id, vec_text in samples:
+        vector = np.array(vec_text.strip('[]').split(','), dtype=np.float32)
+        truth, elapsed = run(vector, query_id)
+        timings['exact'].append(elapsed)
+        if not truth:
+            continue
+        recalls['exact'].append(1.0)
+        for factor in factors:
+            ids, elapsed = run(vector, query_id, retrieval='binary', rerank_factor=factor)
+            timings[f'binary_x{factor}'].append(elapsed)
+            recalls[f'binary_x{factor}'].append(len(set(truth).intersection(ids)) / len(truth))
+
+    return {
+        'queries': len(samples),
+        'top_k': top_k,
+        'index': status()['index'],
+        'modes': {
+            mode: {
+                'recall': round(float(np.mean(recalls[mode])), 4) if recalls[mode] else None,
+                'p50_ms': _percentile_ms(timings[mode], 50),
+                'p95_ms': _percentile_ms(timings[mode], 95),
+            }
+            for mode in modes
+        },
+    }
+
+
+def disable():
+    """Drop the trigger, index, column and helper function."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON fvector_pg;
+                DROP FUNCTION IF EXISTS {SYNC_FUNCTION}();
+                DROP INDEX IF EXISTS {BITS_INDEX};
+                ALTER TABLE fvector_pg DROP COLUMN IF EXISTS {BITS_COLUMN};
+                DROP FUNCTION IF EXISTS {SIGN_BITS_FUNCTION}(real[]);
+                """)
+    finally:
+        conn.close()
+    rebuild_catalog_stats()  # stored_bytes no longer includes the bits
@@ -0,0 +1,310 @@
+# app/database/embedding_sets.py
+"""
+Embedding sets: one set of vectors per embedding model, so the catalog can move to a
+new model without a gap in search.
+
+The active set is fvector_pg.feature_vector itself (each row records the model that
+produced it in fvector_pg.model_id), so searches, indexes and the binary/halfvec
+columns keep working unchanged. A new set is filled in the background into
+fvector_embeddings (model_id, image_id, feature_vector) while the old one keeps
+serving; `activate` then swaps the vectors in one transaction:
+
+    1. lock fvector_pg against writes (reads continue)
+    2. embed the few rows written since the backfill finished (`embed_missing`)
+    3. park the current vectors in fvector_embeddings under their own model
+    4. move the new set's vectors into fvector_pg.feature_vector and flip `active`
+
+Switching back to the previous model is the same operation in reverse. Processes
+pick up the new active model (used to embed queries and new uploads) within
+EMBEDDING_SET_REFRESH_SECONDS; see `pg_connect.active_model_id`.
+"""
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from app.database.pg_connect import _to_vector_text, forget_active_model, get_conn
+
+
+class EmbeddingSetError(Exception):
+    """Raised when an embedding set does not exist or cannot be switched to."""
+
+
+def list_sets() -> List[Dict]:
+    """Every embedding set with its dimension, whether it is active and how many images it covers."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT count(*) FROM fvector_pg")
+                total = cur.fetchone()[0]
+                cur.execute("""
+                SELECT s.model_id, s.dim, s.active, s.created_at, s.activated_at,
+                       CASE WHEN s.active
+                            THEN (SELECT count(*) FROM fvector_pg p WHERE p.model_id = s.model_id)
+                            ELSE (SELECT count(*) FROM fvector_embeddings e WHERE e.model_id = s.model_id)
+                                 + (SELECT count(*) FROM fvector_pg p WHERE p.model_id = s.model_id)
+                       END AS images
+                FROM embedding_sets s
+                ORDER BY s.active DESC, s.created_at
+                """)
+                return [
+                    {
+                        'model_id': model_id,
+                        'dim': dim,
+                        'active': active,
+                        'created_at': created_at.isoformat() if created_at else None,
+                        'activated_at': activated_at.isoformat() if activated_at else None,
+                        'images': images,
+                        'missing': total - images,
+                    }
+                    for model_id, dim, active, created_at, activated_at, images in cur.fetchall()
+                ]
+    finally:
+        conn.close()
+
+
+def create_set(model_id: str, dim: Optional[int] = None) -> bool:
+    """Register an embedding set. Returns False if it already exists."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                INSERT INTO embedding_sets (model_id, dim) VALUES (%s, %s)
+                ON CONFLICT (model_id) DO NOTHING
+                RETURNING model_id
+                """, (model_id, dim))
+                return cur.fetchone() is not None
+    finally:
+        conn.close()
+
+
+def _missing_sql(limit: bool) -> str:
+    return f"""
+    SELECT p.id, p.image_url FROM fvector_pg p
+    WHERE p.id > %s AND p.model_id <> %s
+      AND NOT EXISTS (SELECT 1 FROM fvector_embeddings e WHERE e.model_id = %s AND e.image_id = p.id)
+    ORDER BY p.id
+    {'LIMIT %s' if limit else ''}
+    """
+
+
+def missing_rows(model_id: str, after_id: int = 0, limit: int = 100) -> List[tuple]:
+    """Up to `limit` (id, image_url) rows after `after_id` that have no vector from `model_id` yet."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(_missing_sql(True), (after_id, model_id, model_id, limit))
+                return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def count_missing(model_id: str) -> int:
+    """Rows that have no vector from `model_id` yet."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT count(*) FROM ({_missing_sql(False)}) m", (0, model_id, model_id))
+                return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def store_vectors(model_id: str, ids: List[int], vectors) -> Tuple[int, List[int]]:
+    """
+    Store vectors computed with `model_id` for the rows `ids` (rows deleted meanwhile are skipped).
+
+    Into fvector_embeddings while the set is inactive; if it has become active since
+    the batch was read, into fvector_pg directly (only rows still holding another
+    model's vector).
+
+    Returns:
+        Number of rows stored, and the ids whose live vector in fvector_pg was replaced
+    """
+    rows = [(model_id, int(i), _to_vector_text(v)) for i, v in zip(ids, vectors)]
+    if not rows:
+        return 0, []
+    dim = len(vectors[0])
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # FOR SHARE: waits for a running `activate`, which holds the row FOR UPDATE
+                cur.execute("SELECT dim, active FROM embedding_sets WHERE model_id = %s FOR SHARE", (model_id,))
+                row = cur.fetchone()
+                if row is None:
+                    raise EmbeddingSetError(f"unknown embedding set {model_id!r}")
+                set_dim, active = row
+                if set_dim is None:
+                    cur.execute("UPDATE embedding_sets SET dim = %s WHERE model_id = %s", (dim, model_id))
+                elif set_dim != dim:
+                    raise EmbeddingSetError(f"{model_id!r} vectors have dimension {set_dim}, got {dim}")
+                if active:
+                    result = execute_values(cur, """
+                    UPDATE fvector_pg p SET feature_vector = v.vec::vector, model_id = v.model_id
+                    FROM (VALUES %s) AS v(model_id, id, vec)
+                    WHERE p.id = v.id AND p.model_id <> v.model_id
+                    RETURNING p.id
+                    """, rows, fetch=True)
+                    return len(result), [r[0] for r in result]
+                else:
+                    result = execute_values(cur, """
+                    INSERT INTO fvector_embeddings (model_id, image_id, feature_vector)
+                    SELECT v.model_id, v.id, v.vec::vector
+                    FROM (VALUES %s) AS v(model_id, id, vec) JOIN fvector_pg p ON p.id = v.id
+                    ON CONFLICT (model_id, image_id)
+                    DO UPDATE SET feature_vector = EXCLUDED.feature_vector, created_at = now()
+                    RETURNING image_id
+                    """, rows, fetch=True)
+                return len(result), []
+    finally:
+        conn.close()
+
+
+def _typmod_dims(cur) -> Dict[str, int]:
+    """Declared dimensions of feature_vector / feature_bits (absent if the column is untyped)."""
+    cur.execute("""
+    SELECT attname, atttypmod FROM pg_attribute
+    WHERE attrelid = 'fvector_pg'::regclass AND attname IN ('feature_vector', 'feature_bits')
+      AND NOT attisdropped AND atttypmod > 0
+    """)
+    return dict(cur.fetchall())
+
+
+def activate(model_id: str,
+             embed_missing: Optional[Callable[[List[tuple]], Dict[int, np.ndarray]]] = None,
+             max_missing: int = 500) -> Dict:
+    """
+    Make `model_id` the active embedding set, in one transaction.
+
+    Writes to fvector_pg wait for the switch; searches keep running against the old
+    vectors until it commits. Rows still missing a vector from `model_id` (written
+    after the backfill) are embedded under the lock by `embed_missing(rows)`, which
+    receives (id, image_url) tuples and returns {id: vector}.
+
+    Args:
+        model_id: Set to activate
+        embed_missing: Callback for the remaining rows; without it any missing row is an error
+        max_missing: Refuse (before locking out writes for long) above this many missing rows
+
+    Returns:
+        Dict with model_id, previous (model), switched (rows moved) and embedded
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # lock both set rows first (stores take them FOR SHARE), then the table
+                cur.execute("""
+                SELECT model_id, dim, active FROM embedding_sets
+                WHERE model_id = %s OR active FOR UPDATE
+                """, (model_id,))
+                sets = {m: (dim, active) for m, dim, active in cur.fetchall()}
+                if model_id not in sets:
+                    raise EmbeddingSetError(f"unknown embedding set {model_id!r}")
+                previous = next((m for m, (_, active) in sets.items() if active), None)
+                if previous == model_id:
+                    return {'model_id': model_id, 'previous': previous, 'switched': 0, 'embedded': 0}
+                cur.execute("LOCK TABLE fvector_pg IN SHARE ROW EXCLUSIVE MODE")
+
+                cur.execute(_missing_sql(False), (0, model_id, model_id))
+                missing = cur.fetchall()
+                embedded = 0
+                if missing:
+                    if embed_missing is None or len(missing) > max_missing:
+                        raise EmbeddingSetError(
+                            f"{len(missing)} rows have no {model_id!r} vector yet; run a re-embed job first")
+                    vectors = embed_missing(missing)
+                    failed = [row_id for row_id, _ in missing if row_id not in vectors]
+                    if failed:
+                        raise EmbeddingSetError(f"could not embed {len(failed)} rows (first ids: {failed[:10]})")
+                    embedded = len(missing)
+                    execute_values(cur, """
+                    INSERT INTO fvector_embeddings (model_id, image_id, feature_vector)
+                    VALUES %s
+                    ON CONFLICT (model_id, image_id) DO UPDATE SET feature_vector = EXCLUDED.feature_vector
+                    """, [(model_id, row_id, _to_vector_text(vectors[row_id])) for row_id, _ in missing],
+                        template="(%s, %s, %s::vector)")
+
+                dim = sets[model_id][0]
+                if dim is None:
+                    cur.execute("SELECT vector_dims(feature_vector) FROM fvector_embeddings WHERE model_id = %s LIMIT 1",
+                                (model_id,))
+                    row = cur.fetchone()
+                    dim = row[0] if row else None
+                for column, declared in _typmod_dims(cur).items():
+                    if dim is not None and declared != dim:
+                        raise EmbeddingSetError(
+                            f"{column} is declared with dimension {declared} but {model_id!r} vectors have {dim}")
+
+                # keep the current vectors as their own (now inactive) sets, so the switch can be undone
+                cur.execute("""
+                INSERT INTO embedding_sets (model_id)
+                SELECT DISTINCT model_id FROM fvector_pg
+                ON CONFLICT (model_id) DO NOTHING
+                """)
+                cur.execute("""
+                INSERT INTO fvector_embeddings (model_id, image_id, feature_vector)
+                SELECT p.model_id, p.id, p.feature_vector::vector FROM fvector_pg p
+                WHERE p.model_id <> %s AND p.feature_vector IS NOT NULL
+                ON CONFLICT (model_id, image_id) DO UPDATE SET feature_vector = EXCLUDED.feature_vector, created_at = now()
+                """, (model_id,))
+                cur.execute("""
+                UPDATE fvector_pg p SET feature_vector = e.feature_vector, model_id = e.model_id
+                FROM fvector_embeddings e
+                WHERE e.model_id = %s AND e.image_id = p.id
+                """, (model_id,))
+                switched = cur.rowcount
+                cur.execute("DELETE FROM fvector_embeddings WHERE model_id = %s", (model_id,))
+                cur.execute("UPDATE embedding_sets SET active = false WHERE active")
+                cur.execute("""
+                UPDATE embedding_sets SET active = true, activated_at = now(), dim = COALESCE(dim, %s)
+                WHERE model_id = %s
+                """, (dim, model_id))
+    finally:
+        conn.close()
+    forget_active_model()
+    return {'model_id': model_id, 'previous': previous, 'switched': switched, 'embedded': embedded}
+
+
+def drop_set(model_id: str, batch_size: int = 10000) -> int:
+    """
+    Delete an inactive embedding set and its vectors (in batches of `batch_size`,
+    one transaction each).
+
+    Returns:
+        Number of vectors deleted
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT active FROM embedding_sets WHERE model_id = %s", (model_id,))
+                row = cur.fetchone()
+                if row is None:
+                    raise EmbeddingSetError(f"unknown embedding set {model_id!r}")
+                if row[0]:
+                    raise EmbeddingSetError(f"{model_id!r} is the active embedding set")
+                cur.execute("SELECT EXISTS (SELECT 1 FROM fvector_pg WHERE model_id = %s)", (model_id,))
+                if cur.fetchone()[0]:
+                    raise EmbeddingSetError(f"fvector_pg still holds {model_id!r} vectors")
+        deleted = 0
+        while True:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    DELETE FROM fvector_embeddings
+                    WHERE model_id = %s AND image_id IN (
+                        SELECT image_id FROM fvector_embeddings WHERE model_id = %s LIMIT %s)
+                    """, (model_id, model_id, batch_size))
+                    deleted += cur.rowcount
+                    if cur.rowcount < batch_size:
+                        cur.execute("DELETE FROM embedding_sets WHERE model_id = %s AND NOT active", (model_id,))
+                        return deleted
+    finally:
+        conn.close()
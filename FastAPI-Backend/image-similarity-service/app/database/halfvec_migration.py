@@ -0,0 +1,306 @@
+# app/database/halfvec_migration.py
+"""
+Online conversion of fvector_pg.feature_vector from vector to halfvec (pgvector >= 0.7).
+
+Steps, each safe to re-run:
+    prepare     add feature_vector_half halfvec(dim) and a trigger that keeps it in
+                step with feature_vector for every insert/update from now on
+    backfill    fill feature_vector_half for existing rows, one short transaction per id range
+    build_index CREATE INDEX CONCURRENTLY ... USING hnsw (feature_vector_half halfvec_cosine_ops)
+    compare     recall@k and latency of halfvec (exact and HNSW) against float32 exact search
+    swap        drop the float32 column and rename the halfvec column/index into place
+                (one short transaction; restart the services afterwards)
+    rollback    before the swap: drop the trigger, index and halfvec column again
+"""
+
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.database.pg_connect import get_conn, pgvector_version, rebuild_catalog_stats, update_in_id_ranges
+
+
+HALF_COLUMN = 'feature_vector_half'
+HALF_INDEX = 'idx_fvector_half_hnsw'
+FINAL_INDEX = 'idx_fvector_hnsw'
+SYNC_FUNCTION = 'fvector_pg_sync_half'
+
+
+class MigrationError(Exception):
+    """Raised when a step cannot run in the table's current state."""
+
+
+def _column_types() -> Dict[str, str]:
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+                WHERE attrelid = 'fvector_pg'::regclass AND attname IN ('feature_vector', %s)
+                  AND NOT attisdropped
+                """, (HALF_COLUMN,))
+                return dict(cur.fetchall())
+    finally:
+        conn.close()
+
+
+def status() -> Dict:
+    """Current state: column types, rows still to backfill and whether the HNSW index exists."""
+    types = _column_types()
+    result = {'feature_vector': types.get('feature_vector'), HALF_COLUMN: types.get(HALF_COLUMN)}
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if HALF_COLUMN in types:
+                    cur.execute(f"""
+                    SELECT count(*) FROM fvector_pg
+                    WHERE feature_vector IS NOT NULL AND {HALF_COLUMN} IS NULL
+                    """)
+                    result['pending_rows'] = cur.fetchone()[0]
+                cur.execute("""
+                SELECT c.relname, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname IN (%s, %s)
+                """, (HALF_INDEX, FINAL_INDEX))
+                result['indexes'] = {name: valid for name, valid in cur.fetchall()}
+    finally:
+        conn.close()
+    return result
+
+
+def prepare(dim: int):
+    """Add the halfvec column and the trigger that fills it on insert/update."""
+    types = _column_types()
+    if (types.get('feature_vector') or '').startswith('halfvec'):
+        raise MigrationError("feature_vector is already halfvec")
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if pgvector_version() < (0, 7):
+                    raise MigrationError("halfvec needs pgvector >= 0.7 (installed: %d.%d)" % pgvector_version())
+                cur.execute("""
+                SELECT count(*) FROM fvector_pg
+                WHERE feature_vector IS NOT NULL AND vector_dims(feature_vector) <> %s
+                """, (dim,))
+                mismatched = cur.fetchone()[0]
+                if mismatched:
+                    raise MigrationError(f"{mismatched} rows have a vector dimension other than {dim}")
+                cur.execute(f"""
+                ALTER TABLE fvector_pg ADD COLUMN IF NOT EXISTS {HALF_COLUMN} halfvec({dim});
+                CREATE OR REPLACE FUNCTION {SYNC_FUNCTION}() RETURNS trigger AS $$
+                BEGIN
+                    NEW.{HALF_COLUMN} := NEW.feature_vector::halfvec({dim});
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql;
+                DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON fvector_pg;
+                CREATE TRIGGER {SYNC_FUNCTION} BEFORE INSERT OR UPDATE OF feature_vector ON fvector_pg
+                    FOR EACH ROW EXECUTE FUNCTION {SYNC_FUNCTION}();
+                """)
+    finally:
+        conn.close()
+
+
+def backfill(dim: int, batch_size: int = 5000, on_batch: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Convert existing rows in id ranges of `batch_size`, committing after each range
+    (`pg_connect.update_in_id_ranges`). Rows inserted after the pass started are
+    converted by the trigger. `on_batch(converted, last_id)` reports progress.
+
+    Returns:
+        Number of rows converted
+    """
+    if HALF_COLUMN not in _column_types():
+        raise MigrationError("run prepare first")
+    return update_in_id_ranges(
+        f"{HALF_COLUMN} = feature_vector::halfvec({dim})",
+        f"{HALF_COLUMN} IS NULL AND feature_vector IS NOT NULL",
+        batch_size, on_batch,
+    )
+
+
+def build_index(m: int = 16, ef_construction: int = 64):
+    """
+    Build the HNSW index on the halfvec column without blocking writes.
+
+    An interrupted CONCURRENTLY build leaves an invalid index behind; it is dropped
+    and rebuilt on the next run.
+    """
+    conn = get_conn()
+    try:
+        conn.autocommit = True  # CREATE INDEX CONCURRENTLY cannot run in a transaction
+        with conn.cursor() as cur:
+            cur.execute("""
+            SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = %s
+            """, (HALF_INDEX,))
+            row = cur.fetchone()
+            if row is not None and not row[0]:
+                cur.execute(f"DROP INDEX CONCURRENTLY {HALF_INDEX}")
+            cur.execute(f"""
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS {HALF_INDEX} ON fvector_pg
+            USING hnsw ({HALF_COLUMN} halfvec_cosine_ops) WITH (m = %s, ef_construction = %s)
+            """, (m, ef_construction))
+    finally:
+        conn.close()
+
+
+def _percentile_ms(samples: List[float], q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 2) if samples else 0.0
+
+
+def compare(queries: int = 100, top_k: int = 10, ef_search: int = 40) -> Dict:
+    """
+    Measure what halfvec costs in accuracy and gains in speed/size, on the stored data.
+
+    Uses `queries` random stored vectors as queries (excluding the query row itself)
+    and takes the exact float32 top_k as ground truth. Reports, per mode:
+        float32_exact   sequential scan on feature_vector (today's search)
+        halfvec_exact   sequential scan on the halfvec column (rounding only)
+        halfvec_hnsw    HNSW index scan with hnsw.ef_search = ef_search
+    recall@k (share of the ground-truth ids returned), p50/p95 latency in ms, and
+    the average stored bytes per vector and the index size.
+    """
+    modes = {
+        'float32_exact': ("feature_vector", "vector", "SET LOCAL enable_indexscan = off"),
+        'halfvec_exact': (HALF_COLUMN, "halfvec", "SET LOCAL enable_indexscan = off"),
+        'halfvec_hnsw': (HALF_COLUMN, "halfvec", f"SET LOCAL hnsw.ef_search = {int(ef_search)}"),
+    }
+    timings = {mode: [] for mode in modes}
+    recalls = {mode: [] for mode in modes}
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                SELECT id, feature_vector::text FROM fvector_pg
+                WHERE {HALF_COLUMN} IS NOT NULL
+                ORDER BY random() LIMIT %s
+                """, (queries,))
+                samples = cur.fetchall()
+                cur.execute(f"""
+                SELECT avg(pg_column_size(feature_vector)), avg(pg_column_size({HALF_COLUMN}))
+                FROM (SELECT feature_vector, {HALF_COLUMN} FROM fvector_pg
+                      WHERE {HALF_COLUMN} IS NOT NULL LIMIT 1000) s
+                """)
+                full_bytes, half_bytes = cur.fetchone()
+                cur.execute("SELECT pg_relation_size(to_regclass(%s))", (HALF_INDEX,))
+                index_bytes = cur.fetchone()[0]
+
+        for query_id, vec_text in samples:
+            truth = None
+            for mode, (column, cast, setting) in modes.items():
+                with conn:
+                    with conn.cursor() as cur:
+                        cur.execute(setting)
+                        started = time.perf_counter()
+                        cur.execute(f"""
+                        SELECT id FROM fvector_pg WHERE id <> %s
+                        ORDER BY {column} <=> %s::{cast} LIMIT %s
+                        """, (query_id, vec_text, top_k))
+                        ids = [r[0] for r in cur.fetchall()]
+                        timings[mode].append(time.perf_counter() - started)
+                if truth is None:
+                    truth = set(ids)  # float32_exact runs first
+                if truth:
+                    recalls[mode].append(len(truth.intersection(ids)) / len(truth))
+    finally:
+        conn.close()
+
+    return {
+        'queries': len(samples),
+        'top_k': top_k,
+        'ef_search': ef_search,
+        'modes': {
+            mode: {
+                'recall': round(float(np.mean(recalls[mode])), 4) if recalls[mode] else None,
+                'p50_ms': _percentile_ms(timings[mode], 50),
+                'p95_ms': _percentile_ms(timings[mode], 95),
+            }
+            for mode in modes
+        },
+        'bytes_per_vector': {
+            'float32': int(full_bytes or 0),
+            'halfvec': int(half_bytes or 0),
+        },
+        'hnsw_index_bytes': index_bytes,
+    }
+
+
+def _column_triggers(cur, column: str) -> List[Tuple[str, str]]:
+    """(name, CREATE TRIGGER statement) of the fvector_pg triggers listing `column` in UPDATE OF."""
+    cur.execute("""
+    SELECT t.tgname, pg_get_triggerdef(t.oid) FROM pg_trigger t
+    JOIN pg_attribute a ON a.attrelid = t.tgrelid AND a.attnum = ANY(t.tgattr::int2[])
+    WHERE t.tgrelid = 'fvector_pg'::regclass AND NOT t.tgisinternal AND a.attname = %s
+    ORDER BY t.tgname
+    """, (column,))
+    return cur.fetchall()
+
+
+def swap():
+    """
+    Make the halfvec column the feature_vector column.
+
+    Requires a complete backfill and a valid HNSW index. Runs in one transaction
+    under a brief exclusive lock. DROP COLUMN does not rewrite the table: the float32
+    data is only reclaimed by a later table rewrite (VACUUM FULL or pg_repack).
+    fvector_stats is recounted afterwards, since every row's stored size changes.
+
+    Other triggers that fire on `UPDATE OF feature_vector` (binary quantization's
+    fvector_pg_sync_bits, the catalog stats trigger) depend on the column and would
+    block the drop, so they are dropped and re-created on the new column in the
+    same transaction.
+    """
+    state = status()
+    if state[HALF_COLUMN] is None:
+        raise MigrationError("nothing to swap: run prepare/backfill first")
+    if state.get('pending_rows'):
+        raise MigrationError(f"{state['pending_rows']} rows are not backfilled yet")
+    if not state['indexes'].get(HALF_INDEX):
+        raise MigrationError("build the HNSW index first")
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                LOCK TABLE fvector_pg IN ACCESS EXCLUSIVE MODE;
+                DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON fvector_pg;
+                DROP FUNCTION IF EXISTS {SYNC_FUNCTION}();
+                """)
+                dependent = _column_triggers(cur, 'feature_vector')
+                for name, _ in dependent:
+                    cur.execute(f'DROP TRIGGER "{name}" ON fvector_pg')
+                cur.execute(f"""
+                ALTER TABLE fvector_pg DROP COLUMN feature_vector;
+                ALTER TABLE fvector_pg RENAME COLUMN {HALF_COLUMN} TO feature_vector;
+                ALTER INDEX {HALF_INDEX} RENAME TO {FINAL_INDEX};
+                """)
+                for _, definition in dependent:
+                    cur.execute(definition)
+    finally:
+        conn.close()
+    rebuild_catalog_stats()  # stored_bytes changes with the dropped column
+
+
+def rollback():
+    """Undo prepare/backfill/build_index (before a swap)."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                DROP TRIGGER IF EXISTS {SYNC_FUNCTION} ON fvector_pg;
+                DROP FUNCTION IF EXISTS {SYNC_FUNCTION}();
+                DROP INDEX IF EXISTS {HALF_INDEX};
+                ALTER TABLE fvector_pg DROP COLUMN IF EXISTS {HALF_COLUMN};
+                """)
+    finally:
+        conn.close()
+    rebuild_catalog_stats()
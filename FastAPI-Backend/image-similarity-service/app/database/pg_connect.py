@@ -1,10 +1,14 @@
 import os
 import json
-from datetime import datetime
-from typing import List, Dict, Optional
+import time
+import struct
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import numpy as np
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, Json, execute_values
 from config import settings
+from app.utils.metrics import DB_CONNECT_SECONDS, record_stage
 
 
 def get_conn():
@@ -18,48 +22,551 @@ def get_conn():
         port = os.getenv('POSTGRES_PORT', '5432')
         db = os.getenv('POSTGRES_DB', 'postgres')
         dsn = f"postgresql://{user}:{password}@{host}:{port}/{db}"
-    return psycopg2.connect(dsn)
+    started = time.perf_counter()
+    conn = psycopg2.connect(dsn)
+    elapsed = time.perf_counter() - started
+    DB_CONNECT_SECONDS.observe(elapsed)
+    record_stage('db_connect', elapsed)
+    return conn
 
 
-def init_table():
-    """Create table for vectors if not exists. Requires pgvector extension enabled in DB."""
-    sql = """
+_vector_type: Optional[str] = None
+
+
+def vector_column_type() -> str:
+    """
+    How fvector_pg.feature_vector is stored: 'halfvec' or 'vector'.
+
+    Looked up once per process; after migrate_halfvec.py --swap the services
+    must be restarted to pick up the new type.
+    """
+    global _vector_type
+    if _vector_type is None:
+        conn = get_conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+                    WHERE attrelid = to_regclass('fvector_pg') AND attname = 'feature_vector'
+                    """)
+                    row = cur.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return 'vector'  # table not created yet; don't cache
+        _vector_type = 'halfvec' if row[0].startswith('halfvec') else 'vector'
+    return _vector_type
+
+
+_active_model: Optional[tuple] = None  # (model_id, monotonic time read)
+
+
+def active_model_id() -> str:
+    """
+    Model of the active embedding set: the model that produced fvector_pg.feature_vector
+    and that queries must be embedded with.
+
+    Cached for EMBEDDING_SET_REFRESH_SECONDS, so a switch (`embedding_sets.activate`)
+    reaches every process within that time. Before init_table has run it is EMBEDDING_MODEL,
+    cached the same way so embedding calls do not query the database each time.
+    """
+    global _active_model
+    now = time.monotonic()
+    if _active_model is None or now - _active_model[1] >= float(settings.EMBEDDING_SET_REFRESH_SECONDS):
+        conn = get_conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT to_regclass('embedding_sets') IS NOT NULL")
+                    row = None
+                    if cur.fetchone()[0]:
+                        cur.execute("SELECT model_id FROM embedding_sets WHERE active")
+                        row = cur.fetchone()
+        finally:
+            conn.close()
+        _active_model = (settings.EMBEDDING_MODEL if row is None else row[0], now)
+    return _active_model[0]
+
+
+def forget_active_model():
+    """Drop the cached active model (after switching it in this process)."""
+    global _active_model
+    _active_model = None
+
+
+_pgvector_version: Optional[tuple] = None
+
+
+def pgvector_version() -> tuple:
+    """Installed pgvector version as (major, minor), looked up once per process."""
+    global _pgvector_version
+    if _pgvector_version is None:
+        conn = get_conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+                    row = cur.fetchone()
+        finally:
+            conn.close()
+        _pgvector_version = tuple(int(p) for p in row[0].split('.')[:2]) if row else (0, 0)
+    return _pgvector_version
+
+
+RETRIEVAL_MODES = ('exact', 'binary')
+_binary_ready = False
+
+
+def binary_retrieval_ready() -> bool:
+    """Whether fvector_pg has the sign-bit column used by retrieval='binary' (see binary_index.py)."""
+    global _binary_ready
+    if not _binary_ready:
+        conn = get_conn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    SELECT 1 FROM pg_attribute
+                    WHERE attrelid = to_regclass('fvector_pg') AND attname = 'feature_bits' AND NOT attisdropped
+                    """)
+                    # only a positive answer is cached, so enabling it needs no restart
+                    _binary_ready = cur.fetchone() is not None
+        finally:
+            conn.close()
+    return _binary_ready
+
+
+def check_retrieval(retrieval: str):
+    """Raise ValueError if `retrieval` is unknown or not set up in this database."""
+    if retrieval not in RETRIEVAL_MODES:
+        raise ValueError(f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    if retrieval == 'binary' and not binary_retrieval_ready():
+        raise ValueError("binary retrieval is not set up (run binary_index.py enable)")
+
+
+def _migrate_base(cur):
+    """Vector table (halfvec(PGVECTOR_DIM) for a new table with VECTOR_STORAGE=halfvec) and job table."""
+    if settings.VECTOR_STORAGE == 'halfvec':
+        column_type = f"halfvec({int(settings.PGVECTOR_DIM)})"
+    else:
+        column_type = "vector"
+    sql = f"""
     CREATE TABLE IF NOT EXISTS fvector_pg (
         id SERIAL PRIMARY KEY,
         tenant_id TEXT NOT NULL,
         style_number TEXT,
         image_url TEXT,
-        feature_vector vector,
+        feature_vector {column_type},
         date_created TIMESTAMP DEFAULT now()
     );
     CREATE INDEX IF NOT EXISTS idx_fvector_tenant_id ON fvector_pg(tenant_id);
+    -- storage ETag of the object the vector was computed from (NULL for rows saved before sync existed)
+    ALTER TABLE fvector_pg ADD COLUMN IF NOT EXISTS etag TEXT;
+    -- 64-bit perceptual hash (dHash) of the image, stored as signed BIGINT
+    ALTER TABLE fvector_pg ADD COLUMN IF NOT EXISTS phash BIGINT;
+    -- byte-order index: matches the storage listing order and serves prefix LIKE
+    CREATE INDEX IF NOT EXISTS idx_fvector_image_url_c ON fvector_pg (image_url COLLATE "C");
+    -- ANN index, only once the column is halfvec (new halfvec installs, or after migrate_halfvec.py --swap)
+    DO $$
+    BEGIN
+        IF (SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'fvector_pg'::regclass AND attname = 'feature_vector') LIKE 'halfvec%' THEN
+            CREATE INDEX IF NOT EXISTS idx_fvector_hnsw ON fvector_pg USING hnsw (feature_vector halfvec_cosine_ops);
+        END IF;
+    END $$;
+
+    CREATE TABLE IF NOT EXISTS ingest_jobs (
+        id SERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        params JSONB NOT NULL DEFAULT '{{}}'::jsonb,
+        status TEXT NOT NULL DEFAULT 'queued',
+        total INTEGER,
+        processed INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        run_processed INTEGER NOT NULL DEFAULT 0,
+        checkpoint TEXT,
+        errors JSONB NOT NULL DEFAULT '[]'::jsonb,
+        error TEXT,
+        worker_id TEXT,
+        heartbeat_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT now(),
+        started_at TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT now(),
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status);
+    ALTER TABLE ingest_jobs ADD COLUMN IF NOT EXISTS result JSONB;
+    """
+    cur.execute(sql)
+
+
+def _migrate_embedding_sets(cur):
+    """embedding_sets, fvector_pg.model_id and fvector_embeddings (see embedding_sets.py)."""
+    initial_model = settings.EMBEDDING_MODEL.replace("'", "''")
+    sql = f"""
+    -- embedding sets: the active one is fvector_pg.feature_vector, others live in fvector_embeddings
+    CREATE TABLE IF NOT EXISTS embedding_sets (
+        model_id TEXT PRIMARY KEY,
+        dim INTEGER,
+        active BOOLEAN NOT NULL DEFAULT false,
+        created_at TIMESTAMP DEFAULT now(),
+        activated_at TIMESTAMP
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_embedding_sets_active ON embedding_sets (active) WHERE active;
+    INSERT INTO embedding_sets (model_id, dim, active, activated_at)
+    SELECT '{initial_model}', {int(settings.PGVECTOR_DIM)}, true, now()
+    WHERE NOT EXISTS (SELECT 1 FROM embedding_sets);
+    -- model that produced each row's feature_vector; existing rows get EMBEDDING_MODEL without a
+    -- table rewrite, and the default is dropped so every writer has to say which model it used
+    DO $$
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_attribute
+                       WHERE attrelid = 'fvector_pg'::regclass AND attname = 'model_id' AND NOT attisdropped) THEN
+            ALTER TABLE fvector_pg ADD COLUMN model_id TEXT NOT NULL DEFAULT '{initial_model}';
+            ALTER TABLE fvector_pg ALTER COLUMN model_id DROP DEFAULT;
+        END IF;
+    END $$;
+    CREATE TABLE IF NOT EXISTS fvector_embeddings (
+        model_id TEXT NOT NULL REFERENCES embedding_sets (model_id),
+        image_id INTEGER NOT NULL REFERENCES fvector_pg (id) ON DELETE CASCADE,
+        feature_vector vector NOT NULL,
+        created_at TIMESTAMP DEFAULT now(),
+        PRIMARY KEY (model_id, image_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_fvector_embeddings_image_id ON fvector_embeddings (image_id);
+    """
+    cur.execute(sql)
+
+
+def _migrate_style_index(cur):
+    """Index for style-number allow-lists (id and tenant allow-lists use the primary key / tenant index)."""
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_fvector_style_number ON fvector_pg (style_number)")
+
+
+# Per (tenant, style) counts maintained by statement-level triggers on fvector_pg, so
+# stats never scan the vector table. Each INSERT/UPDATE/DELETE statement folds its
+# transition table into one aggregate upsert (a 10k-row COPY is one upsert per key).
+# style_number NULL is stored as ''. stored_bytes is pg_column_size of the rows.
+CATALOG_STATS_SQL = """
+CREATE TABLE IF NOT EXISTS fvector_stats (
+    tenant_id TEXT NOT NULL,
+    style_number TEXT NOT NULL DEFAULT '',
+    images BIGINT NOT NULL DEFAULT 0,
+    stored_bytes BIGINT NOT NULL DEFAULT 0,
+    last_ingest_at TIMESTAMP,
+    PRIMARY KEY (tenant_id, style_number)
+);
+
+CREATE OR REPLACE FUNCTION fvector_stats_apply() RETURNS trigger AS $fn$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO fvector_stats AS s (tenant_id, style_number, images, stored_bytes, last_ingest_at)
+        SELECT tenant_id, coalesce(style_number, ''), count(*), sum(pg_column_size(n.*)), now()
+        FROM new_rows n GROUP BY 1, 2 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, style_number) DO UPDATE
+        SET images = s.images + EXCLUDED.images,
+            stored_bytes = s.stored_bytes + EXCLUDED.stored_bytes,
+            last_ingest_at = EXCLUDED.last_ingest_at;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- rows can move between keys (tenant/style edits) and change size
+        INSERT INTO fvector_stats AS s (tenant_id, style_number, images, stored_bytes)
+        SELECT tenant_id, style_number, sum(images), sum(stored_bytes)
+        FROM (
+            SELECT tenant_id, coalesce(style_number, '') AS style_number, 1 AS images, pg_column_size(n.*) AS stored_bytes FROM new_rows n
+            UNION ALL
+            SELECT tenant_id, coalesce(style_number, ''), -1, -pg_column_size(o.*) FROM old_rows o
+        ) d
+        GROUP BY 1, 2 HAVING sum(images) <> 0 OR sum(stored_bytes) <> 0 ORDER BY 1, 2
+        ON CONFLICT (tenant_id, style_number) DO UPDATE
+        SET images = s.images + EXCLUDED.images,
+            stored_bytes = s.stored_bytes + EXCLUDED.stored_bytes;
+        DELETE FROM fvector_stats s
+        USING (SELECT DISTINCT tenant_id, coalesce(style_number, '') AS style_number FROM old_rows) d
+        WHERE s.tenant_id = d.tenant_id AND s.style_number = d.style_number AND s.images <= 0;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE fvector_stats s
+        SET images = s.images - d.images, stored_bytes = s.stored_bytes - d.stored_bytes
+        FROM (
+            SELECT tenant_id, coalesce(style_number, '') AS style_number, count(*) AS images,
+                   sum(pg_column_size(o.*)) AS stored_bytes
+            FROM old_rows o GROUP BY 1, 2
+        ) d
+        WHERE s.tenant_id = d.tenant_id AND s.style_number = d.style_number;
+        DELETE FROM fvector_stats s
+        USING (SELECT DISTINCT tenant_id, coalesce(style_number, '') AS style_number FROM old_rows) d
+        WHERE s.tenant_id = d.tenant_id AND s.style_number = d.style_number AND s.images <= 0;
+    ELSE  -- TRUNCATE
+        DELETE FROM fvector_stats;
+    END IF;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS fvector_stats_insert ON fvector_pg;
+DROP TRIGGER IF EXISTS fvector_stats_update ON fvector_pg;
+DROP TRIGGER IF EXISTS fvector_stats_delete ON fvector_pg;
+DROP TRIGGER IF EXISTS fvector_stats_truncate ON fvector_pg;
+CREATE TRIGGER fvector_stats_insert AFTER INSERT ON fvector_pg
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION fvector_stats_apply();
+CREATE TRIGGER fvector_stats_update AFTER UPDATE ON fvector_pg
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION fvector_stats_apply();
+CREATE TRIGGER fvector_stats_delete AFTER DELETE ON fvector_pg
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION fvector_stats_apply();
+CREATE TRIGGER fvector_stats_truncate AFTER TRUNCATE ON fvector_pg
+    FOR EACH STATEMENT EXECUTE FUNCTION fvector_stats_apply();
+"""
+
+
+# Migration 5 replaces the UPDATE trigger above: a statement trigger with transition
+# tables copies every updated row (a feature_bits or halfvec backfill copies the
+# whole table), and Postgres allows no column list on such triggers. The row
+# trigger below fires only for updates that set tenant_id, style_number or
+# feature_vector and change the row's key or size, and moves it between keys.
+CATALOG_STATS_UPDATE_SQL = """
+CREATE OR REPLACE FUNCTION fvector_stats_move() RETURNS trigger AS $fn$
+DECLARE
+    old_style TEXT := coalesce(OLD.style_number, '');
+    new_style TEXT := coalesce(NEW.style_number, '');
+    old_bytes BIGINT := pg_column_size(OLD.*);
+    new_bytes BIGINT := pg_column_size(NEW.*);
+BEGIN
+    IF OLD.tenant_id = NEW.tenant_id AND old_style = new_style THEN
+        UPDATE fvector_stats SET stored_bytes = stored_bytes + new_bytes - old_bytes
+        WHERE tenant_id = NEW.tenant_id AND style_number = new_style;
+        RETURN NULL;
+    END IF;
+    -- both keys in one upsert, in key order like the statement triggers
+    INSERT INTO fvector_stats AS s (tenant_id, style_number, images, stored_bytes, last_ingest_at)
+    SELECT * FROM (VALUES
+        (NEW.tenant_id, new_style, 1, new_bytes, NEW.date_created),
+        (OLD.tenant_id, old_style, -1, -old_bytes, NULL::timestamp)
+    ) d ORDER BY 1, 2
+    ON CONFLICT (tenant_id, style_number) DO UPDATE
+    SET images = s.images + EXCLUDED.images,
+        stored_bytes = s.stored_bytes + EXCLUDED.stored_bytes,
+        last_ingest_at = greatest(s.last_ingest_at, EXCLUDED.last_ingest_at);
+    DELETE FROM fvector_stats
+    WHERE tenant_id = OLD.tenant_id AND style_number = old_style AND images <= 0;
+    RETURN NULL;
+END
+$fn$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS fvector_stats_update ON fvector_pg;
+CREATE TRIGGER fvector_stats_update AFTER UPDATE OF tenant_id, style_number, feature_vector ON fvector_pg
+    FOR EACH ROW WHEN (
+        OLD.tenant_id IS DISTINCT FROM NEW.tenant_id
+        OR OLD.style_number IS DISTINCT FROM NEW.style_number
+        OR pg_column_size(OLD.*) <> pg_column_size(NEW.*)
+    ) EXECUTE FUNCTION fvector_stats_move();
+"""
+
+
+def _stats_installed(cur) -> bool:
+    cur.execute("""
+    SELECT 1 FROM pg_trigger
+    WHERE tgrelid = 'fvector_pg'::regclass AND tgname = 'fvector_stats_insert'
+    """)
+    return cur.fetchone() is not None
+
+
+def _recount_catalog_stats(cur):
+    """Recompute fvector_stats from fvector_pg (one full scan); the caller holds a write-blocking lock."""
+    cur.execute("""
+    DELETE FROM fvector_stats;
+    INSERT INTO fvector_stats (tenant_id, style_number, images, stored_bytes, last_ingest_at)
+    SELECT tenant_id, coalesce(style_number, ''), count(*), sum(pg_column_size(f.*)), max(date_created)
+    FROM fvector_pg f GROUP BY 1, 2;
+    """)
+
+
+def _install_catalog_stats(cur):
+    """Create fvector_stats and its triggers and fill it, once; later calls only check the trigger."""
+    if _stats_installed(cur):
+        return
+    # block writes so no row is counted twice or missed between the backfill and the triggers
+    cur.execute("LOCK TABLE fvector_pg IN SHARE ROW EXCLUSIVE MODE")
+    if _stats_installed(cur):
+        return
+    cur.execute(CATALOG_STATS_SQL)
+    _recount_catalog_stats(cur)
+
+
+def _migrate_stats_update_trigger(cur):
+    """Replace the statement-level UPDATE trigger of fvector_stats (see CATALOG_STATS_UPDATE_SQL)."""
+    cur.execute("LOCK TABLE fvector_pg IN SHARE ROW EXCLUSIVE MODE")
+    cur.execute(CATALOG_STATS_UPDATE_SQL)
+    _recount_catalog_stats(cur)  # also sets last_ingest_at of keys the old trigger created without it
+
+
+# Schema migrations, applied in order and recorded in schema_migrations. Versions
+# 1-3 are idempotent (IF NOT EXISTS), so databases created before versioning take
+# them as no-ops; append new steps with the next version and never edit applied ones.
+MIGRATIONS = [
+    (1, 'vector and job tables', _migrate_base),
+    (2, 'catalog stats triggers', _install_catalog_stats),
+    (3, 'embedding sets', _migrate_embedding_sets),
+    (4, 'style number index', _migrate_style_index),
+    (5, 'catalog stats row update trigger', _migrate_stats_update_trigger),
+]
+MIGRATION_LOCK_KEY = 0x66766563  # pg_advisory_lock key: one process migrates at a time
+
+_schema_ready = False
+
+
+def migrate() -> List[int]:
+    """
+    Apply pending schema migrations, each in its own transaction, under an advisory
+    lock so that processes starting together do not race. Requires the pgvector
+    extension in the database.
+
+    Returns:
+        Versions applied by this call
+    """
+    applied_now = []
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        version INTEGER PRIMARY KEY,
+                        name TEXT NOT NULL,
+                        applied_at TIMESTAMP DEFAULT now()
+                    )
+                    """)
+                    cur.execute("SELECT version FROM schema_migrations")
+                    applied = {row[0] for row in cur.fetchall()}
+            for version, name, step in MIGRATIONS:
+                if version in applied:
+                    continue
+                with conn:
+                    with conn.cursor() as cur:
+                        step(cur)
+                        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                applied_now.append(version)
+        finally:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_KEY,))
+    finally:
+        conn.close()
+    if applied_now:
+        forget_active_model()  # the fallback cached before embedding_sets existed
+    return applied_now
+
+
+def schema_version() -> Dict:
+    """Latest applied migration and the versions this code knows of but the database lacks."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+                applied = set()
+                if cur.fetchone()[0]:
+                    cur.execute("SELECT version FROM schema_migrations")
+                    applied = {row[0] for row in cur.fetchall()}
+    finally:
+        conn.close()
+    return {
+        'version': max(applied) if applied else 0,
+        'pending': [version for version, _, _ in MIGRATIONS if version not in applied],
+    }
+
+
+def init_table():
+    """Bring the schema up to date (`migrate`) once per process; later calls return at once.
+
+    Called at server startup and by the CLI scripts, not per request. With
+    VECTOR_STORAGE=halfvec a new table stores halfvec(PGVECTOR_DIM); an existing
+    table keeps its column type (convert it with migrate_halfvec.py).
     """
+    global _schema_ready
+    if not _schema_ready:
+        migrate()
+        _schema_ready = True
+
+
+def rebuild_catalog_stats():
+    """Recount fvector_stats from scratch, blocking writes for the duration of one scan."""
     conn = get_conn()
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql)
+                cur.execute("LOCK TABLE fvector_pg IN SHARE ROW EXCLUSIVE MODE")
+                _recount_catalog_stats(cur)
     finally:
         conn.close()
 
 
-def upsert_vector(tenant_id, style_number, image_url, vector):
+def _to_vector_text(vector) -> str:
+    """Format a 1D vector as a pgvector text literal."""
+    return '[' + ','.join(f"{float(v):.6f}" for v in vector) + ']'
+
+
+def _to_phash_db(phash: Optional[int]) -> Optional[int]:
+    """Map an unsigned 64-bit hash onto Postgres' signed BIGINT range."""
+    if phash is None:
+        return None
+    return phash - (1 << 64) if phash >= (1 << 63) else phash
+
+
+def _from_phash_db(value: Optional[int]) -> Optional[int]:
+    return None if value is None else value & 0xFFFFFFFFFFFFFFFF
+
+
+def _insert_vectors(cur, vectors_data: List[Dict]) -> List[int]:
+    """Insert rows with one multi-row INSERT on an open cursor. Returns ids in input order.
+
+    Rows without a `model_id` are stamped with the active model (the one the
+    embedding functions use by default).
+    """
+    model_id = active_model_id()
+    rows = [
+        (
+            data['tenant_id'],
+            data.get('style_number', ''),
+            data['image_url'],
+            _to_vector_text(data['feature_vector']),
+            data.get('etag'),
+            _to_phash_db(data.get('phash')),
+            data.get('model_id') or model_id,
+        )
+        for data in vectors_data
+    ]
+    sql = """
+    INSERT INTO fvector_pg (tenant_id, style_number, image_url, feature_vector, etag, phash, model_id, date_created)
+    VALUES %s
+    RETURNING id;
+    """
+    result = execute_values(cur, sql, rows, template="(%s, %s, %s, %s::vector, %s, %s, %s, now())", page_size=len(rows) or 1, fetch=True)
+    return [r[0] for r in result]
+
+
+def upsert_vector(tenant_id, style_number, image_url, vector, phash: Optional[int] = None):
     """Insert vector into Postgres. `vector` is a 1D numpy array or list of floats.
+    `phash` is the optional 64-bit perceptual hash of the image.
+    The row is stamped with the active model (see `active_model_id`).
     Returns the id of the inserted row.
     """
-    vec_list = list(map(float, vector))
-    vec_text = '[' + ','.join(f"{v:.6f}" for v in vec_list) + ']'
+    vec_text = _to_vector_text(vector)
 
     sql = """
-    INSERT INTO fvector_pg (tenant_id, style_number, image_url, feature_vector, date_created)
-    VALUES (%s, %s, %s, %s::vector, now())
+    INSERT INTO fvector_pg (tenant_id, style_number, image_url, feature_vector, phash, model_id, date_created)
+    VALUES (%s, %s, %s, %s::vector, %s, %s, now())
     RETURNING id;
     """
+    model_id = active_model_id()
     conn = get_conn()
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (tenant_id, style_number, image_url, vec_text))
+                cur.execute(sql, (tenant_id, style_number, image_url, vec_text, _to_phash_db(phash), model_id))
                 result = cur.fetchone()
                 return result[0] if result else None
     finally:
@@ -97,7 +604,221 @@ def fetch_vectors(tenant_id: Optional[str] = None, style_number: Optional[str] =
     return rows
 
 
-def search_similar_vectors(query_vector, top_k: int = 10, style_number: Optional[str] = None, exclude_tenant_id: Optional[str] = None) -> List[Dict]:
+def fetch_image_urls(tenant_id: Optional[str] = None) -> set:
+    """Return the set of stored image_urls (no vectors), optionally for one tenant."""
+    sql = "SELECT image_url FROM fvector_pg"
+    params = None
+    if tenant_id:
+        sql += " WHERE tenant_id = %s"
+        params = (tenant_id,)
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                return {row[0] for row in cur}
+    finally:
+        conn.close()
+
+
+def fetch_phashes(tenant_id: str) -> List[tuple]:
+    """Return (id, phash) for every row of a tenant that has a perceptual hash."""
+    sql = "SELECT id, phash FROM fvector_pg WHERE tenant_id = %s AND phash IS NOT NULL"
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (tenant_id,))
+                return [(row_id, _from_phash_db(value)) for row_id, value in cur]
+    finally:
+        conn.close()
+
+
+# Columns `get_vectors_by_ids` can project; feature_vector is only read when asked for
+VECTOR_FIELDS = ('id', 'tenant_id', 'style_number', 'image_url', 'etag', 'phash', 'date_created', 'model_id', 'feature_vector')
+METADATA_FIELDS = VECTOR_FIELDS[:-1]
+
+
+def get_vectors_by_ids(ids: List[int], fields: Optional[List[str]] = None) -> List[Dict]:
+    """Batch lookup of rows by primary key, in one query.
+
+    Args:
+        ids: Row ids; missing ids are left out of the result
+        fields: Columns to return (see VECTOR_FIELDS; `id` is always included).
+                Defaults to all metadata columns, i.e. everything but feature_vector.
+
+    Returns:
+        Row dicts in the order of `ids`; feature_vector (if requested) as a float32 array
+    """
+    if not ids:
+        return []
+    fields = list(fields) if fields else list(METADATA_FIELDS)
+    unknown = set(fields) - set(VECTOR_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    columns = ['id'] + [f for f in VECTOR_FIELDS if f in fields and f != 'id']
+    select = ', '.join('feature_vector::text AS feature_vector' if c == 'feature_vector' else c for c in columns)
+    sql = f"SELECT {select} FROM fvector_pg WHERE id = ANY(%s)"
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, (list(ids),))
+                rows = {row['id']: _decode_row(row) for row in cur.fetchall()}
+    finally:
+        conn.close()
+    return [rows[i] for i in dict.fromkeys(ids) if i in rows]
+
+
+def _parse_vector(text: str) -> np.ndarray:
+    """pgvector text form '[0.1,0.2,...]' -> float32 array."""
+    return np.fromstring(text[1:-1], dtype=np.float32, sep=',')
+
+
+def _decode_row(row) -> Dict:
+    row = dict(row)
+    if 'phash' in row:
+        row['phash'] = _from_phash_db(row['phash'])
+    if row.get('feature_vector') is not None:
+        row['feature_vector'] = _parse_vector(row['feature_vector'])
+    return row
+
+
+def iter_vector_batches(tenant_id: Optional[str] = None, style_number: Optional[str] = None,
+                        fields: Optional[List[str]] = None, fetch_size: Optional[int] = None,
+                        after_id: Optional[int] = None, buckets: Optional[tuple] = None,
+                        changed_since: Optional[int] = None) -> Iterator[List[Dict]]:
+    """Stream rows ordered by id in batches of `fetch_size` (default VECTOR_FETCH_SIZE).
+
+    Backed by a named (server-side) cursor, so only one batch is ever held in
+    memory; all batches come from one snapshot. Rows look like those of
+    `get_vectors_by_ids`, and `fields` defaults to every column including the vector.
+    `after_id` only returns rows with a higher id, `changed_since` only rows
+    inserted or updated since that `change_horizon()` (incremental reads), and
+    `buckets=(key, count, [bucket, ...])` only rows in those buckets (see `bucket_sql`).
+    """
+    fields = list(fields) if fields else list(VECTOR_FIELDS)
+    unknown = set(fields) - set(VECTOR_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(sorted(unknown))}")
+    columns = ['id'] + [f for f in VECTOR_FIELDS if f in fields and f != 'id']
+    select = ', '.join('feature_vector::text AS feature_vector' if c == 'feature_vector' else c for c in columns)
+
+    conditions = []
+    params = []
+    if tenant_id:
+        conditions.append("tenant_id = %s")
+        params.append(tenant_id)
+    if style_number:
+        conditions.append("style_number = %s")
+        params.append(style_number)
+    if after_id is not None:
+        conditions.append("id > %s")
+        params.append(after_id)
+    if changed_since is not None:
+        # xmin is the 32-bit id of the transaction that wrote the row version;
+        # comparing ages keeps the test right across xid wraparound
+        conditions.append("age(xmin) <= age((%s::bigint %% 4294967296)::text::xid)")
+        params.append(changed_since)
+    if buckets is not None:
+        key, count, wanted = buckets
+        conditions.append(f"{bucket_sql(key, count)} = ANY(%s)")
+        params.append(list(wanted))
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    sql = f"SELECT {select} FROM fvector_pg{where_clause} ORDER BY id"
+    fetch_size = fetch_size or int(settings.VECTOR_FETCH_SIZE)
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(name='iter_vectors', cursor_factory=RealDictCursor) as cur:
+                cur.itersize = fetch_size
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(fetch_size)
+                    if not rows:
+                        break
+                    yield [_decode_row(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def change_horizon() -> int:
+    """
+    Commit-safe watermark for incremental reads: the oldest transaction id still
+    running. Every transaction below it has finished, so a read started after
+    this call sees all of their rows, and `iter_vector_batches(changed_since=...)`
+    with it later returns every row written since, whatever order ids were
+    allocated and committed in. (Ids alone are not safe: SERIAL values are
+    handed out before commit, so a lower id can commit after a higher one.)
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+                return int(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+
+def bucket_sql(key: str, count: int) -> str:
+    """
+    SQL for a row's shard bucket: id % count, or the first 32 bits of md5(tenant_id)
+    % count. Must agree with app.utils.shards.bucket_of.
+    """
+    if key == 'id':
+        return f"(id %% {int(count)})"
+    if key == 'tenant':
+        return f"((('x' || substr(md5(tenant_id), 1, 8))::bit(32)::bigint) %% {int(count)})"
+    raise ValueError(f"unknown bucket key: {key}")
+
+
+def sample_vectors(limit: int) -> np.ndarray:
+    """Up to `limit` random stored vectors as a float32 matrix (for training quantizers)."""
+    sql = """
+    SELECT feature_vector::text FROM fvector_pg
+    WHERE feature_vector IS NOT NULL
+    ORDER BY random()
+    LIMIT %s
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (limit,))
+                rows = cur.fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.stack([_parse_vector(row[0]) for row in rows])
+
+
+def iter_vectors(tenant_id: Optional[str] = None, style_number: Optional[str] = None,
+                 fields: Optional[List[str]] = None, fetch_size: Optional[int] = None) -> Iterator[Dict]:
+    """Stream rows one at a time (see `iter_vector_batches`)."""
+    for batch in iter_vector_batches(tenant_id, style_number, fields, fetch_size):
+        yield from batch
+
+
+def get_vector_by_id(image_id: int, fields: Optional[List[str]] = None) -> Optional[Dict]:
+    """Point lookup by id (see `get_vectors_by_ids`). Returns None if not found."""
+    rows = get_vectors_by_ids([image_id], fields)
+    return rows[0] if rows else None
+
+
+def fetch_feature_vectors(ids: List[int]) -> Dict[int, np.ndarray]:
+    """Return {id: float32 vector} for the given ids (missing ids are left out)."""
+    return {row['id']: row['feature_vector'] for row in get_vectors_by_ids(ids, ['feature_vector'])}
+
+
+def search_similar_vectors(query_vector, top_k: int = 10, style_number: Optional[str] = None, exclude_tenant_id: Optional[str] = None, group_by_style: bool = False,
+                           retrieval: str = 'exact', rerank_factor: Optional[int] = None,
+                           image_ids: Optional[List[int]] = None, style_numbers: Optional[List[str]] = None,
+                           tenant_ids: Optional[List[str]] = None) -> List[Dict]:
     """
     Search for similar vectors using cosine similarity in PostgreSQL with pgvector.
     Searches ACROSS ALL tenants to find the most similar images.
@@ -107,12 +828,24 @@ def search_similar_vectors(query_vector, top_k: int = 10, style_number: Optional
         top_k: Number of top similar results to return
         style_type: Optional style type to filter by
         exclude_tenant_id: Optional tenant ID to exclude from results 
+        group_by_style: Return only the best image per (tenant_id, style_number),
+                        for the top_k groups (see `_search_grouped`)
+        retrieval: 'exact' ranks all rows by cosine distance; 'binary' first
+                   shortlists rows by Hamming distance of the sign bits, then ranks
+                   the shortlist exactly (see `_binary_shortlist`)
+        rerank_factor: Shortlist size as a multiple of the rows needed
+                       (default BINARY_RERANK_FACTOR)
+        image_ids, style_numbers, tenant_ids: Allow-lists; when any is given only rows
+                       matching all given lists are ranked, by an exact scan over just
+                       those rows (no ANN index or binary shortlist, so nothing is
+                       filtered away after retrieval). An empty list matches nothing.
         
     Returns:
         List of dicts with tenant_id, style_type, image_url, similarity_score, rank
+        (plus group_matches when grouped)
     """
     vec_list = list(map(float, query_vector))
-    vec_text = '[' + ','.join(f"{v:.6f}" for v in vec_list) + ']'
+    vec_text = _to_vector_text(vec_list)
     
     # Build query with cosine similarity (1 - cosine_distance)
     # pgvector's <=> operator computes cosine distance, so similarity = 1 - distance
@@ -126,74 +859,212 @@ def search_similar_vectors(query_vector, top_k: int = 10, style_number: Optional
     if style_number:
         conditions.append("style_number = %s")
         params.append(style_number)
+
+    allow_lists = [("id", image_ids), ("style_number", style_numbers), ("tenant_id", tenant_ids)]
+    subset = any(values is not None for _, values in allow_lists)
+    for column, values in allow_lists:
+        if values is not None:
+            if not values:
+                return []
+            conditions.append(f"{column} = ANY(%s)")
+            params.append([int(v) for v in values] if column == "id" else list(values))
     
     where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    # the query must have the column's type for the ANN index to be used
+    cast = vector_column_type()
+
+    check_retrieval(retrieval)
+    if subset:
+        retrieval = 'exact'
+    factor = max(int(rerank_factor or settings.BINARY_RERANK_FACTOR), 1)
+    bits = _sign_bits(vec_list) if retrieval == 'binary' else None
+
+    def source(limit: int) -> tuple:
+        """(FROM clause, its params, rows scanned by the index) for ranking `limit` rows."""
+        if subset:
+            # OFFSET 0 keeps the subquery from being flattened, so the ranking cannot turn
+            # into an HNSW scan that filters afterwards: the allowed rows are scanned exactly
+            sql = f"""(
+                SELECT id, tenant_id, style_number, image_url, feature_vector
+                FROM fvector_pg{where_clause}
+                OFFSET 0
+            ) fvector_pg"""
+            return sql, list(params), limit
+        if bits is None:
+            return f"fvector_pg{where_clause}", list(params), limit
+        shortlist = limit * factor
+        return _binary_shortlist(where_clause, params, bits, shortlist) + (shortlist,)
     
-    sql = f"""
-    SELECT 
-        id,
-        tenant_id,
-        style_number,
-        image_url,
-        1 - (feature_vector <=> %s::vector) as similarity_score
-    FROM fvector_pg
-    {where_clause}
-    ORDER BY feature_vector <=> %s::vector
-    LIMIT %s;
-    """
-    
-    conn = get_conn()
-    try:
-        with conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute(sql, [vec_text] + params + [vec_text, top_k])
-                rows = cur.fetchall()
-    finally:
-        conn.close()
+    if group_by_style:
+        rows = _search_grouped(vec_text, source, top_k, retrieval)
+    else:
+        from_clause, from_params, scanned = source(top_k)
+        sql = f"""
+        SELECT 
+            id,
+            tenant_id,
+            style_number,
+            image_url,
+            1 - (feature_vector <=> %s::{cast}) as similarity_score
+        FROM {from_clause}
+        ORDER BY feature_vector <=> %s::{cast}
+        LIMIT %s;
+        """
+        
+        conn = get_conn()
+        try:
+            with conn:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    _set_ann_limit(cur, scanned, retrieval)
+                    cur.execute(sql, [vec_text] + from_params + [vec_text, top_k])
+                    rows = cur.fetchall()
+        finally:
+            conn.close()
     
     # Add rank to results
     results = []
     for rank, row in enumerate(rows, start=1):
-        results.append({
+        result = {
             'id': row['id'],
             'tenant_id': row['tenant_id'],
             'style_number': row.get('style_number'),
             'image_url': row['image_url'],
             'similarity_score': float(row['similarity_score']),
             'rank': rank
-        })
+        }
+        if group_by_style:
+            result['group_matches'] = row['group_matches']
+        results.append(result)
     
     return results
 
 
+def _sign_bits(vector) -> str:
+    """Sign-bit quantization of a vector as a bit string literal (1 for positive components)."""
+    return ''.join('1' if v > 0 else '0' for v in vector)
+
+
+def _binary_shortlist(where_clause: str, params: List, bits: str, size: int) -> tuple:
+    """
+    FROM clause selecting the `size` rows nearest to `bits` by Hamming distance.
+
+    The subquery is aliased fvector_pg, so the exact ranking runs on it unchanged.
+    pgvector >= 0.7 provides `<~>` (served by an HNSW bit_hamming_ops index if one
+    was built); older versions fall back to bit_count(a # b) on a sequential scan,
+    which is still far cheaper per row than cosine on the full vector.
+    """
+    if pgvector_version() >= (0, 7):
+        distance = f"feature_bits <~> %s::bit({len(bits)})"
+    else:
+        distance = f"bit_count(feature_bits # %s::bit({len(bits)}))"
+    sql = f"""(
+        SELECT id, tenant_id, style_number, image_url, feature_vector
+        FROM fvector_pg{where_clause}
+        ORDER BY {distance}
+        LIMIT %s
+    ) AS fvector_pg"""
+    return sql, list(params) + [bits, size]
+
+
+def _set_ann_limit(cur, limit: int, retrieval: str = 'exact'):
+    """
+    Let an HNSW scan return `limit` rows (it stops at hnsw.ef_search candidates).
+
+    Only applies where an HNSW index can exist: halfvec storage, or the sign bits on
+    pgvector >= 0.7. Filters (tenant/style) are applied to the candidates, so a
+    selective filter can still return fewer rows than asked for; HNSW_EF_SEARCH
+    raises the floor.
+    """
+    if retrieval == 'binary':
+        indexed = pgvector_version() >= (0, 7)
+    else:
+        indexed = vector_column_type() == 'halfvec'
+    if indexed:
+        ef_search = min(max(int(settings.HNSW_EF_SEARCH), limit), 1000)  # pgvector's maximum
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (ef_search,))
+
+
+def _search_grouped(vec_text: str, source: Callable[[int], tuple], top_k: int, retrieval: str = 'exact') -> List[Dict]:
+    """
+    Best match per (tenant_id, style_number) for the top_k groups.
+
+    Fetches the nearest `top_k * SEARCH_GROUP_OVERFETCH` rows (an ordinary
+    ORDER BY distance LIMIT, so an ANN index still applies), collapses them with
+    DISTINCT ON and keeps the top_k groups. If that yields fewer than top_k
+    groups while the candidate set was full, the over-fetch grows (x4) up to
+    SEARCH_GROUP_MAX_FETCH rows. Rows without a style_number are their own group.
+    `group_matches` is how many of the candidates fell into the group.
+    `source(fetch)` gives the FROM clause the candidates are ranked from.
+    """
+    cast = vector_column_type()
+    sql = """
+    WITH candidates AS (
+        SELECT id, tenant_id, style_number, image_url,
+               feature_vector <=> %s::{cast} AS distance,
+               COALESCE(NULLIF(style_number, ''), '#' || id::text) AS group_key
+        FROM {from_clause}
+        ORDER BY feature_vector <=> %s::{cast}
+        LIMIT %s
+    ), best AS (
+        SELECT DISTINCT ON (tenant_id, group_key)
+               id, tenant_id, style_number, image_url, distance,
+               count(*) OVER (PARTITION BY tenant_id, group_key) AS group_matches
+        FROM candidates
+        ORDER BY tenant_id, group_key, distance
+    )
+    SELECT id, tenant_id, style_number, image_url, group_matches,
+           1 - distance AS similarity_score,
+           (SELECT count(*) FROM candidates) AS fetched
+    FROM best
+    ORDER BY distance
+    LIMIT %s;
+    """
+    fetch = max(top_k * int(settings.SEARCH_GROUP_OVERFETCH), top_k)
+    max_fetch = max(int(settings.SEARCH_GROUP_MAX_FETCH), top_k)
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                while True:
+                    fetch = min(fetch, max_fetch)
+                    from_clause, from_params, scanned = source(fetch)
+                    _set_ann_limit(cur, scanned, retrieval)
+                    cur.execute(sql.format(cast=cast, from_clause=from_clause),
+                                [vec_text] + from_params + [vec_text, fetch, top_k])
+                    rows = cur.fetchall()
+                    saturated = bool(rows) and rows[0]['fetched'] >= fetch
+                    if len(rows) >= top_k or not saturated or fetch >= max_fetch:
+                        return rows
+                    fetch *= 4
+    finally:
+        conn.close()
+
+
 def delete_vector(image_id: int) -> Optional[str]:
     """Delete a vector row by id.
     Returns the deleted row's image_url or None if not found.
     """
-    sql_select = "SELECT image_url FROM fvector_pg WHERE id = %s"
-    sql_delete = "DELETE FROM fvector_pg WHERE id = %s"
+    sql = "DELETE FROM fvector_pg WHERE id = %s RETURNING image_url"
 
     conn = get_conn()
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql_select, (image_id,))
+                cur.execute(sql, (image_id,))
                 row = cur.fetchone()
-                if not row:
-                    return None
-                image_url = row[0]
-                cur.execute(sql_delete, (image_id,))
     finally:
         conn.close()
-    return image_url
+    return row[0] if row else None
 
 
-def update_vector(image_id: int, tenant_id: str, style_number: str, image_url: str, vector):
+def update_vector(image_id: int, tenant_id: str, style_number: str, image_url: str, vector, phash: Optional[int] = None):
     """Update an existing vector by id.
+    The row's vectors in other embedding sets were computed from the old image and
+    are deleted (a running re-embed job picks the row up again).
     Returns True if successful, False if image_id not found.
     """
-    vec_list = list(map(float, vector))
-    vec_text = '[' + ','.join(f"{v:.6f}" for v in vec_list) + ']'
+    vec_text = _to_vector_text(vector)
     
     sql = """
     UPDATE fvector_pg 
@@ -201,37 +1072,49 @@ def update_vector(image_id: int, tenant_id: str, style_number: str, image_url: s
         style_number = %s, 
         image_url = %s, 
         feature_vector = %s::vector, 
+        phash = %s,
+        model_id = %s,
+        etag = NULL,
         date_created = now()
     WHERE id = %s
     RETURNING image_url;
     """
-    
+    model_id = active_model_id()
     conn = get_conn()
     try:
         with conn:
             with conn.cursor() as cur:
-                cur.execute(sql, (tenant_id, style_number, image_url, vec_text, image_id))
+                cur.execute(sql, (tenant_id, style_number, image_url, vec_text, _to_phash_db(phash), model_id, image_id))
                 result = cur.fetchone()
+                cur.execute("DELETE FROM fvector_embeddings WHERE image_id = %s", (image_id,))
                 return result is not None
     finally:
         conn.close()
 
 
-def get_vector_count(tenant_id: Optional[str] = None) -> int:
+def get_vector_count(tenant_id: Optional[str] = None, style_number: Optional[str] = None) -> int:
     """Get the total count of vectors in the database.
-    
+
+    Read from the trigger-maintained fvector_stats table, so it is exact without
+    scanning fvector_pg.
+
     Args:
         tenant_id: Optional tenant ID to filter count
+        style_number: Optional style number to filter count
         
     Returns:
         Count of vectors
     """
+    conditions = []
+    params = []
     if tenant_id:
-        sql = "SELECT COUNT(*) FROM fvector_pg WHERE tenant_id = %s"
-        params = (tenant_id,)
-    else:
-        sql = "SELECT COUNT(*) FROM fvector_pg"
-        params = None
+        conditions.append("tenant_id = %s")
+        params.append(tenant_id)
+    if style_number:
+        conditions.append("style_number = %s")
+        params.append(style_number)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    sql = f"SELECT COALESCE(SUM(images), 0)::bigint FROM fvector_stats{where_clause}"
     
     conn = get_conn()
     try:
@@ -244,11 +1127,66 @@ def get_vector_count(tenant_id: Optional[str] = None) -> int:
     return count
 
 
-def bulk_upsert_vectors(vectors_data: List[Dict]):
-    """
-    Bulk insert multiple vectors into the database.
-    
-    Args:
+def estimate_vector_count() -> int:
+    """Planner row estimate for fvector_pg (pg_class.reltuples): no table access at all."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = 'fvector_pg'::regclass")
+                row = cur.fetchone()
+    finally:
+        conn.close()
+    return max(int(row[0]), 0) if row else 0  # -1 until the table is first analyzed
+
+
+def get_catalog_stats(tenant_id: Optional[str] = None, limit: int = 100) -> Dict:
+    """Catalog statistics from fvector_stats.
+
+    Args:
+        tenant_id: Per-style breakdown of this tenant instead of the per-tenant list
+        limit: Largest tenants (or styles) to list, by image count
+
+    Returns:
+        Totals (images, stored_bytes, tenants, styles, last_ingest_at) and a
+        `by_tenant` (or, for one tenant, `by_style`) list with the same fields per entry
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                where_clause, params = ("WHERE tenant_id = %s", [tenant_id]) if tenant_id else ("", [])
+                cur.execute(f"""
+                SELECT COALESCE(SUM(images), 0)::bigint AS images, COALESCE(SUM(stored_bytes), 0)::bigint AS stored_bytes,
+                       COUNT(DISTINCT tenant_id) AS tenants, COUNT(*) AS styles, MAX(last_ingest_at) AS last_ingest_at
+                FROM fvector_stats {where_clause}
+                """, params)
+                totals = dict(cur.fetchone())
+                if tenant_id:
+                    cur.execute("""
+                    SELECT NULLIF(style_number, '') AS style_number, images, stored_bytes, last_ingest_at
+                    FROM fvector_stats WHERE tenant_id = %s
+                    ORDER BY images DESC, style_number LIMIT %s
+                    """, (tenant_id, limit))
+                    totals['by_style'] = [dict(r) for r in cur.fetchall()]
+                else:
+                    cur.execute("""
+                    SELECT tenant_id, SUM(images)::bigint AS images, SUM(stored_bytes)::bigint AS stored_bytes,
+                           COUNT(*) AS styles, MAX(last_ingest_at) AS last_ingest_at
+                    FROM fvector_stats GROUP BY tenant_id
+                    ORDER BY images DESC, tenant_id LIMIT %s
+                    """, (limit,))
+                    totals['by_tenant'] = [dict(r) for r in cur.fetchall()]
+    finally:
+        conn.close()
+    return totals
+
+
+def bulk_upsert_vectors(vectors_data: List[Dict]):
+    """
+    Bulk insert multiple vectors into the database.
+    
+    Args:
         vectors_data: List of dicts with keys: tenant_id, style_number, image_url, feature_vector
     
     Returns:
@@ -257,30 +1195,652 @@ def bulk_upsert_vectors(vectors_data: List[Dict]):
     if not vectors_data:
         return []
     
-    sql = """
-    INSERT INTO fvector_pg (tenant_id, style_number, image_url, feature_vector, date_created)
-    VALUES (%s, %s, %s, %s::vector, now())
-    RETURNING id;
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                inserted_ids = _insert_vectors(cur, vectors_data)
+    finally:
+        conn.close()
+    
+    return inserted_ids
+
+
+def replace_vectors(vectors_data: List[Dict], delete_ids: Optional[List[int]] = None) -> List[int]:
     """
+    Insert new vectors and delete superseded rows in one transaction.
     
+    Args:
+        vectors_data: List of dicts with keys: tenant_id, style_number, image_url, feature_vector, etag
+        delete_ids: Ids of rows the new vectors replace
+    
+    Returns:
+        List of inserted IDs
+    """
     conn = get_conn()
-    inserted_ids = []
     try:
         with conn:
             with conn.cursor() as cur:
-                for data in vectors_data:
-                    vec_list = list(map(float, data['feature_vector']))
-                    vec_text = '[' + ','.join(f"{v:.6f}" for v in vec_list) + ']'
-                    cur.execute(sql, (
-                        data['tenant_id'],
-                        data.get('style_number', ''),
-                        data['image_url'],
-                        vec_text
-                    ))
-                    result = cur.fetchone()
-                    if result:
-                        inserted_ids.append(result[0])
+                inserted_ids = _insert_vectors(cur, vectors_data) if vectors_data else []
+                if delete_ids:
+                    cur.execute("DELETE FROM fvector_pg WHERE id = ANY(%s)", (list(delete_ids),))
     finally:
         conn.close()
-    
     return inserted_ids
+
+
+def fetch_image_index(url_prefix: str = "") -> List[tuple]:
+    """
+    Return (id, image_url, etag) for every row whose image_url starts with `url_prefix`,
+    ordered by image_url and newest id first. Vectors are not read.
+    """
+    pattern = _like_prefix(url_prefix)
+    sql = """
+    SELECT id, image_url, etag FROM fvector_pg
+    WHERE image_url LIKE %s
+    ORDER BY image_url, id DESC;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (pattern,))
+                return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def set_vector_etags(id_etags: List[tuple]) -> int:
+    """Record storage ETags for existing rows. `id_etags` is a list of (id, etag)."""
+    if not id_etags:
+        return 0
+    sql = """
+    UPDATE fvector_pg AS f SET etag = v.etag
+    FROM (VALUES %s) AS v(id, etag)
+    WHERE f.id = v.id;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                execute_values(cur, sql, id_etags, template="(%s::int, %s::text)", page_size=len(id_etags))
+                return cur.rowcount
+    finally:
+        conn.close()
+
+
+def delete_vectors_by_ids(ids: List[int]) -> List[int]:
+    """Delete rows by id in a single statement. Returns the ids of the rows deleted."""
+    if not ids:
+        return []
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM fvector_pg WHERE id = ANY(%s) RETURNING id", (list(ids),))
+                return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def delete_vectors_returning(ids: List[int]) -> List[tuple]:
+    """Delete rows by id in a single statement.
+    Returns (id, image_url) of the rows that existed and were deleted.
+    """
+    if not ids:
+        return []
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM fvector_pg WHERE id = ANY(%s) RETURNING id, image_url", (list(ids),))
+                return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def _like_prefix(prefix: str) -> str:
+    """LIKE pattern matching strings that start with `prefix` (wildcards escaped)."""
+    return prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def iter_image_urls(url_prefix: str = "", batch_size: int = 5000) -> Iterator[tuple]:
+    """
+    Stream (id, image_url) for rows whose image_url starts with `url_prefix`,
+    ordered by image_url in byte order (COLLATE "C", the order S3 lists keys in).
+
+    Uses a server-side cursor, so memory stays at `batch_size` rows however
+    large the table is. The rows are a snapshot taken when iteration starts.
+    """
+    sql = """
+    SELECT id, image_url FROM fvector_pg
+    WHERE image_url COLLATE "C" LIKE %s
+    ORDER BY image_url COLLATE "C", id;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(name='iter_image_urls') as cur:
+                cur.itersize = batch_size
+                cur.execute(sql, (_like_prefix(url_prefix),))
+                yield from cur
+    finally:
+        conn.close()
+
+
+def filter_stored_urls(image_urls: List[str]) -> set:
+    """Return the subset of `image_urls` that at least one row points to."""
+    if not image_urls:
+        return set()
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT DISTINCT image_url FROM fvector_pg WHERE image_url = ANY(%s)", (list(image_urls),))
+                return {row[0] for row in cur.fetchall()}
+    finally:
+        conn.close()
+
+
+def delete_vectors_if_unchanged(id_urls: List[tuple]) -> List[int]:
+    """
+    Delete rows given as (id, image_url), but only those that still point at that URL
+    (a row re-pointed by update-image in the meantime is kept). Returns the ids deleted.
+    """
+    if not id_urls:
+        return []
+    sql = """
+    DELETE FROM fvector_pg f
+    USING (VALUES %s) AS v(id, image_url)
+    WHERE f.id = v.id AND f.image_url = v.image_url
+    RETURNING f.id;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                rows = execute_values(cur, sql, id_urls, page_size=1000, fetch=True)
+                return [row[0] for row in rows]
+    finally:
+        conn.close()
+
+
+_PG_EPOCH = datetime(2000, 1, 1)
+_COPY_SIGNATURE = b'PGCOPY\n\xff\r\n\x00'
+
+
+class _ChunkReader:
+    """Minimal file-like object over an iterator of byte strings, for copy_expert."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        # short reads are fine for copy_expert; b'' only at the very end
+        while self._pos >= len(self._buffer):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return b''
+            self._buffer, self._pos = chunk, 0
+        end = len(self._buffer) if size < 0 else self._pos + size
+        data = self._buffer[self._pos:end]
+        self._pos += len(data)
+        return data
+
+
+def _copy_binary_chunks(batches: Iterator[tuple], keep_ids: bool, counter: Dict,
+                        half: bool = False, model_id: str = '') -> Iterator[bytes]:
+    """Encode (vectors, metadata) batches in PostgreSQL's binary COPY format (`half` for a halfvec column).
+
+    Rows whose metadata has no model_id get `model_id`.
+    """
+    def text(value):
+        if value is None:
+            return b'\xff\xff\xff\xff'
+        data = str(value).encode('utf-8')
+        return struct.pack('!i', len(data)) + data
+
+    field_count = struct.pack('!h', 9 if keep_ids else 8)
+    null = b'\xff\xff\xff\xff'
+    yield _COPY_SIGNATURE + struct.pack('!ii', 0, 0)
+    for vectors, metadata in batches:
+        vectors = np.ascontiguousarray(vectors, dtype='>f2' if half else '>f4')
+        dim = vectors.shape[1]
+        # pgvector binary format: int16 dim, int16 unused, float4[dim] (float2 for halfvec)
+        vector_header = struct.pack('!ihh', 4 + vectors.itemsize * dim, dim, 0)
+        parts = []
+        for vector, meta in zip(vectors, metadata):
+            parts.append(field_count)
+            if keep_ids:
+                parts.append(struct.pack('!ii', 4, meta['id']))
+            parts += [text(meta['tenant_id']), text(meta.get('style_number')), text(meta.get('image_url'))]
+            parts += [vector_header, vector.tobytes(), text(meta.get('etag'))]
+            phash = _to_phash_db(meta.get('phash'))
+            parts.append(null if phash is None else struct.pack('!iq', 8, phash))
+            created = meta.get('date_created')
+            if created is None:
+                parts.append(null)
+            else:
+                micros = (created - _PG_EPOCH) // timedelta(microseconds=1)
+                parts.append(struct.pack('!iq', 8, micros))
+            parts.append(text(meta.get('model_id') or model_id))
+        counter['rows'] += len(metadata)
+        yield b''.join(parts)
+    yield struct.pack('!h', -1)
+
+
+def copy_vectors(batches: Iterator[tuple], keep_ids: bool = False, replace: bool = False,
+                 tenant_id: Optional[str] = None, style_number: Optional[str] = None) -> int:
+    """
+    Bulk load rows with binary COPY, streaming: each batch is encoded and sent as it is read.
+
+    Args:
+        batches: Iterator of (vectors [n, dim] array, metadata dicts) with tenant_id,
+                 style_number, image_url, etag, phash, date_created (datetime or None),
+                 model_id (None: the active model) and, for keep_ids, id
+        keep_ids: Load the ids from the metadata (and move the id sequence past them)
+                  instead of assigning new ones
+        replace: First delete the rows in scope (tenant_id/style_number, or the whole
+                 table), in the same transaction as the load
+        tenant_id, style_number: Scope for `replace`
+
+    Returns:
+        Number of rows loaded
+    """
+    columns = ['tenant_id', 'style_number', 'image_url', 'feature_vector', 'etag', 'phash', 'date_created', 'model_id']
+    if keep_ids:
+        columns.insert(0, 'id')
+    counter = {'rows': 0}
+    half = vector_column_type() == 'halfvec'
+    model_id = active_model_id()
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                if replace:
+                    conditions = []
+                    params = []
+                    if tenant_id:
+                        conditions.append("tenant_id = %s")
+                        params.append(tenant_id)
+                    if style_number:
+                        conditions.append("style_number = %s")
+                        params.append(style_number)
+                    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+                    cur.execute(f"DELETE FROM fvector_pg{where_clause}", params)
+                cur.copy_expert(
+                    f"COPY fvector_pg ({', '.join(columns)}) FROM STDIN WITH (FORMAT binary)",
+                    _ChunkReader(_copy_binary_chunks(batches, keep_ids, counter, half, model_id)),
+                    size=1024 * 1024,
+                )
+                if keep_ids:
+                    cur.execute(
+                        "SELECT setval(pg_get_serial_sequence('fvector_pg', 'id'), "
+                        "GREATEST((SELECT max(id) FROM fvector_pg), 1))"
+                    )
+    finally:
+        conn.close()
+    return counter['rows']
+
+
+def update_in_id_ranges(set_clause: str, condition: str, batch_size: int = 5000,
+                        on_batch: Optional[Callable[[int, int], None]] = None) -> int:
+    """
+    Run `UPDATE fvector_pg SET <set_clause> WHERE <condition>` over id ranges of
+    `batch_size`, committing after each range (schema backfills on a live table).
+
+    Each range is one primary-key range scan, so the pass is linear in the table size
+    and row locks are held for one batch only. Rows inserted after the pass starts are
+    not visited. `on_batch(updated, last_id)` reports progress.
+
+    Returns:
+        Number of rows updated
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COALESCE(min(id), 0), COALESCE(max(id), 0) FROM fvector_pg")
+                low, high = cur.fetchone()
+
+        updated = 0
+        start = low - 1
+        while start < high:
+            with conn:
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"UPDATE fvector_pg SET {set_clause} WHERE id > %s AND id <= %s AND ({condition})",
+                        (start, start + batch_size),
+                    )
+                    updated += cur.rowcount
+            start += batch_size
+            if on_batch:
+                on_batch(updated, min(start, high))
+        return updated
+    finally:
+        conn.close()
+
+
+# --- Background jobs -------------------------------------------------------
+
+JOB_ERRORS_KEPT = 100  # most recent per-item errors stored on a job row
+
+
+def create_job(kind: str, params: Dict) -> int:
+    """Queue a background job and return its id."""
+    sql = "INSERT INTO ingest_jobs (kind, params) VALUES (%s, %s) RETURNING id"
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (kind, Json(params)))
+                return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def find_active_job(kind: str, params: Dict) -> Optional[int]:
+    """Return the id of a queued/running job of `kind` with identical params, if any."""
+    sql = """
+    SELECT id FROM ingest_jobs
+    WHERE kind = %s AND params = %s::jsonb AND status IN ('queued', 'running', 'cancelling')
+    ORDER BY id LIMIT 1;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (kind, Json(params)))
+                row = cur.fetchone()
+                return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def get_job(job_id: int) -> Optional[Dict]:
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute("SELECT * FROM ingest_jobs WHERE id = %s", (job_id,))
+                return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None, limit: int = 50) -> List[Dict]:
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if kind:
+        conditions.append("kind = %s")
+        params.append(kind)
+    where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    sql = f"SELECT * FROM ingest_jobs{where_clause} ORDER BY id DESC LIMIT %s"
+
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql, params + [limit])
+                return cur.fetchall()
+    finally:
+        conn.close()
+
+
+def claim_job(worker_id: str, stale_after_seconds: int) -> Optional[Dict]:
+    """Atomically take the oldest queued job, or a running job whose worker stopped heartbeating.
+
+    Uses SKIP LOCKED so several service processes can poll the same table.
+    A job that was being cancelled when its worker died is marked cancelled.
+    """
+    sql_sweep = """
+    UPDATE ingest_jobs
+    SET status = 'cancelled', finished_at = now(), updated_at = now()
+    WHERE status = 'cancelling' AND heartbeat_at < now() - make_interval(secs => %s);
+    """
+    sql = """
+    UPDATE ingest_jobs
+    SET status = 'running',
+        worker_id = %s,
+        heartbeat_at = now(),
+        started_at = now(),
+        updated_at = now(),
+        run_processed = 0
+    WHERE id = (
+        SELECT id FROM ingest_jobs
+        WHERE status = 'queued'
+           OR (status = 'running' AND heartbeat_at < now() - make_interval(secs => %s))
+        ORDER BY id
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING *;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(sql_sweep, (stale_after_seconds,))
+                cur.execute(sql, (worker_id, stale_after_seconds))
+                return cur.fetchone()
+    finally:
+        conn.close()
+
+
+def heartbeat_job(job_id: int, worker_id: str) -> Optional[str]:
+    """Refresh a job's heartbeat. Returns the current status (e.g. 'cancelling')."""
+    sql = """
+    UPDATE ingest_jobs SET heartbeat_at = now()
+    WHERE id = %s AND worker_id = %s
+    RETURNING status;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (job_id, worker_id))
+                row = cur.fetchone()
+                return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def set_job_total(job_id: int, total: int):
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE ingest_jobs SET total = %s, updated_at = now() WHERE id = %s", (total, job_id))
+    finally:
+        conn.close()
+
+
+def set_job_result(job_id: int, result: Dict):
+    """Store a job-specific summary (e.g. a sync diff) on the job row."""
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute("UPDATE ingest_jobs SET result = %s, updated_at = now() WHERE id = %s", (Json(result), job_id))
+    finally:
+        conn.close()
+
+
+def commit_job_chunk(
+    job_id: int,
+    worker_id: str,
+    vectors_data: List[Dict],
+    checkpoint: Optional[str],
+    processed: int,
+    failed: int,
+    errors: Optional[List[Dict]] = None,
+    delete_ids: Optional[List[int]] = None,
+) -> Tuple[Optional[str], List[int]]:
+    """Insert a chunk of vectors and advance the job checkpoint in one transaction.
+
+    Either both the rows and the new checkpoint are committed or neither is, so a
+    resumed job never re-inserts or skips a chunk. `delete_ids` are rows the new
+    vectors replace; they are deleted in the same transaction.
+
+    Returns the job status after the update (None if this worker lost the job)
+    and the ids of the inserted rows, in input order (empty if rolled back).
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                ids = _insert_vectors(cur, vectors_data) if vectors_data else []
+                if delete_ids:
+                    cur.execute("DELETE FROM fvector_pg WHERE id = ANY(%s)", (list(delete_ids),))
+                status = _advance_job(cur, job_id, worker_id, checkpoint, processed, failed, errors)
+                if status is None:
+                    # another worker took the job over; roll back this chunk
+                    conn.rollback()
+                    return None, []
+                return status, ids
+    finally:
+        conn.close()
+
+
+def _advance_job(cur, job_id: int, worker_id: str, checkpoint: Optional[str],
+                 processed: int, failed: int, errors: Optional[List[Dict]]) -> Optional[str]:
+    """Add a chunk's counts/errors to a job row. Returns its status, or None if `worker_id` lost the job."""
+    sql = """
+    UPDATE ingest_jobs
+    SET checkpoint = COALESCE(%s, checkpoint),
+        processed = processed + %s,
+        failed = failed + %s,
+        run_processed = run_processed + %s,
+        errors = (
+            SELECT COALESCE(jsonb_agg(e ORDER BY n), '[]'::jsonb) FROM (
+                SELECT e, n FROM jsonb_array_elements(errors || %s::jsonb) WITH ORDINALITY AS t(e, n)
+                ORDER BY n DESC LIMIT %s
+            ) recent
+        ),
+        heartbeat_at = now(),
+        updated_at = now()
+    WHERE id = %s AND worker_id = %s
+    RETURNING status;
+    """
+    cur.execute(sql, (
+        checkpoint, processed, failed, processed,
+        Json(errors or []), JOB_ERRORS_KEPT, job_id, worker_id,
+    ))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def purge_job_chunk(
+    job_id: int,
+    worker_id: str,
+    tenant_id: str,
+    style_number: Optional[str],
+    limit: int,
+    delete_objects: Callable[[List[str]], List[str]],
+) -> tuple:
+    """Delete up to `limit` rows of a tenant (optionally one style) for a purge job.
+
+    The rows are deleted with one DELETE ... RETURNING; `delete_objects` is then
+    called with their image URLs (returning the URLs it failed to delete) and the
+    job counters are updated, all before the transaction commits. If the worker
+    dies while objects are being deleted the rows come back and the resumed job
+    deletes them again, so no object is left behind without a row. Objects that
+    could not be deleted are counted as failed; their rows stay deleted.
+
+    Returns (deleted_ids, failed, job_status); status is None if this worker lost the job.
+    """
+    conditions = ["tenant_id = %s"]
+    params = [tenant_id]
+    if style_number:
+        conditions.append("style_number = %s")
+        params.append(style_number)
+    sql = f"""
+    DELETE FROM fvector_pg WHERE id IN (
+        SELECT id FROM fvector_pg
+        WHERE {" AND ".join(conditions)}
+        ORDER BY id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, image_url;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params + [limit])
+                rows = cur.fetchall()
+                failed_urls = delete_objects([url for _, url in rows]) if rows else []
+                errors = [{'key': url, 'error': 'storage delete failed'} for url in failed_urls]
+                status = _advance_job(cur, job_id, worker_id, None,
+                                      len(rows) - len(failed_urls), len(failed_urls), errors)
+                if status is None:
+                    conn.rollback()
+                    return [], 0, None
+                return [image_id for image_id, _ in rows], len(failed_urls), status
+    finally:
+        conn.close()
+
+
+def finish_job(job_id: int, worker_id: str, status: str, error: Optional[str] = None):
+    sql = """
+    UPDATE ingest_jobs
+    SET status = %s, error = %s, updated_at = now(),
+        finished_at = CASE WHEN %s IN ('completed', 'failed', 'cancelled') THEN now() ELSE NULL END
+    WHERE id = %s AND worker_id = %s;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (status, error, status, job_id, worker_id))
+    finally:
+        conn.close()
+
+
+def request_job_cancel(job_id: int) -> Optional[str]:
+    """Cancel a queued job immediately, or ask the worker of a running job to stop.
+
+    Returns the new status, or None if the job does not exist or already finished.
+    """
+    sql = """
+    UPDATE ingest_jobs
+    SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE 'cancelling' END,
+        finished_at = CASE WHEN status = 'queued' THEN now() ELSE finished_at END,
+        updated_at = now()
+    WHERE id = %s AND status IN ('queued', 'running')
+    RETURNING status;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (job_id,))
+                row = cur.fetchone()
+                return row[0] if row else None
+    finally:
+        conn.close()
+
+
+def resume_job(job_id: int) -> bool:
+    """Re-queue a cancelled or failed job; it continues from its last checkpoint."""
+    sql = """
+    UPDATE ingest_jobs
+    SET status = 'queued', error = NULL, finished_at = NULL, updated_at = now()
+    WHERE id = %s AND status IN ('cancelled', 'failed')
+    RETURNING id;
+    """
+    conn = get_conn()
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, (job_id,))
+                return cur.fetchone() is not None
+    finally:
+        conn.close()
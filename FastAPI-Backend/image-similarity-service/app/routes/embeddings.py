@@ -0,0 +1,86 @@
+import asyncio
+from fastapi import APIRouter, HTTPException, Form
+
+from app.database import embedding_sets, pg_connect
+
+
+embeddings_router = APIRouter()
+
+
+@embeddings_router.get('/embedding-sets')
+async def list_embedding_sets():
+    """
+    List embedding sets (one per model): dimension, whether it is the active one,
+    and how many images have / are still missing a vector from it.
+    """
+    try:
+        sets = await asyncio.to_thread(embedding_sets.list_sets)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing embedding sets: {str(e)}")
+    return {"status": "success", "active_model": pg_connect.active_model_id(), "sets": sets}
+
+
+@embeddings_router.post('/embedding-sets/reembed')
+async def reembed(
+    model_id: str = Form(...),
+    activate: bool = Form(True),
+):
+    """
+    Queue a background job that embeds every image with another model while search
+    keeps using the active one, and then (with `activate`) switches to it atomically.
+
+    Args:
+        model_id: Hugging Face CLIP model id, e.g. openai/clip-vit-base-patch32
+        activate: Switch to the new set once every image has a vector from it
+
+    Returns:
+        The id of the queued (or already active) job
+    """
+    params = {'model_id': model_id, 'activate': activate}
+    try:
+        job_id = pg_connect.find_active_job('reembed', params)
+        message = "Re-embed job already queued or running"
+        if job_id is None:
+            job_id = pg_connect.create_job('reembed', params)
+            message = "Re-embed job queued"
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating re-embed job: {str(e)}")
+
+    return {
+        "status": "queued",
+        "message": message,
+        "job_id": job_id,
+        "status_url": f"/img/jobs/{job_id}",
+    }
+
+
+@embeddings_router.post('/embedding-sets/activate')
+async def activate_embedding_set(model_id: str = Form(...)):
+    """
+    Switch to an embedding set that already covers every image, e.g. back to the
+    previous model. Writes wait for the switch; searches do not.
+
+    Returns:
+        The previous model and the number of vectors switched
+    """
+    try:
+        result = await asyncio.to_thread(embedding_sets.activate, model_id)
+    except embedding_sets.EmbeddingSetError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error activating embedding set: {str(e)}")
+    return {"status": "success", **result}
+
+
+@embeddings_router.delete('/embedding-sets')
+async def drop_embedding_set(model_id: str = Form(...)):
+    """
+    Delete an inactive embedding set and its stored vectors.
+    """
+    try:
+        deleted = await asyncio.to_thread(embedding_sets.drop_set, model_id)
+    except embedding_sets.EmbeddingSetError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting embedding set: {str(e)}")
+    return {"status": "success", "model_id": model_id, "deleted_vectors": deleted}
@@ -1,13 +1,24 @@
 import io
 import uuid
 import base64
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+import asyncio
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
 from pydantic import BaseModel
 from PIL import Image
 from typing import List, Optional
 
 from app.utils.feature_extraction import get_feature_vector_pretrained
-from app.utils.s3_handler import upload_to_s3, delete_from_s3, get_image_by_tenant_id
+from app.utils.dedup import dhash, embed_with_dedup, get_phash_index
+from app.utils.s3_handler import upload_to_s3, delete_from_s3, get_image_by_tenant_id, key_from_url
+from app.utils.jobs import delete_image_objects
+from app.utils.bulk_save import BulkSaveError, check_item_count, items_from_zip, new_item, save_images_bulk
+from app.utils.uploads import MB, read_image_upload, spool_upload
+from app.utils.pq_index import discard_vectors, index_vectors
+from app.utils.shards import discard_rows, index_rows
+from app.utils.metrics import stage
+from app.utils.write_coalescer import insert_vector
+from app.routes.search import check_allow_lists, check_retrieval, search_vectors
+from config import settings
 from app.database import pg_connect
 
 
@@ -28,36 +39,185 @@ async def save(
     """Save uploaded image to S3, compute CLIP embedding, and store in DB.
 
     Uses CLIP with image_size=224 and stores `feature_vector` as bytes.
+    If the image is a near-duplicate (perceptual hash) of one already stored for
+    the tenant, that image's vector is reused instead of running CLIP and the
+    response reports `duplicate_of`.
     """
     form_data = ImageSaveForm(style_number=style_number, tenant_id=tenant_id)
 
-    try:
-        image_bytes = await image.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading uploaded file: {e}")
+    image_file, pil_image, _ = await read_image_upload(image)
 
     # upload raw file to S3 with tenant_id prefix 
     file_name = f"{form_data.tenant_id}/{uuid.uuid4()}.png"
     try:
-        image_url = upload_to_s3(image_bytes, file_name)
+        image_url = upload_to_s3(image_file, file_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading image to S3: {e}")
+    finally:
+        image_file.close()
 
     try:
-        # compute CLIP embedding directly (no preprocessing)
-        feature_vector = get_feature_vector_pretrained(image_bytes, i_type=None)
-        # insert to Postgres vector table
-        pg_connect.init_table()
-        image_id = pg_connect.upsert_vector(form_data.tenant_id, form_data.style_number, image_url, feature_vector)
+        # compute CLIP embedding directly (no preprocessing), or reuse a near-duplicate's
+        embedding = await asyncio.to_thread(embed_with_dedup, form_data.tenant_id, pil_image)
+        # insert to Postgres vector table (group-committed with concurrent saves)
+        image_id = await insert_vector({
+            'tenant_id': form_data.tenant_id, 'style_number': form_data.style_number, 'image_url': image_url,
+            'feature_vector': embedding['vector'], 'phash': embedding['phash'],
+        })
+        get_phash_index().add(form_data.tenant_id, image_id, embedding['phash'])
+        index_vectors([image_id], [embedding['vector']])
+        await asyncio.to_thread(index_rows, [{
+            'id': image_id, 'tenant_id': form_data.tenant_id, 'style_number': form_data.style_number,
+            'feature_vector': embedding['vector'],
+        }])
     except Exception as e:
         # try to delete uploaded S3 object on failure
         try:
             delete_from_s3(file_name)
         except Exception:
             pass
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "message": "Image saved successfully",
+        "image_id": image_id,
+        "tenant_id": form_data.tenant_id,
+        "duplicate_of": embedding['duplicate_of'],
+        "hamming_distance": embedding['hamming_distance'],
+        "embedding_reused": embedding['embedding_reused'],
+    }
+
+
+async def read_bounded(upload: UploadFile, max_bytes: Optional[int] = None) -> bytes:
+    """Read a whole upload, with 413 once it exceeds `max_bytes` (default MAX_UPLOAD_MB)."""
+    spool = await spool_upload(upload, max_bytes)
+    with spool:
+        return spool.read()
+
+
+@image_router.post("/save-images")
+async def save_images(
+    tenant_id: str = Form(...),
+    images: Optional[List[UploadFile]] = File(None),
+    style_numbers: Optional[List[str]] = Form(None),
+    archive: Optional[UploadFile] = File(None),
+    manifest: Optional[UploadFile] = File(None),
+):
+    """Save many images at once: upload to S3, embed in batches and bulk insert.
+
+    Send either:
+    - `images` (repeated file field) with one `style_numbers` field per image, in the same order, or
+    - `archive`: a zip of images plus a CSV manifest (`filename,style_number`), either
+      as the `manifest` field or as `manifest.csv` inside the zip.
+
+    Items fail individually; the response lists the status of every item in input order.
+    """
+    try:
+        if archive is not None:
+            manifest_bytes = await read_bounded(manifest) if manifest is not None else None
+            items = items_from_zip(await read_bounded(archive, int(settings.MAX_REQUEST_MB) * MB), manifest_bytes)
+        elif images:
+            if not style_numbers or len(style_numbers) != len(images):
+                raise BulkSaveError("send exactly one style_numbers value per image")
+            check_item_count(len(images))
+            items = [
+                new_item(index, image.filename or '', style_number, data=await read_bounded(image),
+                         content_type=image.content_type)
+                for index, (image, style_number) in enumerate(zip(images, style_numbers))
+            ]
+        else:
+            raise BulkSaveError("send either images or an archive")
+    except BulkSaveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error reading uploaded files: {e}")
+
+    try:
+        # upload/embed/insert are blocking; keep the event loop free
+        results = await asyncio.to_thread(save_images_bulk, tenant_id, items)
+    except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    return {"message": "Image saved successfully", "image_id": image_id, "tenant_id": form_data.tenant_id}
+    saved = sum(1 for r in results if r['status'] == 'saved')
+    return {
+        "message": f"Saved {saved} of {len(results)} images",
+        "tenant_id": tenant_id,
+        "saved": saved,
+        "failed": len(results) - saved,
+        "items": results,
+    }
+
+
+def image_record(row: dict) -> dict:
+    """JSON-friendly view of a `get_vectors_by_ids` row (image_id instead of id, vector as a list)."""
+    record = {'image_id': row['id']}
+    record.update((k, v) for k, v in row.items() if k != 'id')
+    if record.get('phash') is not None:
+        # 64-bit; as a JSON number it would lose precision in JavaScript clients
+        record['phash'] = format(record['phash'], '016x')
+    if 'date_created' in record and record['date_created'] is not None:
+        record['date_created'] = record['date_created'].isoformat()
+    if 'feature_vector' in record:
+        record['feature_vector'] = record['feature_vector'].tolist()
+    return record
+
+
+@image_router.get("/images/{image_id}")
+async def get_image(image_id: int, include_vector: bool = Query(False)):
+    """
+    Look up one stored image by id.
+
+    Args:
+        image_id: Id of the stored image
+        include_vector: Also return the 768-d feature vector (left out by default)
+
+    Returns:
+        tenant_id, style_number, image_url, etag, phash, date_created (and feature_vector)
+    """
+    fields = list(pg_connect.VECTOR_FIELDS if include_vector else pg_connect.METADATA_FIELDS)
+    try:
+        row = await asyncio.to_thread(pg_connect.get_vector_by_id, image_id, fields)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error looking up image: {e}")
+    if row is None:
+        raise HTTPException(status_code=404, detail="No image found with the given image_id")
+    return image_record(row)
+
+
+@image_router.get("/images")
+async def get_images(
+    ids: List[int] = Query(...),
+    include_vector: bool = Query(False),
+):
+    """
+    Look up many stored images by id in one query (`?ids=1&ids=2`).
+
+    Args:
+        ids: Ids to look up (at most IMAGE_LOOKUP_MAX_IDS)
+        include_vector: Also return the feature vectors (left out by default)
+
+    Returns:
+        Found images in request order, and the ids that do not exist
+    """
+    max_ids = int(settings.IMAGE_LOOKUP_MAX_IDS)
+    if len(ids) > max_ids:
+        raise HTTPException(status_code=400, detail=f"too many ids ({len(ids)}); the limit is {max_ids} per request")
+
+    fields = list(pg_connect.VECTOR_FIELDS if include_vector else pg_connect.METADATA_FIELDS)
+    try:
+        rows = await asyncio.to_thread(pg_connect.get_vectors_by_ids, ids, fields)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error looking up images: {e}")
+
+    found = {row['id'] for row in rows}
+    return {
+        "images": [image_record(row) for row in rows],
+        "not_found": [image_id for image_id in dict.fromkeys(ids) if image_id not in found],
+    }
 
 
 @image_router.delete("/delete-image")
@@ -73,12 +233,14 @@ async def delete(image_id: int = Form(...)):
             status_code=404,
             detail="No image found with the given image_id",
         )
+    get_phash_index().discard(image_id)
+    discard_vectors([image_id])
+    await asyncio.to_thread(discard_rows, [image_id])
 
     try:
-        # Extract full S3 key from URL 
+        # Extract full object key from URL
         # URL format: https://bucket.s3.amazonaws.com/tenant_id/uuid.png
-        from app.utils.s3_handler import BUCKET_NAME
-        image_key = image_url.split(f"{BUCKET_NAME}.s3.amazonaws.com/")[-1]
+        image_key = key_from_url(image_url)
         delete_from_s3(image_key)
     except Exception as e:
         raise HTTPException(status_code=500, detail="Error deleting image from s3: " + str(e))
@@ -86,6 +248,89 @@ async def delete(image_id: int = Form(...)):
     return {"message": "Image and fvector deleted successfully"}
 
 
+@image_router.delete("/delete-images")
+async def delete_images(image_ids: List[int] = Form(...)):
+    """
+    Delete many images and their vectors at once.
+
+    The rows are removed with one DELETE ... RETURNING and the stored objects with
+    S3 DeleteObjects (1000 keys per request, run concurrently). For a whole tenant
+    or style use `/img/purge-images`, which runs as a background job.
+
+    Args:
+        image_ids: Ids to delete (repeat the field; at most BULK_DELETE_MAX_IDS)
+
+    Returns:
+        Deleted ids, ids that did not exist, and URLs whose object could not be deleted
+    """
+    max_ids = int(settings.BULK_DELETE_MAX_IDS)
+    image_ids = list(dict.fromkeys(image_ids))
+    if len(image_ids) > max_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f"too many ids ({len(image_ids)}); the limit is {max_ids} per request, use /img/purge-images",
+        )
+
+    try:
+        rows = await asyncio.to_thread(pg_connect.delete_vectors_returning, image_ids)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Error deleting fvectors from database: " + str(e))
+
+    deleted = [image_id for image_id, _ in rows]
+    get_phash_index().discard_many(deleted)
+    discard_vectors(deleted)
+    await asyncio.to_thread(discard_rows, deleted)
+
+    try:
+        storage_failed = await asyncio.to_thread(delete_image_objects, [url for _, url in rows])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="Error deleting images from s3: " + str(e))
+
+    deleted_set = set(deleted)
+    return {
+        "message": f"Deleted {len(deleted)} images",
+        "deleted": deleted,
+        "not_found": [image_id for image_id in image_ids if image_id not in deleted_set],
+        "storage_failed": storage_failed,
+    }
+
+
+@image_router.post("/purge-images")
+async def purge_images(
+    tenant_id: str = Form(...),
+    style_number: Optional[str] = Form(None),
+):
+    """
+    Queue a background job that deletes every image and vector of a tenant
+    (or of one of its styles). Progress is reported on `GET /img/jobs/{job_id}`;
+    objects that could not be deleted are listed in its recent errors. If an
+    identical purge is already queued or running, its id is returned instead.
+
+    Args:
+        tenant_id: Tenant whose images are deleted
+        style_number: Optional style number to limit the purge to
+
+    Returns:
+        The id of the queued (or already active) job
+    """
+    params = {'tenant_id': tenant_id, 'style_number': style_number or None}
+    try:
+        job_id = pg_connect.find_active_job('purge', params)
+        message = "Purge job already queued or running"
+        if job_id is None:
+            job_id = pg_connect.create_job('purge', params)
+            message = "Purge job queued"
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating purge job: {str(e)}")
+
+    return {
+        "status": "queued",
+        "message": message,
+        "job_id": job_id,
+        "status_url": f"/img/jobs/{job_id}",
+    }
+
+
 @image_router.put("/update-image")
 async def update_image(
     image: UploadFile = File(...),
@@ -93,48 +338,53 @@ async def update_image(
     tenant_id: str = Form(...),
     image_id: int = Form(...),
 ):
-    try:
-        image_bytes = await image.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading uploaded file: {e}")
+    image_file, pil_image, _ = await read_image_upload(image)
 
     # Get old image URL before update
-    old_image_url = None
     try:
-        rows = pg_connect.fetch_vectors()
-        for row in rows:
-            if row.get('id') == image_id:
-                old_image_url = row.get('image_url')
-                break
-    except Exception:
-        pass
-    
-    if not old_image_url:
+        row = pg_connect.get_vector_by_id(image_id, fields=['image_url'])
+    except Exception as e:
+        image_file.close()
+        raise HTTPException(status_code=500, detail=f"Error looking up image: {e}")
+
+    if not row or not row['image_url']:
+        image_file.close()
         raise HTTPException(status_code=404, detail="Image not found with given image_id")
+    old_image_url = row['image_url']
 
     # Upload new image with tenant_id prefix
     file_name = f"{tenant_id}/{uuid.uuid4()}.png"
     try:
-        image_url = upload_to_s3(image_bytes, file_name)
+        image_url = upload_to_s3(image_file, file_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading image to S3: {e}")
+    finally:
+        image_file.close()
 
     try:
-        feature_vector = get_feature_vector_pretrained(image_bytes, i_type=None)
+        feature_vector = await asyncio.to_thread(get_feature_vector_pretrained, pil_image, None, tenant_id)
+        phash = dhash(pil_image)
         # update in Postgres
-        pg_connect.init_table()
-        success = pg_connect.update_vector(image_id, tenant_id, style_number, image_url, feature_vector)
+        success = pg_connect.update_vector(image_id, tenant_id, style_number, image_url, feature_vector, phash=phash)
         if not success:
             raise Exception("Failed to update vector")
+        phash_index = get_phash_index()
+        phash_index.discard(image_id)
+        phash_index.add(tenant_id, image_id, phash)
+        index_vectors([image_id], [feature_vector])
+        await asyncio.to_thread(index_rows, [{
+            'id': image_id, 'tenant_id': tenant_id, 'style_number': style_number, 'feature_vector': feature_vector,
+        }])
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
     # Delete old image from S3
     if old_image_url:
         try:
-            # Extract full S3 key from URL
-            from app.utils.s3_handler import BUCKET_NAME
-            image_key = old_image_url.split(f"{BUCKET_NAME}.s3.amazonaws.com/")[-1]
+            # Extract full object key from URL
+            image_key = key_from_url(old_image_url)
             delete_from_s3(image_key)
         except Exception:
             pass  
@@ -148,6 +398,7 @@ class SimilarImageResult(BaseModel):
     style_number: str
     image_url: str
     similarity: float
+    group_matches: Optional[int] = None
     image_base64: Optional[str] = None
 
 
@@ -158,6 +409,9 @@ class SearchAndStoreResponse(BaseModel):
     uploaded_tenant_id: str
     image_url: str
     similar_images: List[SimilarImageResult]
+    duplicate_of: Optional[int] = None
+    hamming_distance: Optional[int] = None
+    embedding_reused: bool = False
 
 
 @image_router.post("/upload-image")
@@ -176,19 +430,19 @@ async def upload_image_only(
     Returns:
         Success message with S3 URL
     """
-    try:
-        image_bytes = await image.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading uploaded file: {e}")
+    # validate the header only; the pixels are never decoded here
+    image_file, _, _ = await read_image_upload(image, decode=False)
 
     # Create filename with tenant_id prefix for organization
     file_extension = image.filename.split('.')[-1] if '.' in image.filename else 'png'
     file_name = f"{tenant_id}/{uuid.uuid4()}.{file_extension}"
     
     try:
-        image_url = upload_to_s3(image_bytes, file_name)
+        image_url = upload_to_s3(image_file, file_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading image to S3: {e}")
+    finally:
+        image_file.close()
 
     return {
         "message": "Image uploaded successfully to S3",
@@ -203,6 +457,11 @@ async def search_and_store(
     style_number: str = Form(...),
     tenant_id: str = Form(...),
     top_k: int = Form(10),
+    group_by_style: bool = Form(False),
+    retrieval: str = Form("exact"),
+    image_ids: Optional[List[int]] = Form(None),
+    style_numbers: Optional[List[str]] = Form(None),
+    tenant_ids: Optional[List[str]] = Form(None),
 ):
     """
     Search for similar images across ALL tenants, then store the submitted image.
@@ -219,29 +478,47 @@ async def search_and_store(
         style_type: The style type/category of the image
         tenant_id: The tenant ID to associate with the stored image
         top_k: Number of similar images to return (default: 10)
+        group_by_style: If True, return only the best image per (tenant, style)
+        retrieval: "exact" (default), "binary" (sign-bit shortlist + exact rerank),
+                   "pq" (in-process IVF-PQ index + exact rerank) or "sharded"
+                   (scatter-gather over the shard processes)
+        image_ids, style_numbers, tenant_ids: Optional allow-lists (repeat the
+                   field per value); only matching images are searched
         
     Returns:
         List of similar images and confirmation of storage
     """
-    try:
-        image_bytes = await image.read()
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error reading uploaded file: {e}")
+    check_retrieval(retrieval, group_by_style)
+    check_allow_lists(image_ids, style_numbers, tenant_ids)
+    image_file, pil_image, _ = await read_image_upload(image)
 
-    # Compute CLIP embedding for the uploaded image
+    # Compute CLIP embedding for the uploaded image (or reuse a near-duplicate's)
     try:
-        feature_vector = get_feature_vector_pretrained(image_bytes, i_type=None)
+        embedding = await asyncio.to_thread(embed_with_dedup, tenant_id, pil_image)
+        feature_vector = embedding['vector']
     except Exception as e:
+        image_file.close()
+        if isinstance(e, HTTPException):
+            raise
         raise HTTPException(status_code=500, detail=f"Error extracting features: {e}")
 
     # Search for similar images across ALL tenants
     try:
-        pg_connect.init_table()
-        similar_results = pg_connect.search_similar_vectors(
+        similar_results = await asyncio.to_thread(
+            search_vectors,
             query_vector=feature_vector,
-            top_k=top_k
+            top_k=top_k,
+            group_by_style=group_by_style,
+            retrieval=retrieval,
+            image_ids=image_ids,
+            style_numbers=style_numbers,
+            tenant_ids=tenant_ids
         )
+    except HTTPException:
+        image_file.close()
+        raise
     except Exception as e:
+        image_file.close()
         raise HTTPException(status_code=500, detail=f"Error searching for similar images: {e}")
 
     # Fetch base64 images for similar results
@@ -251,7 +528,8 @@ async def search_and_store(
         try:
             s3_image_bytes = get_image_by_tenant_id(result['tenant_id'])
             if s3_image_bytes:
-                image_base64 = base64.b64encode(s3_image_bytes).decode('utf-8')
+                with stage('encode'):
+                    image_base64 = base64.b64encode(s3_image_bytes).decode('utf-8')
         except Exception:
             pass  # Continue even if we can't fetch the image
 
@@ -261,6 +539,7 @@ async def search_and_store(
             style_number=result.get('style_number', ''),
             image_url=result.get('image_url', ''),
             similarity=result.get('similarity_score', 0.0),
+            group_matches=result.get('group_matches'),
             image_base64=image_base64
         ))
 
@@ -269,13 +548,23 @@ async def search_and_store(
     file_name = f"{tenant_id}/{uuid.uuid4()}.{file_extension}"
     
     try:
-        image_url = upload_to_s3(image_bytes, file_name)
+        image_url = upload_to_s3(image_file, file_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading image to S3: {e}")
+    finally:
+        image_file.close()
 
     # Store the embedding in PostgreSQL
     try:
-        image_id = pg_connect.upsert_vector(tenant_id, style_number, image_url, feature_vector)
+        image_id = await insert_vector({
+            'tenant_id': tenant_id, 'style_number': style_number, 'image_url': image_url,
+            'feature_vector': feature_vector, 'phash': embedding['phash'],
+        })
+        get_phash_index().add(tenant_id, image_id, embedding['phash'])
+        index_vectors([image_id], [feature_vector])
+        await asyncio.to_thread(index_rows, [{
+            'id': image_id, 'tenant_id': tenant_id, 'style_number': style_number, 'feature_vector': feature_vector,
+        }])
     except Exception as e:
         # Try to clean up S3 on failure
         try:
@@ -289,5 +578,8 @@ async def search_and_store(
         image_id=image_id,
         uploaded_tenant_id=tenant_id,
         image_url=image_url,
-        similar_images=similar_images
+        similar_images=similar_images,
+        duplicate_of=embedding['duplicate_of'],
+        hamming_distance=embedding['hamming_distance'],
+        embedding_reused=embedding['embedding_reused']
     )
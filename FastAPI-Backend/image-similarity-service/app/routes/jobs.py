@@ -0,0 +1,71 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query
+
+from app.database import pg_connect
+from app.utils.jobs import job_summary
+
+
+jobs_router = APIRouter()
+
+
+@jobs_router.get('/jobs')
+async def list_jobs(
+    status: Optional[str] = Query(None),
+    kind: Optional[str] = Query(None),
+    limit: int = Query(50, gt=0, le=500),
+):
+    """
+    List background jobs, newest first.
+    
+    Args:
+        status: Optional status filter (queued, running, cancelling, cancelled, completed, failed)
+        kind: Optional job kind filter (e.g. ingest)
+        limit: Maximum number of jobs to return
+    """
+    try:
+        jobs = pg_connect.list_jobs(status=status, kind=kind, limit=limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing jobs: {str(e)}")
+    return {"status": "success", "count": len(jobs), "jobs": [job_summary(j) for j in jobs]}
+
+
+@jobs_router.get('/jobs/{job_id}')
+async def get_job(job_id: int):
+    """
+    Get progress, throughput (images/s) and recent failures for a job.
+    """
+    try:
+        job = pg_connect.get_job(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job: {str(e)}")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_summary(job)
+
+
+@jobs_router.post('/jobs/{job_id}/cancel')
+async def cancel_job(job_id: int):
+    """
+    Cancel a job. Running jobs stop after the current chunk; committed chunks are kept.
+    """
+    try:
+        status = pg_connect.request_job_cancel(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error cancelling job: {str(e)}")
+    if status is None:
+        raise HTTPException(status_code=409, detail="Job not found or already finished")
+    return {"status": "success", "job_id": job_id, "job_status": status}
+
+
+@jobs_router.post('/jobs/{job_id}/resume')
+async def resume_job(job_id: int):
+    """
+    Re-queue a cancelled or failed job. It continues from its last committed chunk.
+    """
+    try:
+        resumed = pg_connect.resume_job(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error resuming job: {str(e)}")
+    if not resumed:
+        raise HTTPException(status_code=409, detail="Job not found or not in a resumable state")
+    return {"status": "success", "job_id": job_id, "job_status": "queued"}
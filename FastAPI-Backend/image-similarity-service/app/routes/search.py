@@ -2,6 +2,7 @@ import io
 import time
 import json
 import base64
+import asyncio
 from typing import List, Optional
 import numpy as np
 from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
@@ -11,7 +12,11 @@ from pydantic import BaseModel
 from app.utils.feature_extraction import get_feature_vector_pretrained
 from app.utils.s3_handler import list_images_from_s3, download_from_s3, download_from_s3_url, get_image_by_tenant_id
 from app.utils.embedding_extractor import compute_clip_embedding
+from app.utils.uploads import read_image_upload
 from app.database import pg_connect
+from app.utils import pq_index, shards
+from app.utils.metrics import stage
+from config import settings
 
 
 class SearchResponse(BaseModel):
@@ -21,6 +26,7 @@ class SearchResponse(BaseModel):
     image_url: str
     similarity_score: float
     rank: int
+    group_matches: Optional[int] = None  # only with group_by_style
 
 
 class SimilarImageResponse(BaseModel):
@@ -31,6 +37,7 @@ class SimilarImageResponse(BaseModel):
     image_url: str
     similarity_score: float
     rank: int
+    group_matches: Optional[int] = None  # only with group_by_style
     image_base64: Optional[str] = None  # Base64 encoded image data
 
 
@@ -42,16 +49,99 @@ class EmbeddingCreationResponse(BaseModel):
     details: List[dict] = []
 
 
+class JobSubmitResponse(BaseModel):
+    status: str
+    message: str
+    job_id: int
+    status_url: str
+
+
 router = APIRouter()
 search_router = router  # Alias for backward compatibility
 
 
+RETRIEVAL_MODES = pg_connect.RETRIEVAL_MODES + ('pq', 'sharded')
+
+
+def check_retrieval(retrieval: str, group_by_style: bool = False):
+    """400 for an unknown retrieval mode or one that is not set up."""
+    if retrieval not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"retrieval must be one of {', '.join(RETRIEVAL_MODES)}")
+    if retrieval == 'pq':
+        if group_by_style:
+            raise HTTPException(status_code=400, detail="group_by_style is not supported with retrieval=pq")
+        if pq_index.get_pq_index() is None:
+            raise HTTPException(status_code=400, detail="no PQ index is loaded (set PQ_INDEX_PATH, see build_pq_index.py)")
+        return
+    if retrieval == 'sharded':
+        if group_by_style:
+            raise HTTPException(status_code=400, detail="group_by_style is not supported with retrieval=sharded")
+        coordinator = shards.get_shard_coordinator()
+        if coordinator is None:
+            raise HTTPException(status_code=400, detail="sharded search is disabled (set SHARD_COUNT)")
+        if not coordinator.ready:
+            raise HTTPException(status_code=503, detail="shards are still loading, see /status/shards")
+        return
+    try:
+        pg_connect.check_retrieval(retrieval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def check_allow_lists(*allow_lists: Optional[List]):
+    """400 when the allow-lists of a search hold more than SEARCH_ALLOW_LIST_MAX values together."""
+    limit = int(settings.SEARCH_ALLOW_LIST_MAX)
+    total = sum(len(values) for values in allow_lists if values)
+    if total > limit:
+        raise HTTPException(status_code=400, detail=f"allow-lists hold {total} values, at most {limit} are allowed")
+
+
+def search_vectors(query_vector, top_k: int = 10, style_number: Optional[str] = None,
+                   exclude_tenant_id: Optional[str] = None, group_by_style: bool = False,
+                   retrieval: str = 'exact', image_ids: Optional[List[int]] = None,
+                   style_numbers: Optional[List[str]] = None, tenant_ids: Optional[List[str]] = None):
+    """
+    Run a search with the given retrieval mode ('pq' and 'sharded' in process, Postgres otherwise).
+
+    `image_ids`, `style_numbers` and `tenant_ids` restrict the search to matching
+    rows (None = no restriction). PQ codes carry no metadata, so 'pq' with an
+    allow-list scans the subset exactly in Postgres instead.
+    """
+    allow_lists = dict(image_ids=image_ids, style_numbers=style_numbers, tenant_ids=tenant_ids)
+    restricted = any(values is not None for values in allow_lists.values())
+    if retrieval == 'pq' and not restricted:
+        with stage('index_search'):
+            return pq_index.search_catalog(query_vector, top_k, style_number, exclude_tenant_id)
+    if retrieval == 'sharded':
+        try:
+            with stage('index_search'):
+                return shards.get_shard_coordinator().search(query_vector, top_k, style_number,
+                                                             exclude_tenant_id, **allow_lists)
+        except shards.ShardError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+    with stage('db_query'):
+        return pg_connect.search_similar_vectors(
+            query_vector=query_vector,
+            top_k=top_k,
+            style_number=style_number,
+            exclude_tenant_id=exclude_tenant_id,
+            group_by_style=group_by_style,
+            retrieval='exact' if retrieval == 'pq' else retrieval,
+            **allow_lists,
+        )
+
+
 @router.post('/find-similar-tenants', response_model=List[SimilarImageResponse])
 async def find_similar_tenants(
     image: UploadFile = File(...),
     top_k: int = Form(10),
     style_number: Optional[str] = Form(None),
-    include_image_data: bool = Form(False)
+    include_image_data: bool = Form(False),
+    group_by_style: bool = Form(False),
+    retrieval: str = Form("exact"),
+    image_ids: Optional[List[int]] = Form(None),
+    style_numbers: Optional[List[str]] = Form(None),
+    tenant_ids: Optional[List[str]] = Form(None)
 ):
     """
     Find similar tenant images by uploading a new image.
@@ -68,26 +158,44 @@ async def find_similar_tenants(
         top_k: Number of top similar tenant results to return (default: 10)
         style_type: Optional style type to filter results
         include_image_data: If True, includes base64 encoded image data in response
+        group_by_style: If True, return only the best image per (tenant, style) for
+                        the top K styles, with how many candidate images matched it
+        retrieval: "exact" (default), "binary" (shortlist by sign-bit Hamming
+                   distance, then rerank exactly), "pq" (in-process IVF-PQ index,
+                   then rerank exactly) or "sharded" (scatter-gather over the
+                   shard processes)
+        
+        image_ids, style_numbers, tenant_ids: Optional allow-lists (repeat the
+                   field per value); only images matching every given list are
+                   ranked, e.g. the candidates a text search already picked
         
     Returns:
         List of similar tenant images with similarity scores, ranked by similarity.
         Includes the actual image bytes (base64 encoded)
     """
-    start_time = time.time()
-    
+    check_retrieval(retrieval, group_by_style)
+    check_allow_lists(image_ids, style_numbers, tenant_ids)
+
+    # Validate and decode the upload (413/415 on bad input) before searching
+    image_file, pil_image, _ = await read_image_upload(image)
+    image_file.close()
+
     try:
-        # Read uploaded image data
-        data = await image.read()
-        
         # Compute embedding for the uploaded image using CLIP
-        query_vec = get_feature_vector_pretrained(data, 'clip')
+        query_vec = await asyncio.to_thread(get_feature_vector_pretrained, pil_image, 'clip')
         
         # Search across ALL tenants for similar images using cosine similarity
-        results = pg_connect.search_similar_vectors(
+        results = await asyncio.to_thread(
+            search_vectors,
             query_vector=query_vec,
             top_k=top_k,
             style_number=style_number,
-            exclude_tenant_id=None  # Don't exclude any tenant
+            exclude_tenant_id=None,  # Don't exclude any tenant
+            group_by_style=group_by_style,
+            retrieval=retrieval,
+            image_ids=image_ids,
+            style_numbers=style_numbers,
+            tenant_ids=tenant_ids
         )
         
         if not results:
@@ -105,13 +213,15 @@ async def find_similar_tenants(
                 try:
                     # Fetch image from S3 using the stored URL
                     image_bytes = download_from_s3_url(image_url)
-                    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                    with stage('encode'):
+                        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                 except Exception as e:
                     # If fetching fails, try using tenant_id to find image
                     try:
                         image_bytes = get_image_by_tenant_id(tenant_id)
                         if image_bytes:
-                            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+                            with stage('encode'):
+                                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
                     except Exception:
                         pass  # Continue without image data
             
@@ -122,11 +232,14 @@ async def find_similar_tenants(
                 image_url=image_url,
                 similarity_score=r['similarity_score'],
                 rank=r['rank'],
+                group_matches=r.get('group_matches'),
                 image_base64=image_base64
             ))
         
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error finding similar tenants: {str(e)}")
 
@@ -135,7 +248,12 @@ async def find_similar_tenants(
 async def search_image(
     image: UploadFile = File(...),
     top_k: int = Form(10),
-    style_number: Optional[str] = Form(None)
+    style_number: Optional[str] = Form(None),
+    group_by_style: bool = Form(False),
+    retrieval: str = Form("exact"),
+    image_ids: Optional[List[int]] = Form(None),
+    style_numbers: Optional[List[str]] = Form(None),
+    tenant_ids: Optional[List[str]] = Form(None)
 ):
     """
     Search for similar images using the provided image file.
@@ -147,22 +265,40 @@ async def search_image(
         image: The uploaded image file to search with
         top_k: Number of top similar results to return (default: 10)
         style_type: Optional style type to filter results
+        group_by_style: If True, return only the best image per (tenant, style)
+        retrieval: "exact" (default), "binary" (sign-bit shortlist + exact rerank),
+                   "pq" (in-process IVF-PQ index + exact rerank) or "sharded"
+                   (scatter-gather over the shard processes)
+        
+        image_ids, style_numbers, tenant_ids: Optional allow-lists (repeat the
+                   field per value); only images matching every given list are
+                   ranked, e.g. the candidates a text search already picked
         
     Returns:
         List of similar images with similarity scores, ranked by similarity
     """
+    check_retrieval(retrieval, group_by_style)
+    check_allow_lists(image_ids, style_numbers, tenant_ids)
+
+    # Validate and decode the upload (413/415 on bad input) before searching
+    image_file, pil_image, _ = await read_image_upload(image)
+    image_file.close()
+
     try:
-        # Read uploaded image data
-        data = await image.read()
-        
         # Compute embedding for the uploaded image using CLIP
-        query_vec = get_feature_vector_pretrained(data, 'clip')
+        query_vec = await asyncio.to_thread(get_feature_vector_pretrained, pil_image, 'clip')
         
         # Search across ALL tenants using cosine similarity
-        results = pg_connect.search_similar_vectors(
+        results = await asyncio.to_thread(
+            search_vectors,
             query_vector=query_vec,
             top_k=top_k,
-            style_number=style_number
+            style_number=style_number,
+            group_by_style=group_by_style,
+            retrieval=retrieval,
+            image_ids=image_ids,
+            style_numbers=style_numbers,
+            tenant_ids=tenant_ids
         )
         
         if not results:
@@ -176,13 +312,16 @@ async def search_image(
                     style_number=r.get('style_number'),
                     image_url=r['image_url'],
                     similarity_score=r['similarity_score'],
-                    rank=r['rank']
+                    rank=r['rank'],
+                    group_matches=r.get('group_matches')
                 )
                 for r in results
             ]
         
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching images: {str(e)}")
 
@@ -249,17 +388,20 @@ async def search_image(
 #         raise HTTPException(status_code=500, detail=f"Error searching images: {str(e)}")
 
 
-@router.post('/create-embeddings-from-s3', response_model=EmbeddingCreationResponse)
+@router.post('/create-embeddings-from-s3', response_model=JobSubmitResponse)
 async def create_embeddings_from_s3(
     tenant_id: Optional[str] = Form(None),
     prefix: str = Form(""),
     limit: int = Form(0)
 ):
     """
-    Fetch images from S3, compute their embeddings, and store them in the vector database.
+    Queue a background job that fetches images from S3, computes their embeddings,
+    and stores them in the vector database.
     
-    This endpoint scans S3 for images under the specified prefix,
-    computes CLIP embeddings for each image, and stores them in PostgreSQL with pgvector.
+    The job scans storage under the specified prefix and processes the listing in
+    checkpointed chunks (download, batched CLIP embedding, bulk insert). Poll
+    `GET /img/jobs/{job_id}` for progress, throughput and failures. Cancelled or
+    interrupted jobs resume from the last committed chunk.
     
     Args:
         tenant_id: Optional tenant ID - if provided, only processes images for that tenant.
@@ -268,78 +410,149 @@ async def create_embeddings_from_s3(
         limit: Maximum number of images to process (0 = all)
         
     Returns:
-        Status of the embedding creation process
+        The id of the queued job
     """
     try:
-        # Initialize the database table
-        pg_connect.init_table()
-        
-        # List images from S3 (all images if tenant_id is None)
-        images = list_images_from_s3(prefix=prefix, tenant_id=tenant_id)
+        job_id = pg_connect.create_job('ingest', {
+            'tenant_id': tenant_id,
+            'prefix': prefix,
+            'limit': limit,
+        })
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating embedding job: {str(e)}")
+
+    return JobSubmitResponse(
+        status="queued",
+        message="Embedding job queued",
+        job_id=job_id,
+        status_url=f"/img/jobs/{job_id}",
+    )
+
+
+@router.post('/sync-embeddings-from-s3', response_model=JobSubmitResponse)
+async def sync_embeddings_from_s3(
+    tenant_id: Optional[str] = Form(None),
+    prefix: str = Form(""),
+    force: bool = Form(False)
+):
+    """
+    Queue a background job that mirrors storage into the vector database.
+    
+    Objects are compared with stored vectors by URL and ETag: new or replaced
+    objects are embedded, vectors whose object was deleted are removed, and
+    duplicate rows for one URL are dropped. The diff summary is reported as
+    `result` on `GET /img/jobs/{job_id}`. Safe to call on a schedule: if an
+    identical sync is already queued or running, its id is returned instead.
+    
+    Args:
+        tenant_id: Optional tenant ID - if provided, only syncs images for that tenant
+        prefix: Optional S3 prefix to sync
+        force: Apply deletes even if they exceed SYNC_MAX_DELETE_FRACTION
         
-        if not images:
-            message = "No images found" if not tenant_id else f"No images found for tenant {tenant_id}"
-            return EmbeddingCreationResponse(
-                status="success",
-                message=message,
-                processed_count=0,
-                failed_count=0,
-                details=[]
+    Returns:
+        The id of the queued (or already active) job
+    """
+    params = {'tenant_id': tenant_id, 'prefix': prefix, 'force': force}
+    try:
+        job_id = pg_connect.find_active_job('sync', params)
+        if job_id is not None:
+            return JobSubmitResponse(
+                status="queued",
+                message="Sync job already queued or running",
+                job_id=job_id,
+                status_url=f"/img/jobs/{job_id}",
             )
+        job_id = pg_connect.create_job('sync', params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating sync job: {str(e)}")
+
+    return JobSubmitResponse(
+        status="queued",
+        message="Sync job queued",
+        job_id=job_id,
+        status_url=f"/img/jobs/{job_id}",
+    )
+
+
+@router.post('/reconcile-storage', response_model=JobSubmitResponse)
+async def reconcile_storage(
+    tenant_id: Optional[str] = Form(None),
+    prefix: str = Form(""),
+    fix_vectors: bool = Form(False),
+    fix_objects: bool = Form(False),
+    force: bool = Form(False)
+):
+    """
+    Queue a background job that finds storage objects without a vector and
+    vectors whose object is missing, and optionally deletes them.
+    
+    Storage keys and stored image URLs are walked side by side in sorted order
+    (a streaming merge-join), so the job runs in time linear in the catalog and
+    constant memory. The report (counts and sample orphans) is `result` on
+    `GET /img/jobs/{job_id}`. Objects newer than RECONCILE_GRACE_SECONDS are
+    ignored. If an identical job is already queued or running, its id is returned.
+    
+    Args:
+        tenant_id: Optional tenant ID - if provided, only checks that tenant's images
+        prefix: Optional S3 prefix to check
+        fix_vectors: Delete vectors whose object is missing
+        fix_objects: Delete image objects no vector points to
+        force: Apply fixes even if they exceed RECONCILE_MAX_DELETE_FRACTION
         
-        # Apply limit if specified
-        if limit > 0:
-            images = images[:limit]
-        
-        processed_count = 0
-        failed_count = 0
-        details = []
-        vectors_to_insert = []
-        
-        for img_info in images:
-            try:
-                # Download image from S3
-                image_data = download_from_s3(img_info['key'])
-                
-                # Compute CLIP embedding
-                embedding = compute_clip_embedding(image_data, image_size=224)
-                
-                # Prepare vector data for bulk insert
-                vectors_to_insert.append({
-                    'tenant_id': img_info['tenant_id'],
-                    'style_type': img_info.get('style_type', ''),
-                    'image_url': img_info['url'],
-                    'feature_vector': embedding
-                })
-                
-                processed_count += 1
-                details.append({
-                    'key': img_info['key'],
-                    'status': 'success'
-                })
-                
-            except Exception as e:
-                failed_count += 1
-                details.append({
-                    'key': img_info['key'],
-                    'status': 'failed',
-                    'error': str(e)
-                })
-        
-        # Bulk insert all vectors
-        if vectors_to_insert:
-            pg_connect.bulk_upsert_vectors(vectors_to_insert)
-        
-        return EmbeddingCreationResponse(
-            status="success",
-            message=f"Processed {processed_count} images, {failed_count} failed",
-            processed_count=processed_count,
-            failed_count=failed_count,
-            details=details
-        )
+    Returns:
+        The id of the queued (or already active) job
+    """
+    params = {'tenant_id': tenant_id, 'prefix': prefix, 'fix_vectors': fix_vectors,
+              'fix_objects': fix_objects, 'force': force}
+    try:
+        job_id = pg_connect.find_active_job('reconcile', params)
+        message = "Reconcile job already queued or running"
+        if job_id is None:
+            job_id = pg_connect.create_job('reconcile', params)
+            message = "Reconcile job queued"
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error creating reconcile job: {str(e)}")
+
+    return JobSubmitResponse(
+        status="queued",
+        message=message,
+        job_id=job_id,
+        status_url=f"/img/jobs/{job_id}",
+    )
+
+
+@router.post('/export-vectors', response_model=JobSubmitResponse)
+async def export_vectors(
+    tenant_id: Optional[str] = Form(None),
+    style_number: Optional[str] = Form(None)
+):
+    """
+    Queue a background job that writes a snapshot of the stored vectors to
+    SNAPSHOT_DIR on the server: vectors.npy, metadata.jsonl and manifest.json.
+    
+    Rows are streamed through a server-side cursor, so memory use does not grow
+    with the catalog. The snapshot path and row count are `result` on
+    `GET /img/jobs/{job_id}`; load it with `python vector_snapshot.py import`.
+    
+    Args:
+        tenant_id: Optional tenant ID - if provided, only exports that tenant
+        style_number: Optional style number to export
         
+    Returns:
+        The id of the queued job
+    """
+    params = {'tenant_id': tenant_id, 'style_number': style_number}
+    try:
+        job_id = pg_connect.create_job('export', params)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error creating embeddings: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error creating export job: {str(e)}")
+
+    return JobSubmitResponse(
+        status="queued",
+        message="Export job queued",
+        job_id=job_id,
+        status_url=f"/img/jobs/{job_id}",
+    )
 
 
 # @router.post('/create-all-embeddings', response_model=EmbeddingCreationResponse)
@@ -483,25 +696,58 @@ async def list_s3_images(
 
 
 @router.get('/embedding-stats')
-async def get_embedding_stats(tenant_id: Optional[str] = Query(None)):
+async def get_embedding_stats(tenant_id: Optional[str] = Query(None), approximate: bool = Query(False)):
     """
     Get statistics about stored embeddings.
+
+    Counts come from the trigger-maintained fvector_stats table, so this never
+    scans the vector table.
     
     Args:
         tenant_id: Optional tenant ID to filter stats
+        approximate: Report the planner's row estimate as the total instead
+                     (no table access at all; refreshed by autovacuum/ANALYZE)
         
     Returns:
         Count of embeddings and other stats
     """
     try:
-        total_count = pg_connect.get_vector_count()
+        if approximate:
+            total_count = pg_connect.estimate_vector_count()
+        else:
+            total_count = pg_connect.get_vector_count()
         tenant_count = pg_connect.get_vector_count(tenant_id) if tenant_id else None
         
         return {
             "status": "success",
             "total_embeddings": total_count,
+            "approximate": approximate,
             "tenant_embeddings": tenant_count,
             "tenant_id": tenant_id
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
+
+
+@router.get('/catalog-stats')
+async def get_catalog_stats(tenant_id: Optional[str] = Query(None), limit: int = Query(100, ge=1, le=10000)):
+    """
+    Catalog statistics: image counts, stored bytes and last ingest time.
+
+    Without tenant_id: totals plus the largest `limit` tenants. With tenant_id:
+    that tenant's totals plus its largest `limit` styles. Read from fvector_stats only.
+
+    Args:
+        tenant_id: Optional tenant ID for a per-style breakdown
+        limit: Number of tenants (or styles) to list
+
+    Returns:
+        Totals, the planner's row estimate, and the per-tenant or per-style list
+    """
+    try:
+        stats = await asyncio.to_thread(pg_connect.get_catalog_stats, tenant_id, limit)
+        stats["estimated_rows"] = await asyncio.to_thread(pg_connect.estimate_vector_count)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting stats: {str(e)}")
+    stats["tenant_id"] = tenant_id
+    return stats
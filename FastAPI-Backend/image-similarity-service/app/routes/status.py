@@ -1,5 +1,15 @@
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from app.utils.storage import get_storage
+from app.utils.image_cache import get_image_cache
+from app.utils.shards import ShardError, get_shard_coordinator
+from app.utils.priority import inference_scheduler
+from app.utils import metrics
+from app.database import pg_connect
+from config import settings
 
 status_router = APIRouter()
 
@@ -13,3 +23,78 @@ async def index():
             "description": "Sketch similarity search engine is up and running",
         },
     )
+
+
+@status_router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Request, stage, storage and DB-connect latency histograms in the Prometheus text format."""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="metrics are disabled (METRICS_ENABLED)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@status_router.get("/status/inference")
+async def inference_status():
+    """Report waiting and running CLIP inference work per scheduler lane."""
+    return JSONResponse(status_code=200, content=inference_scheduler.stats())
+
+
+@status_router.get("/status/schema")
+async def schema_status():
+    """Report the applied schema migration version and any pending ones."""
+    try:
+        version = await asyncio.to_thread(pg_connect.schema_version)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading schema version: {str(e)}")
+    return JSONResponse(status_code=200, content=version)
+
+
+@status_router.get("/status/storage")
+async def storage_status():
+    """Report the active storage backend and its per-operation I/O latency."""
+    storage = get_storage()
+    return JSONResponse(
+        status_code=200,
+        content={
+            "backend": storage.name,
+            "latency": storage.latency_stats(),
+        },
+    )
+
+
+@status_router.get("/status/cache")
+async def cache_status():
+    """Report hit rate and bytes saved by the on-disk image cache."""
+    cache = get_image_cache()
+    return JSONResponse(
+        status_code=200,
+        content={
+            "enabled": cache is not None,
+            "stats": cache.stats() if cache is not None else None,
+        },
+    )
+
+
+@status_router.get("/status/shards")
+async def shards_status():
+    """Per-shard health of the sharded index: rows, buckets, memory and search latency."""
+    coordinator = get_shard_coordinator()
+    if coordinator is None:
+        return JSONResponse(status_code=200, content={"enabled": False, "shards": []})
+    shards = await asyncio.to_thread(coordinator.health)
+    return JSONResponse(
+        status_code=200 if all(s["healthy"] for s in shards) else 503,
+        content={"enabled": True, "key": coordinator.key, "shards": shards},
+    )
+
+
+@status_router.post("/status/shards/add")
+async def add_shard():
+    """Start one more shard and move its share of buckets to it (the new shard loads before donors drop)."""
+    coordinator = get_shard_coordinator()
+    if coordinator is None or not coordinator.ready:
+        raise HTTPException(status_code=409, detail="sharded search is disabled or still loading")
+    try:
+        return await asyncio.to_thread(coordinator.add_shard)
+    except ShardError as e:
+        raise HTTPException(status_code=503, detail=str(e))
@@ -0,0 +1,210 @@
+# app/utils/bulk_save.py
+
+import io
+import os
+import csv
+import uuid
+import zipfile
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+
+from config import settings
+from app.database import pg_connect
+from app.utils.priority import inference_lane
+from app.utils.storage import get_storage
+from app.utils.s3_handler import is_image_key
+from app.utils.embedding_extractor import compute_clip_embeddings
+from app.utils.dedup import dhash, find_duplicates, get_phash_index
+from app.utils.pq_index import index_vectors
+from app.utils.shards import index_rows
+from app.utils.uploads import decode_image, max_upload_bytes, sniff_image
+
+
+class BulkSaveError(Exception):
+    """Raised for a malformed bulk request (bad archive/manifest, too many items)."""
+
+
+def new_item(index: int, filename: str, style_number: str, data: Optional[bytes] = None,
+             content_type: Optional[str] = None, error: Optional[str] = None) -> Dict:
+    return {
+        'index': index,
+        'filename': filename,
+        'style_number': style_number,
+        'data': data,
+        'content_type': content_type,
+        'error': error,
+    }
+
+
+def items_from_zip(archive: bytes, manifest: Optional[bytes] = None) -> List[Dict]:
+    """
+    Build bulk save items from a zip of images and a CSV manifest.
+
+    The manifest has a header row with `filename` and `style_number` columns,
+    where `filename` is the path inside the zip. It may be uploaded separately
+    or included in the zip as `manifest.csv`.
+    """
+    try:
+        zf = zipfile.ZipFile(io.BytesIO(archive))
+    except zipfile.BadZipFile:
+        raise BulkSaveError("archive is not a valid zip file")
+
+    with zf:
+        if manifest is None:
+            try:
+                manifest = zf.read('manifest.csv')
+            except KeyError:
+                raise BulkSaveError("no manifest given and archive has no manifest.csv")
+
+        try:
+            rows = list(csv.DictReader(io.StringIO(manifest.decode('utf-8-sig'))))
+        except UnicodeDecodeError:
+            raise BulkSaveError("manifest must be UTF-8 CSV")
+        if rows and not {'filename', 'style_number'} <= set(rows[0]):
+            raise BulkSaveError("manifest needs 'filename' and 'style_number' columns")
+        check_item_count(len(rows))
+
+        max_bytes = max_upload_bytes()
+        items = []
+        for index, row in enumerate(rows):
+            filename = (row.get('filename') or '').strip()
+            style_number = (row.get('style_number') or '').strip()
+            try:
+                info = zf.getinfo(filename)
+            except KeyError:
+                items.append(new_item(index, filename, style_number, error="file not found in archive"))
+                continue
+            # declared size check guards against zip bombs before inflating
+            if info.file_size > max_bytes:
+                items.append(new_item(index, filename, style_number, error="file exceeds size limit"))
+                continue
+            items.append(new_item(index, filename, style_number, data=zf.read(info)))
+        return items
+
+
+def check_item_count(count: int):
+    max_items = int(settings.BULK_SAVE_MAX_ITEMS)
+    if count == 0:
+        raise BulkSaveError("no images given")
+    if count > max_items:
+        raise BulkSaveError(f"too many images ({count}); the limit is {max_items} per request")
+
+
+def save_images_bulk(tenant_id: str, items: List[Dict]) -> List[Dict]:
+    """
+    Upload, embed and store many images at once.
+
+    Uploads run on a thread pool while the images are embedded in CLIP batches;
+    all vectors are then inserted with one multi-row INSERT. A failing item does
+    not fail the request. If the insert itself fails, every uploaded object is
+    removed again.
+
+    Args:
+        tenant_id: Tenant the images belong to
+        items: Items from `new_item` / `items_from_zip`
+
+    Returns:
+        Per-item results in input order: index, filename, style_number, status
+        ('saved' or 'error'), image_id, image_url, error, duplicate_of, embedding_reused
+    """
+    storage = get_storage()
+    results = [
+        {'index': it['index'], 'filename': it['filename'], 'style_number': it['style_number'],
+         'status': 'error', 'image_id': None, 'image_url': None, 'error': it['error'],
+         'duplicate_of': None, 'embedding_reused': False}
+        for it in items
+    ]
+
+    # decode first so corrupt files are never uploaded
+    decoded = []
+    for pos, it in enumerate(items):
+        if it['error']:
+            continue
+        try:
+            buf = io.BytesIO(it['data'])
+            sniff_image(buf)
+            decoded.append((pos, decode_image(buf)))
+        except HTTPException as e:
+            results[pos]['error'] = e.detail
+        except Exception as e:
+            results[pos]['error'] = f"invalid image: {e}"
+
+    def upload(pos):
+        it = items[pos]
+        ext = os.path.splitext(it['filename'])[1].lower() if is_image_key(it['filename']) else '.png'
+        key = f"{tenant_id}/{uuid.uuid4()}{ext}"
+        content_type = it['content_type'] or mimetypes.guess_type(key)[0]
+        return key, storage.put(key, it['data'], content_type)
+
+    uploaded = {}
+    with ThreadPoolExecutor(max_workers=int(settings.BULK_SAVE_UPLOAD_WORKERS)) as pool:
+        futures = {pos: pool.submit(upload, pos) for pos, _ in decoded}
+
+        # embed while the uploads are in flight; near-duplicates of stored
+        # images reuse the stored vector and skip CLIP
+        embeddings = [None] * len(decoded)
+        embed_error = None
+        try:
+            model_id = pg_connect.active_model_id()
+            phashes = [dhash(img) for _, img in decoded]
+            duplicates = find_duplicates(tenant_id, phashes)
+            for i, duplicate in duplicates.items():
+                embeddings[i] = duplicate['vector']
+                results[decoded[i][0]].update(duplicate_of=duplicate['duplicate_of'], embedding_reused=True)
+
+            to_embed = [i for i in range(len(decoded)) if i not in duplicates]
+            with inference_lane('batch', tenant_id):
+                vectors = compute_clip_embeddings([decoded[i][1] for i in to_embed],
+                                                  batch_size=int(settings.BULK_SAVE_BATCH_SIZE),
+                                                  model_name=model_id)
+            for i, vector in zip(to_embed, vectors):
+                embeddings[i] = vector
+        except Exception as e:
+            embed_error = f"error extracting features: {e}"
+
+        for pos, future in futures.items():
+            try:
+                uploaded[pos] = future.result()
+            except Exception as e:
+                results[pos]['error'] = f"error uploading image: {e}"
+
+    rows, row_positions = [], []
+    for i, (pos, _) in enumerate(decoded):
+        if pos not in uploaded:
+            continue
+        if embed_error:
+            results[pos]['error'] = embed_error
+            continue
+        rows.append({
+            'tenant_id': tenant_id,
+            'style_number': items[pos]['style_number'],
+            'image_url': uploaded[pos][1],
+            'feature_vector': embeddings[i],
+            'phash': phashes[i],
+            'model_id': model_id,
+        })
+        row_positions.append(pos)
+
+    try:
+        ids = pg_connect.bulk_upsert_vectors(rows)
+    except Exception as e:
+        ids = None
+        for pos in row_positions:
+            results[pos]['error'] = f"error storing embedding: {e}"
+
+    if ids is None or embed_error:
+        # nothing of this request made it into the DB; remove the uploads
+        storage.delete_many([key for key, _ in uploaded.values()])
+        return results
+
+    phash_index = get_phash_index()
+    for pos, image_id, row in zip(row_positions, ids, rows):
+        results[pos].update({'status': 'saved', 'image_id': image_id,
+                             'image_url': uploaded[pos][1], 'error': None})
+        phash_index.add(tenant_id, image_id, row['phash'])
+    index_vectors(ids, [row['feature_vector'] for row in rows])
+    index_rows([dict(row, id=image_id) for image_id, row in zip(ids, rows)])
+    return results
@@ -0,0 +1,219 @@
+# app/utils/dedup.py
+
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import settings
+from app.database import pg_connect
+from app.utils.feature_extraction import get_feature_vector_pretrained
+
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 grayscale thumbnail.
+
+    Robust to re-compression, resizing and small colour changes, which is what
+    re-exports and repeated shots of a garment mostly differ by.
+    """
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class _TenantHashes:
+    """Multi-index hashing tables for one tenant.
+
+    The 64-bit hash is split into `max_distance + 1` disjoint bit ranges. Two
+    hashes within `max_distance` bits must agree exactly on at least one range
+    (pigeonhole), so a query is one dict lookup per range plus a popcount per
+    candidate instead of a scan.
+    """
+
+    def __init__(self, ranges: List[Tuple[int, int]]):
+        self.ranges = ranges
+        self.hashes: Dict[int, int] = {}
+        self.tables: List[Dict[int, Set[int]]] = [{} for _ in ranges]
+        self.loaded_at = time.monotonic()
+
+    def _parts(self, phash: int):
+        for shift, mask in self.ranges:
+            yield (phash >> shift) & mask
+
+    def add(self, image_id: int, phash: int):
+        self.hashes[image_id] = phash
+        for table, part in zip(self.tables, self._parts(phash)):
+            table.setdefault(part, set()).add(image_id)
+
+    def discard(self, image_id: int):
+        phash = self.hashes.pop(image_id, None)
+        if phash is None:
+            return
+        for table, part in zip(self.tables, self._parts(phash)):
+            bucket = table.get(part)
+            if bucket:
+                bucket.discard(image_id)
+                if not bucket:
+                    del table[part]
+
+    def nearest(self, phash: int, max_distance: int, exclude: Iterable[int] = ()) -> Optional[Tuple[int, int]]:
+        candidates = set()
+        for table, part in zip(self.tables, self._parts(phash)):
+            candidates |= table.get(part, set())
+        candidates.difference_update(exclude)
+
+        best = None
+        for image_id in candidates:
+            distance = hamming(phash, self.hashes[image_id])
+            # closest wins; ties go to the oldest row
+            if distance <= max_distance and (best is None or (distance, image_id) < best):
+                best = (distance, image_id)
+        return (best[1], best[0]) if best else None
+
+
+class PhashIndex:
+    """Per-tenant in-memory near-duplicate index over `fvector_pg.phash`.
+
+    A tenant's hashes are loaded on first lookup and reloaded after
+    `ttl_seconds`, so rows written by other worker processes show up
+    eventually. Rows saved through this process are added immediately.
+    """
+
+    def __init__(self, max_distance: int, ttl_seconds: int):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        count = max_distance + 1
+        widths = [HASH_BITS // count + (1 if i < HASH_BITS % count else 0) for i in range(count)]
+        self._ranges = []
+        shift = 0
+        for width in widths:
+            self._ranges.append((shift, (1 << width) - 1))
+            shift += width
+        self._tenants: Dict[str, _TenantHashes] = {}
+        self._lock = threading.Lock()
+
+    def _tenant(self, tenant_id: str) -> _TenantHashes:
+        with self._lock:
+            index = self._tenants.get(tenant_id)
+            if index is not None and time.monotonic() - index.loaded_at < self.ttl_seconds:
+                return index
+
+        index = _TenantHashes(self._ranges)
+        for image_id, phash in pg_connect.fetch_phashes(tenant_id):
+            index.add(image_id, phash)
+        with self._lock:
+            self._tenants[tenant_id] = index
+        return index
+
+    def find(self, tenant_id: str, phash: int, exclude: Iterable[int] = ()) -> Optional[Tuple[int, int]]:
+        """Return (image_id, hamming_distance) of the closest stored hash within max_distance, or None."""
+        index = self._tenant(tenant_id)
+        with self._lock:
+            return index.nearest(phash, self.max_distance, exclude)
+
+    def add(self, tenant_id: str, image_id: int, phash: Optional[int]):
+        if phash is None:
+            return
+        with self._lock:
+            index = self._tenants.get(tenant_id)
+            if index is not None:
+                index.add(image_id, phash)
+
+    def discard(self, image_id: int):
+        self.discard_many([image_id])
+
+    def discard_many(self, image_ids: Iterable[int]):
+        with self._lock:
+            for image_id in image_ids:
+                for index in self._tenants.values():
+                    index.discard(image_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "tenants_loaded": len(self._tenants),
+                "hashes": sum(len(index.hashes) for index in self._tenants.values()),
+                "max_distance": self.max_distance,
+            }
+
+
+_phash_index: Optional[PhashIndex] = None
+_phash_index_lock = threading.Lock()
+
+
+def get_phash_index() -> PhashIndex:
+    global _phash_index
+    if _phash_index is None:
+        with _phash_index_lock:
+            if _phash_index is None:
+                _phash_index = PhashIndex(
+                    max_distance=int(settings.PHASH_MAX_DISTANCE),
+                    ttl_seconds=int(settings.PHASH_INDEX_TTL_SECONDS),
+                )
+    return _phash_index
+
+
+def find_duplicates(tenant_id: str, phashes: List[int], exclude: Iterable[int] = ()) -> Dict[int, Dict]:
+    """
+    Look up near-duplicates for several hashes and load the matched vectors.
+
+    Returns {position: {'duplicate_of', 'hamming_distance', 'vector'}} for the
+    positions whose duplicate still has a stored vector. Empty if dedup is disabled.
+    """
+    if not settings.PHASH_DEDUP_ENABLED:
+        return {}
+    index = get_phash_index()
+    exclude = set(exclude)
+    matches = {}
+    for pos, phash in enumerate(phashes):
+        match = index.find(tenant_id, phash, exclude)
+        if match is not None:
+            matches[pos] = match
+
+    vectors = pg_connect.fetch_feature_vectors(sorted({image_id for image_id, _ in matches.values()}))
+    for image_id, _ in matches.values():
+        if image_id not in vectors:
+            # deleted by another process since the tenant was loaded
+            index.discard(image_id)
+    return {
+        pos: {'duplicate_of': image_id, 'hamming_distance': distance, 'vector': vectors[image_id]}
+        for pos, (image_id, distance) in matches.items()
+        if image_id in vectors
+    }
+
+
+def embed_with_dedup(tenant_id: str, image: Image.Image, exclude: Iterable[int] = ()) -> Dict:
+    """
+    Hash an image and reuse the CLIP vector of a near-duplicate from the same
+    tenant if there is one; otherwise run CLIP.
+
+    Returns a dict with vector, phash, duplicate_of, hamming_distance and
+    embedding_reused.
+    """
+    phash = dhash(image)
+    duplicate = find_duplicates(tenant_id, [phash], exclude).get(0)
+    if duplicate is not None:
+        return {
+            'vector': duplicate['vector'],
+            'phash': phash,
+            'duplicate_of': duplicate['duplicate_of'],
+            'hamming_distance': duplicate['hamming_distance'],
+            'embedding_reused': True,
+        }
+    return {
+        'vector': get_feature_vector_pretrained(image, i_type=None, tenant_id=tenant_id),
+        'phash': phash,
+        'duplicate_of': None,
+        'hamming_distance': None,
+        'embedding_reused': False,
+    }
@@ -5,30 +5,46 @@ from PIL import Image
 import torch
 from transformers import CLIPModel, CLIPProcessor
 
+from app.database import pg_connect
+from app.utils.metrics import stage
+from app.utils.priority import inference_slot
+
 
 # --- CLIP extractor -------------------------------------------------
-def _load_clip_model(model_name: str = "openai/clip-vit-large-patch14", device: str = None):
-    """Lazy-load CLIP model and processor. Returns (model, processor, device)."""
-    global _clip_model, _clip_processor, _clip_device, _clip_model_name
-    try:
-        _clip_model
-    except NameError:
-        _clip_model = None
-        _clip_processor = None
-        _clip_device = None
-        _clip_model_name = None
+# (model_name, device) -> (model, processor); several models stay loaded while a
+# re-embedding job runs next to request traffic
+_clip_models = {}
+
 
+def _load_clip_model(model_name: str = None, device: str = None):
+    """Lazy-load CLIP model and processor. Returns (model, processor, device).
+
+    `model_name` defaults to the active embedding set (`pg_connect.active_model_id`).
+    """
+    model_name = model_name or pg_connect.active_model_id()
     device = device or ("cuda" if torch.cuda.is_available() else "cpu")
-    if _clip_model is None or _clip_model_name != model_name or _clip_device != device:
-        _clip_model = CLIPModel.from_pretrained(model_name).to(device)
-        _clip_processor = CLIPProcessor.from_pretrained(model_name)
-        _clip_device = device
-        _clip_model_name = model_name
+    key = (model_name, device)
+    if key not in _clip_models:
+        model = CLIPModel.from_pretrained(model_name).to(device)
+        _clip_models[key] = (model, CLIPProcessor.from_pretrained(model_name))
+    model, processor = _clip_models[key]
+    return model, processor, device
 
-    return _clip_model, _clip_processor, _clip_device
+
+def load_rgb_image(image_input) -> Image.Image:
+    """Normalize bytes, file-like, PIL Image or numpy array (H,W,3) to an RGB PIL Image."""
+    if isinstance(image_input, (bytes, bytearray)):
+        return Image.open(io.BytesIO(image_input)).convert("RGB")
+    elif hasattr(image_input, "read"):
+        return Image.open(image_input).convert("RGB")
+    elif isinstance(image_input, Image.Image):
+        return image_input.convert("RGB")
+    else:
+        # assume numpy array
+        return Image.fromarray(image_input.astype("uint8"), mode="RGB")
 
 
-def compute_clip_embedding(image_input, image_size: int = 224, model_name: str = "openai/clip-vit-large-patch14"):
+def compute_clip_embedding(image_input, image_size: int = 224, model_name: str = None):
     """Compute CLIP image embedding for a single image.
 
     image_input: PIL.Image, numpy array (H,W,3), bytes, or BytesIO
@@ -36,21 +52,13 @@ def compute_clip_embedding(image_input, image_size: int = 224, model_name: str =
     """
     model, processor, device = _load_clip_model(model_name)
 
-    # Normalize input to PIL Image
-    if isinstance(image_input, (bytes, bytearray)):
-        img = Image.open(io.BytesIO(image_input)).convert("RGB")
-    elif hasattr(image_input, "read"):
-        img = Image.open(image_input).convert("RGB")
-    elif isinstance(image_input, Image.Image):
-        img = image_input.convert("RGB")
-    else:
-        # assume numpy array
-        img = Image.fromarray(image_input.astype("uint8"), mode="RGB")
+    with stage('preprocess'):
+        img = load_rgb_image(image_input)
 
-    # Processor will resize/center-crop as needed
-    inputs = processor(images=img, return_tensors="pt")
-    inputs = {k: v.to(device) for k, v in inputs.items()}
-    with torch.no_grad():
+        # Processor will resize/center-crop as needed
+        inputs = processor(images=img, return_tensors="pt")
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+    with inference_slot(1), stage('inference'), torch.no_grad():
         img_feats = model.get_image_features(**{"pixel_values": inputs["pixel_values"]})
         img_feats = img_feats / img_feats.norm(p=2, dim=-1, keepdim=True)
         vec = img_feats.cpu().numpy().reshape(-1).astype(np.float32)
@@ -61,3 +69,46 @@ def compute_clip_embedding(image_input, image_size: int = 224, model_name: str =
         vec = vec / norm
     return vec
 
+
+def preprocess_clip_image(image_input, model_name: str = None):
+    """Decode and resize/center-crop/normalize one image for CLIP.
+
+    Runs only the processor (no model forward pass), so it can be done on a
+    separate thread from inference. Returns a (3, H, W) float tensor.
+    """
+    _, processor, _ = _load_clip_model(model_name)
+    with stage('preprocess'):
+        img = load_rgb_image(image_input)
+        return processor(images=img, return_tensors="pt")["pixel_values"][0]
+
+
+def embed_clip_pixels(pixel_values, model_name: str = None):
+    """Run CLIP on a batch of preprocessed images.
+
+    pixel_values: list of (3, H, W) tensors from `preprocess_clip_image`, or a stacked (N, 3, H, W) tensor
+    Returns: numpy.float32 array of shape (N, dim), rows L2-normalized
+    """
+    model, _, device = _load_clip_model(model_name)
+    if isinstance(pixel_values, (list, tuple)):
+        pixel_values = torch.stack(pixel_values)
+    with inference_slot(len(pixel_values)), stage('inference'), torch.no_grad():
+        feats = model.get_image_features(pixel_values=pixel_values.to(device))
+        feats = feats / feats.norm(p=2, dim=-1, keepdim=True)
+    return feats.cpu().numpy().astype(np.float32)
+
+
+def compute_clip_embeddings(images, batch_size: int = 16, model_name: str = None):
+    """Compute CLIP image embeddings for several images in batched forward passes.
+
+    images: list of inputs accepted by `compute_clip_embedding`
+    Returns: numpy.float32 array of shape (len(images), dim), rows L2-normalized
+    """
+    model_name = model_name or pg_connect.active_model_id()  # one model for every batch
+    batches = []
+    for start in range(0, len(images), batch_size):
+        pixels = [preprocess_clip_image(img, model_name) for img in images[start:start + batch_size]]
+        batches.append(embed_clip_pixels(pixels, model_name))
+
+    if not batches:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.concatenate(batches, axis=0)
@@ -1,15 +1,25 @@
 import numpy as np
+from fastapi import HTTPException
 from app.utils.embedding_extractor import compute_clip_embedding
+from app.utils.priority import InferenceQueueFull, inference_lane
 
 
-def get_feature_vector_pretrained(image, i_type):
+def get_feature_vector_pretrained(image, i_type, tenant_id: str = None):
     """Return a CLIP embedding for the provided image.
 
     `image` may be a PIL Image, numpy array, bytes, or file-like object.
     `i_type` is kept for API compatibility but is not used by CLIP.
+    `tenant_id` is the tenant the inference is queued for (fair share within the
+    interactive lane); searches across all tenants leave it empty.
     Returns a 1D numpy.float32 L2-normalized vector.
+    Raises HTTPException(503) if the interactive inference queue is full.
     """
-    return compute_clip_embedding(image, image_size=224)
+    # request-path inference: served ahead of queued batch work
+    try:
+        with inference_lane('interactive', tenant_id):
+            return compute_clip_embedding(image, image_size=224)
+    except InferenceQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
 
 def get_cosine_similarity(image_vector, vector):
@@ -0,0 +1,243 @@
+# app/utils/image_cache.py
+
+import os
+import time
+import uuid
+import hashlib
+import threading
+from typing import Dict, Optional
+
+from config import settings
+from app.utils.storage import StorageBackend, ObjectNotFound
+
+
+class ImageCache:
+    """Bounded on-disk read-through cache for storage objects.
+
+    Layout: `<root>/<h[:2]>/<h>/<sha1(etag)>` where `h` is the sha256 of the
+    object key, so an entry is identified by key + ETag and a replaced object
+    never serves stale bytes once revalidated.
+
+    - Entries younger than `ttl_seconds` (by mtime) are served without touching
+      storage. Older entries are revalidated with a HEAD; a matching ETag
+      refreshes the entry, a different one replaces it.
+    - Reads bump the file's atime explicitly (noatime mounts are common), and
+      eviction removes the least recently read files until the cache fits in
+      `max_bytes`.
+    - Writes go to a unique temp file and are renamed into place, so several
+      worker processes can share one cache directory.
+    """
+
+    def __init__(self, root: str, max_bytes: int, ttl_seconds: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(self.root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._approx_bytes = self._scan_total_bytes()
+        self._counters = {
+            "hits": 0,
+            "revalidated_hits": 0,
+            "misses": 0,
+            "bytes_saved": 0,
+            "bytes_fetched": 0,
+            "evictions": 0,
+            "evicted_bytes": 0,
+        }
+
+    # --- helpers -------------------------------------------------------
+    def _key_dir(self, key: str) -> str:
+        h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, h[:2], h)
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def _entries(self, key_dir: str):
+        try:
+            return [e for e in os.scandir(key_dir) if e.is_file() and not e.name.endswith(".tmp")]
+        except FileNotFoundError:
+            return []
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            st = os.stat(path)
+            # bump atime for LRU, keep mtime (validation time)
+            os.utime(path, (time.time(), st.st_mtime))
+            return data
+        except FileNotFoundError:
+            # evicted by another worker between scandir and open
+            return None
+
+    def _scan_total_bytes(self) -> int:
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                try:
+                    total += os.stat(os.path.join(dirpath, name)).st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _remove_dir_entries(self, key_dir: str, keep: Optional[str] = None):
+        for entry in self._entries(key_dir):
+            if entry.name != keep:
+                try:
+                    size = entry.stat().st_size
+                    os.remove(entry.path)
+                    with self._lock:
+                        self._approx_bytes -= size
+                except FileNotFoundError:
+                    pass
+
+    def _store(self, key_dir: str, etag: str, data: bytes):
+        os.makedirs(key_dir, exist_ok=True)
+        # ETags may contain characters that are awkward in file names
+        name = hashlib.sha1(etag.encode("utf-8")).hexdigest()
+        path = os.path.join(key_dir, name)
+        tmp_path = os.path.join(key_dir, f"{name}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            try:
+                replaced = os.stat(path).st_size  # same key and etag stored again
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+        except OSError:
+            # caching is best effort; the caller already has the bytes
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._remove_dir_entries(key_dir, keep=name)
+        with self._lock:
+            self._approx_bytes += len(data) - replaced
+            over = self._approx_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    # --- public API ----------------------------------------------------
+    def get(self, storage: StorageBackend, key: str) -> bytes:
+        """Return object bytes for `key`, reading through to `storage` on a miss."""
+        key_dir = self._key_dir(key)
+        entries = self._entries(key_dir)
+
+        newest = None
+        for e in entries:
+            try:
+                mtime = e.stat().st_mtime
+            except FileNotFoundError:
+                continue  # evicted by another worker since scandir: a miss
+            if newest is None or mtime > newest[1]:
+                newest = (e, mtime)
+
+        if newest is not None:
+            entry, mtime = newest
+            age = time.time() - mtime
+            if age < self.ttl_seconds:
+                data = self._read(entry.path)
+                if data is not None:
+                    self._count("hits")
+                    self._count("bytes_saved", len(data))
+                    return data
+            else:
+                meta = storage.stat(key)
+                if meta is None:
+                    self._remove_dir_entries(key_dir)
+                    raise ObjectNotFound(f"Object {key} not found")
+                if hashlib.sha1(meta["etag"].encode("utf-8")).hexdigest() == entry.name:
+                    data = self._read(entry.path)
+                    if data is not None:
+                        # mark as validated now
+                        os.utime(entry.path, None)
+                        self._count("revalidated_hits")
+                        self._count("bytes_saved", len(data))
+                        return data
+
+        data, etag = storage.fetch(key)
+        self._count("misses")
+        self._count("bytes_fetched", len(data))
+        self._store(key_dir, etag, data)
+        return data
+
+    def invalidate(self, key: str):
+        """Drop every cached version of `key` (e.g. after a delete or overwrite)."""
+        self._remove_dir_entries(self._key_dir(key))
+
+    def evict(self):
+        """Remove least recently read entries until the cache fits in max_bytes."""
+        if not self._evict_lock.acquire(blocking=False):
+            return  # another thread is already evicting
+        try:
+            files = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith(".tmp"):
+                        continue  # being written; another worker is about to rename it into place
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_atime, st.st_size, path))
+
+            total = sum(size for _, size, _ in files)
+            # evict down to 90% so we don't rescan on every subsequent write
+            target = int(self.max_bytes * 0.9)
+            files.sort()
+            for _, size, path in files:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    self._count("evictions")
+                    self._count("evicted_bytes", size)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+            with self._lock:
+                self._approx_bytes = total
+        finally:
+            self._evict_lock.release()
+
+    def stats(self) -> Dict:
+        """Counters for this process plus the current (approximate) cache size."""
+        with self._lock:
+            counters = dict(self._counters)
+            size = self._approx_bytes
+        hits = counters["hits"] + counters["revalidated_hits"]
+        lookups = hits + counters["misses"]
+        counters.update({
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+        })
+        return counters
+
+
+_image_cache: Optional[ImageCache] = None
+_image_cache_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """Return the process-wide image cache, or None if caching is disabled."""
+    global _image_cache
+    if not settings.IMAGE_CACHE_ENABLED:
+        return None
+    if _image_cache is None:
+        with _image_cache_lock:
+            if _image_cache is None:
+                _image_cache = ImageCache(
+                    root=settings.IMAGE_CACHE_DIR,
+                    max_bytes=int(settings.IMAGE_CACHE_MAX_MB) * 1024 * 1024,
+                    ttl_seconds=int(settings.IMAGE_CACHE_TTL_SECONDS),
+                )
+    return _image_cache
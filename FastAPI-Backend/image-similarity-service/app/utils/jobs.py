@@ -0,0 +1,521 @@
+# app/utils/jobs.py
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from config import settings
+from app.database import embedding_sets, pg_connect
+from app.utils.priority import inference_lane
+from app.utils.s3_handler import iter_images_from_s3, download_from_s3, delete_many_from_s3, key_from_url
+from app.utils.embedding_extractor import compute_clip_embeddings, load_rgb_image
+from app.utils.dedup import dhash, get_phash_index
+from app.utils.pq_index import discard_vectors, index_vectors
+from app.utils.shards import discard_rows, index_rows
+from app.utils.sync import compute_sync_diff, check_delete_limit, format_sync_summary
+from app.utils.reconcile import scan_orphans, check_fix_limit, fix_orphans, format_reconcile_report
+from app.utils.snapshot import export_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job handler when the job was cancelled or taken over."""
+
+
+JOB_HANDLERS: Dict[str, Callable] = {}
+
+
+def job_handler(kind: str):
+    """Register a function as the handler for jobs of the given kind."""
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class JobContext:
+    """Handle passed to job handlers for checkpointing, heartbeats and throttling."""
+
+    def __init__(self, job: Dict, worker_id: str):
+        self.job = job
+        self.worker_id = worker_id
+        self.params = job.get("params") or {}
+        self._last_heartbeat = time.monotonic()
+
+    @property
+    def job_id(self) -> int:
+        return self.job["id"]
+
+    @property
+    def checkpoint(self) -> Optional[str]:
+        return self.job.get("checkpoint")
+
+    @property
+    def consumed(self) -> int:
+        """Manifest items already committed (successful or failed)."""
+        return (self.job.get("processed") or 0) + (self.job.get("failed") or 0)
+
+    def _check_status(self, status: Optional[str]):
+        if status is None:
+            raise JobCancelled("job was taken over by another worker")
+        if status == "cancelling":
+            raise JobCancelled("job was cancelled")
+
+    def heartbeat(self):
+        """Refresh the job heartbeat (at most every few seconds) and honour cancellation."""
+        now = time.monotonic()
+        if now - self._last_heartbeat < 5:
+            return
+        self._last_heartbeat = now
+        self._check_status(pg_connect.heartbeat_job(self.job_id, self.worker_id))
+
+    def set_total(self, total: int):
+        pg_connect.set_job_total(self.job_id, total)
+        self.job["total"] = total
+
+    def commit_chunk(self, vectors_data: List[Dict], checkpoint: Optional[str],
+                     processed: int, failed: int = 0, errors: Optional[List[Dict]] = None,
+                     delete_ids: Optional[List[int]] = None):
+        """Persist a chunk of results (and the rows they replace) together with the new checkpoint."""
+        status, ids = pg_connect.commit_job_chunk(
+            self.job_id, self.worker_id, vectors_data, checkpoint, processed, failed, errors, delete_ids
+        )
+        if status is not None:
+            # keep this process's in-memory indexes in step with the committed chunk
+            phash_index = get_phash_index()
+            phash_index.discard_many(delete_ids or [])
+            for image_id, row in zip(ids, vectors_data):
+                phash_index.add(row['tenant_id'], image_id, row.get('phash'))
+            discard_vectors(delete_ids or [])
+            index_vectors(ids, [row['feature_vector'] for row in vectors_data])
+            discard_rows(delete_ids or [])
+            index_rows([dict(row, id=image_id) for image_id, row in zip(ids, vectors_data)])
+        self.job["processed"] = (self.job.get("processed") or 0) + processed
+        self.job["failed"] = (self.job.get("failed") or 0) + failed
+        if checkpoint is not None:
+            self.job["checkpoint"] = checkpoint
+        self._last_heartbeat = time.monotonic()
+        self._check_status(status)
+
+    def commit_purge_chunk(self, tenant_id: str, style_number: Optional[str], limit: int,
+                           delete_objects: Callable[[List[str]], List[str]]) -> List[int]:
+        """Delete a chunk of rows and their objects and count them, in one transaction (see pg_connect.purge_job_chunk)."""
+        ids, failed, status = pg_connect.purge_job_chunk(
+            self.job_id, self.worker_id, tenant_id, style_number, limit, delete_objects
+        )
+        self.job["processed"] = (self.job.get("processed") or 0) + len(ids) - failed
+        self.job["failed"] = (self.job.get("failed") or 0) + failed
+        self._last_heartbeat = time.monotonic()
+        self._check_status(status)
+        return ids
+
+    def throttle(self):
+        """Pause (JOB_BATCH_PAUSE_MS) and heartbeat before the next unit of batch work.
+
+        Yielding to interactive requests happens in the inference scheduler: the job
+        runs in the batch lane (see `JobRunner.run_job`).
+        """
+        pause = float(settings.JOB_BATCH_PAUSE_MS) / 1000.0
+        if pause > 0:
+            time.sleep(pause)
+        self.heartbeat()
+
+
+class JobRunner:
+    """Polls `ingest_jobs` and runs claimed jobs one at a time in a daemon thread.
+
+    Every service process may run a JobRunner; claiming uses SKIP LOCKED so a
+    job is only ever worked on by one of them. A job whose worker stops
+    heartbeating (crash, redeploy) is picked up again and resumes from its last
+    committed checkpoint.
+    """
+
+    def __init__(self, poll_seconds: float, stale_after_seconds: int):
+        self.poll_seconds = poll_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-runner", daemon=True)
+        self._thread.start()
+        logger.info("Job runner %s started", self.worker_id)
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                job = pg_connect.claim_job(self.worker_id, self.stale_after_seconds)
+            except Exception as e:
+                logger.error(f"Error claiming job: {e}")
+                job = None
+
+            if job is None:
+                self._stop.wait(self.poll_seconds)
+                continue
+
+            self.run_job(job)
+
+    def run_job(self, job: Dict):
+        handler = JOB_HANDLERS.get(job["kind"])
+        ctx = JobContext(job, self.worker_id)
+        if handler is None:
+            pg_connect.finish_job(job["id"], self.worker_id, "failed", f"Unknown job kind: {job['kind']}")
+            return
+
+        logger.info("Running job %s (%s) from checkpoint %r", job["id"], job["kind"], job.get("checkpoint"))
+        try:
+            with inference_lane('batch', ctx.params.get("tenant_id")):
+                handler(ctx)
+        except JobCancelled as e:
+            logger.info("Job %s stopped: %s", job["id"], e)
+            pg_connect.finish_job(job["id"], self.worker_id, "cancelled", str(e))
+        except Exception as e:
+            logger.exception("Job %s failed", job["id"])
+            pg_connect.finish_job(job["id"], self.worker_id, "failed", str(e))
+        else:
+            pg_connect.finish_job(job["id"], self.worker_id, "completed")
+
+
+_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(
+            poll_seconds=float(settings.JOB_POLL_SECONDS),
+            stale_after_seconds=int(settings.JOB_STALE_AFTER_SECONDS),
+        )
+    return _runner
+
+
+def job_summary(job: Dict) -> Dict:
+    """JSON-friendly view of a job row with progress and throughput."""
+    total = job.get("total")
+    processed = job.get("processed") or 0
+    failed = job.get("failed") or 0
+    done = processed + failed
+
+    throughput = None
+    started_at, updated_at = job.get("started_at"), job.get("updated_at")
+    if started_at and updated_at and updated_at > started_at:
+        elapsed = (updated_at - started_at).total_seconds()
+        throughput = round((job.get("run_processed") or 0) / elapsed, 3)
+
+    eta_seconds = None
+    if total and throughput and job.get("status") == "running":
+        eta_seconds = round(max(total - done, 0) / throughput, 1)
+
+    def iso(value):
+        return value.isoformat() if value else None
+
+    return {
+        "job_id": job["id"],
+        "kind": job["kind"],
+        "status": job["status"],
+        "params": job.get("params") or {},
+        "total": total,
+        "processed": processed,
+        "failed": failed,
+        "progress": round(done / total, 4) if total else None,
+        "throughput_images_per_s": throughput,
+        "eta_seconds": eta_seconds,
+        "checkpoint": job.get("checkpoint"),
+        "error": job.get("error"),
+        "recent_errors": job.get("errors") or [],
+        "result": job.get("result"),
+        "created_at": iso(job.get("created_at")),
+        "started_at": iso(job.get("started_at")),
+        "updated_at": iso(job.get("updated_at")),
+        "finished_at": iso(job.get("finished_at")),
+    }
+
+
+# --- Job kinds ---------------------------------------------------------------
+
+def _embed_chunk(ctx: JobContext, pool: ThreadPoolExecutor, chunk: List[Dict], batch_size: int):
+    """Download, decode and embed a chunk of image infos. Returns (vectors, errors)."""
+    def fetch(img_info):
+        try:
+            return img_info, load_rgb_image(download_from_s3(img_info['key'])), None
+        except Exception as e:
+            return img_info, None, str(e)
+
+    decoded = list(pool.map(fetch, chunk))
+    ok = [(info, img) for info, img, err in decoded if err is None]
+    errors = [{'key': info['key'], 'error': err} for info, _, err in decoded if err is not None]
+
+    vectors = []
+    for batch in chunked(ok, batch_size):
+        ctx.throttle()
+        # stamp the model actually used, in case the active set switches before the commit
+        model_id = pg_connect.active_model_id()
+        embeddings = compute_clip_embeddings([img for _, img in batch], batch_size=batch_size, model_name=model_id)
+        for (info, img), embedding in zip(batch, embeddings):
+            # style_number is the layout code, not the style_type path segment
+            vectors.append({
+                'tenant_id': info['tenant_id'],
+                'style_number': info['layout_code'],
+                'image_url': info['url'],
+                'feature_vector': embedding,
+                'etag': info.get('etag'),
+                'phash': dhash(img),
+                'model_id': model_id,
+            })
+    return vectors, errors
+
+
+@job_handler("ingest")
+def run_ingest_job(ctx: JobContext):
+    """Embed every image under a prefix/tenant and insert it into fvector_pg.
+
+    params: prefix, tenant_id, limit (0 = all). The manifest is the sorted
+    storage listing; the checkpoint is the last key of the last committed chunk.
+    """
+    prefix = ctx.params.get("prefix") or ""
+    tenant_id = ctx.params.get("tenant_id")
+    limit = int(ctx.params.get("limit") or 0)
+    chunk_size = int(settings.JOB_CHUNK_SIZE)
+    batch_size = int(settings.JOB_BATCH_SIZE)
+
+    if ctx.job.get("total") is None:
+        total = 0
+        for _ in iter_images_from_s3(prefix=prefix, tenant_id=tenant_id):
+            total += 1
+            if limit and total >= limit:
+                break
+        ctx.set_total(total)
+
+    remaining = limit - ctx.consumed if limit else None
+    if remaining is not None and remaining <= 0:
+        return
+
+    manifest = iter_images_from_s3(prefix=prefix, tenant_id=tenant_id, start_after=ctx.checkpoint or "")
+
+    with ThreadPoolExecutor(max_workers=int(settings.JOB_DOWNLOAD_WORKERS)) as pool:
+        for chunk in chunked(manifest, chunk_size):
+            if remaining is not None:
+                chunk = chunk[:remaining]
+
+            vectors, errors = _embed_chunk(ctx, pool, chunk, batch_size)
+            ctx.commit_chunk(vectors, checkpoint=chunk[-1]['key'],
+                             processed=len(vectors), failed=len(errors), errors=errors)
+
+            if remaining is not None:
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+
+
+@job_handler("sync")
+def run_sync_job(ctx: JobContext):
+    """Mirror storage adds, changes and deletes into fvector_pg.
+
+    params: prefix, tenant_id, force (skip the mass-delete guard). Each run
+    recomputes the diff, so a resumed job only sees what is still out of sync.
+    Replacements insert the new vector and delete the old row in one chunk commit.
+    """
+    diff = compute_sync_diff(prefix=ctx.params.get("prefix") or "", tenant_id=ctx.params.get("tenant_id"))
+    check_delete_limit(diff, force=bool(ctx.params.get("force")))
+    pg_connect.set_job_result(ctx.job_id, diff["summary"])
+    logger.info("Sync job %s: %s", ctx.job_id, format_sync_summary(diff["summary"]))
+
+    ctx.set_total(ctx.consumed + len(diff["to_embed"]))
+    pg_connect.set_vector_etags(diff["to_adopt"])
+    deleted = pg_connect.delete_vectors_by_ids(diff["to_delete"])
+    get_phash_index().discard_many(deleted)
+    discard_vectors(deleted)
+    discard_rows(deleted)
+
+    chunk_size = int(settings.JOB_CHUNK_SIZE)
+    batch_size = int(settings.JOB_BATCH_SIZE)
+    with ThreadPoolExecutor(max_workers=int(settings.JOB_DOWNLOAD_WORKERS)) as pool:
+        for chunk in chunked(diff["to_embed"], chunk_size):
+            vectors, errors = _embed_chunk(ctx, pool, chunk, batch_size)
+            embedded = {v['image_url'] for v in vectors}
+            # only drop the old row once its replacement made it in
+            delete_ids = [i for info in chunk if info['url'] in embedded for i in info.get('replace_ids', [])]
+            ctx.commit_chunk(vectors, checkpoint=chunk[-1]['key'], processed=len(vectors),
+                             failed=len(errors), errors=errors, delete_ids=delete_ids)
+
+
+def delete_image_objects(image_urls: List[str]) -> List[str]:
+    """Delete the stored objects behind `image_urls`. Returns the URLs whose object could not be deleted."""
+    urls_by_key = {key_from_url(url): url for url in image_urls}
+    return [urls_by_key[key] for key in delete_many_from_s3(list(urls_by_key))]
+
+
+@job_handler("purge")
+def run_purge_job(ctx: JobContext):
+    """Delete all vectors (and their stored images) of a tenant, optionally only one style.
+
+    params: tenant_id, style_number. Works in chunks of PURGE_CHUNK_SIZE rows by
+    ascending id; there is no checkpoint because deleted rows simply stop matching.
+    """
+    tenant_id = ctx.params["tenant_id"]
+    style_number = ctx.params.get("style_number")
+    chunk_size = int(settings.PURGE_CHUNK_SIZE)
+
+    if ctx.job.get("total") is None:
+        ctx.set_total(pg_connect.get_vector_count(tenant_id, style_number))
+
+    phash_index = get_phash_index()
+    while True:
+        ctx.heartbeat()
+        ids = ctx.commit_purge_chunk(tenant_id, style_number, chunk_size, delete_image_objects)
+        phash_index.discard_many(ids)
+        discard_vectors(ids)
+        discard_rows(ids)
+        if not ids:
+            break
+
+
+@job_handler("reconcile")
+def run_reconcile_job(ctx: JobContext):
+    """Report (and optionally delete) objects without vectors and vectors without objects.
+
+    params: prefix, tenant_id, fix_vectors, fix_objects, force. The first pass
+    only reports; fixes re-scan and re-check every orphan before deleting it, so
+    anything repaired in between is left alone.
+    """
+    prefix = ctx.params.get("prefix") or ""
+    tenant_id = ctx.params.get("tenant_id")
+    fix_vectors = bool(ctx.params.get("fix_vectors"))
+    fix_objects = bool(ctx.params.get("fix_objects"))
+
+    report = scan_orphans(prefix, tenant_id, heartbeat=ctx.heartbeat)
+    pg_connect.set_job_result(ctx.job_id, {'report': report})
+    logger.info("Reconcile job %s: %s", ctx.job_id, format_reconcile_report(report))
+    if not (fix_vectors or fix_objects):
+        return
+
+    check_fix_limit(report, force=bool(ctx.params.get("force")))
+    fixed = fix_orphans(prefix, tenant_id, fix_vectors=fix_vectors, fix_objects=fix_objects,
+                        heartbeat=ctx.heartbeat)
+    pg_connect.set_job_result(ctx.job_id, {'report': report, 'fixed': fixed})
+
+
+@job_handler("export")
+def run_export_job(ctx: JobContext):
+    """Write a vector snapshot (see app/utils/snapshot.py) under SNAPSHOT_DIR.
+
+    params: tenant_id, style_number. An interrupted export starts over; the
+    snapshot directory only appears once it is complete.
+    """
+    tenant_id = ctx.params.get("tenant_id")
+    style_number = ctx.params.get("style_number")
+    out_dir = os.path.join(settings.SNAPSHOT_DIR, f"export-{ctx.job_id}")
+
+    manifest = export_snapshot(out_dir, tenant_id=tenant_id, style_number=style_number,
+                               on_batch=lambda rows: ctx.heartbeat())
+    pg_connect.set_job_result(ctx.job_id, dict(manifest, path=os.path.abspath(out_dir)))
+
+
+def _embed_rows(ctx: Optional[JobContext], pool: ThreadPoolExecutor, rows: List[tuple],
+                model_id: str, batch_size: int):
+    """Download and embed (id, image_url) rows with `model_id`. Returns ({id: vector}, errors)."""
+    def fetch(row):
+        try:
+            return row, load_rgb_image(download_from_s3(key_from_url(row[1]))), None
+        except Exception as e:
+            return row, None, str(e)
+
+    decoded = list(pool.map(fetch, rows))
+    ok = [(row[0], img) for row, img, err in decoded if err is None]
+    errors = [{'id': row[0], 'url': row[1], 'error': err} for row, _, err in decoded if err is not None]
+
+    vectors = {}
+    for batch in chunked(ok, batch_size):
+        if ctx is not None:
+            ctx.throttle()
+        embeddings = compute_clip_embeddings([img for _, img in batch], batch_size=batch_size, model_name=model_id)
+        vectors.update((row_id, embedding) for (row_id, _), embedding in zip(batch, embeddings))
+    return vectors, errors
+
+
+@job_handler("reembed")
+def run_reembed_job(ctx: JobContext):
+    """Fill the embedding set of another model in the background, then optionally switch to it.
+
+    params: model_id, activate. Rows are read by ascending id (the checkpoint is
+    the last id stored); search keeps using the active set meanwhile. A final pass
+    from the start catches rows written during the run. If every row was embedded
+    and activate is set, `embedding_sets.activate` switches in one transaction,
+    embedding the stragglers under the lock. Writers that embedded with the old
+    model just before the switch are repaired by a last pass once every process
+    has seen the new model (EMBEDDING_SET_REFRESH_SECONDS).
+    """
+    model_id = ctx.params["model_id"]
+    activate = bool(ctx.params.get("activate"))
+    chunk_size = int(settings.JOB_CHUNK_SIZE)
+    batch_size = int(settings.JOB_BATCH_SIZE)
+
+    embedding_sets.create_set(model_id)
+    if ctx.job.get("total") is None:
+        ctx.set_total(embedding_sets.count_missing(model_id))
+
+    failed_ids = set()
+
+    def sweep(after_id: int, checkpointed: bool):
+        with ThreadPoolExecutor(max_workers=int(settings.JOB_DOWNLOAD_WORKERS)) as pool:
+            while True:
+                ctx.heartbeat()
+                rows = embedding_sets.missing_rows(model_id, after_id, chunk_size)
+                if not rows:
+                    return
+                after_id = rows[-1][0]
+                rows = [r for r in rows if r[0] not in failed_ids]
+                vectors, errors = _embed_rows(ctx, pool, rows, model_id, batch_size)
+                stored, replaced = embedding_sets.store_vectors(model_id, list(vectors), list(vectors.values()))
+                index_vectors(replaced, [vectors[i] for i in replaced])
+                failed_ids.update(e['id'] for e in errors)
+                ctx.commit_chunk([], checkpoint=str(after_id) if checkpointed else None,
+                                 processed=stored, failed=len(errors), errors=errors)
+
+    sweep(int(ctx.checkpoint or 0), checkpointed=True)
+    sweep(0, checkpointed=False)
+    result = {'model_id': model_id, 'missing': embedding_sets.count_missing(model_id), 'activated': False}
+    if activate and not failed_ids:
+        def embed_missing(rows):
+            with ThreadPoolExecutor(max_workers=int(settings.JOB_DOWNLOAD_WORKERS)) as pool:
+                return _embed_rows(None, pool, rows, model_id, batch_size)[0]
+
+        switch = embedding_sets.activate(model_id, embed_missing,
+                                         max_missing=int(settings.REEMBED_ACTIVATE_MAX_MISSING))
+        result.update(activated=True, switch=switch)
+        pg_connect.set_job_result(ctx.job_id, result)
+        # rows written with the old model by processes that had not seen the switch yet
+        deadline = time.monotonic() + 2 * float(settings.EMBEDDING_SET_REFRESH_SECONDS)
+        while time.monotonic() < deadline:
+            ctx.heartbeat()
+            time.sleep(1)
+        sweep(0, checkpointed=False)
+        result['missing'] = embedding_sets.count_missing(model_id)
+    elif activate:
+        result['error'] = f"not activated: {len(failed_ids)} images could not be embedded"
+    pg_connect.set_job_result(ctx.job_id, result)
+    logger.info("Re-embed job %s: %s", ctx.job_id, result)
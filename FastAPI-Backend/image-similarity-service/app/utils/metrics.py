@@ -0,0 +1,200 @@
+# app/utils/metrics.py
+"""
+Per-stage request timing and Prometheus metrics.
+
+Code paths wrap their work in `stage(name)`; each timing goes to the
+`image_stage_seconds` histogram and, while a request is being served, to that
+request's list of stages, which the middleware in `create_app` returns as a
+`Server-Timing` header (repeated stages, e.g. one storage fetch per result, are
+summed). The stage list lives in a context variable, so work handed to
+`asyncio.to_thread` is attributed to the request that started it.
+
+`/metrics` serves every metric registered here in the Prometheus text format.
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+
+# seconds; covers a cache hit (<1 ms) up to a cold CLIP load
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def _render_value(self, key, value) -> List[str]:
+        counts, total = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            le = 'le="%s"' % bound
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format (0.0.4)."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- metrics recorded by the service ----------------------------------------
+REQUEST_SECONDS = Histogram('image_request_seconds', 'HTTP request latency', ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('image_requests_in_flight', 'HTTP requests being served')
+STAGE_SECONDS = Histogram('image_stage_seconds', 'Time spent in a named stage of a request or job', ('stage',))
+STAGE_ERRORS = Counter('image_stage_errors_total', 'Stages that raised', ('stage',))
+STORAGE_SECONDS = Histogram('image_storage_op_seconds', 'Storage backend call latency', ('backend', 'op'))
+STORAGE_QUEUE_SECONDS = Histogram('image_storage_queue_seconds', 'Wait for a thread before an async storage call starts', ('op',))
+DB_CONNECT_SECONDS = Histogram('image_db_connect_seconds', 'Time to open a Postgres connection')
+
+
+def route_label(scope) -> str:
+    """
+    Path template of the matched route ("/img/jobs/{job_id}"), so that ids do not
+    become label values. Routes of an included router may report their path
+    without the router prefix; the prefix is taken back from the request path.
+    """
+    route = scope.get('route')
+    if route is None:
+        return 'unmatched'
+    path = scope.get('path', '')
+    try:
+        concrete = route.path_format.format(**scope.get('path_params', {}))
+    except (AttributeError, KeyError, IndexError, ValueError):
+        return route.path
+    prefix = path[:-len(concrete)] if concrete and path.endswith(concrete) else ''
+    return prefix + route.path
+
+
+# --- per-request stages ------------------------------------------------------
+_stages: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar('image_request_stages', default=None)
+
+
+def begin_request():
+    """Start collecting stages for the current request; returns a token for `end_request`."""
+    return _stages.set([])
+
+
+def end_request(token) -> List[Tuple[str, float]]:
+    stages = _stages.get() or []
+    _stages.reset(token)
+    return stages
+
+
+def record_stage(name: str, seconds: float):
+    """Record a stage timed elsewhere (histogram, plus the current request if any)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    stages = _stages.get()
+    if stages is not None:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as stage `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def server_timing(stages: List[Tuple[str, float]], total: Optional[float] = None) -> str:
+    """`Server-Timing` header value: one entry per stage name (durations summed, in ms)."""
+    merged: Dict[str, List[float]] = {}
+    for name, seconds in stages:
+        entry = merged.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [
+        f'{name};dur={seconds * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else '')
+        for name, (seconds, count) in merged.items()
+    ]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
@@ -0,0 +1,455 @@
+# app/utils/pq_index.py
+"""
+In-process IVF-PQ index for retrieval='pq' searches.
+
+Vectors are L2-normalised (so L2 order is cosine order), assigned to the nearest
+of `nlist` coarse centroids, and the residual is product-quantized: split into `m`
+sub-vectors, each replaced by the index (uint8) of its nearest of 256 sub-centroids.
+A 768-dim vector takes m bytes of codes plus an 8-byte id instead of 3 KB.
+
+A search probes the `nprobe` lists nearest to the query, scores their codes with
+one lookup table per list (m x 256 partial distances, summed with numpy fancy
+indexing), and reranks the best `top_k * PQ_RERANK_FACTOR` candidates by exact
+cosine on the full vectors, read from fvector_pg or from the memory-mapped snapshot
+the index was built from (PQ_RERANK_SOURCE).
+
+The index is built offline (build_pq_index.py) and loaded from PQ_INDEX_PATH. Saves
+and updates through this process (including its jobs) are applied immediately;
+rows inserted or updated elsewhere are picked up every PQ_INDEX_REFRESH_SECONDS by
+the transaction that wrote them (see `catch_up`).
+"""
+
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from app.database import pg_connect
+from app.utils.snapshot import load_snapshot
+
+
+KSUB = 256  # sub-centroids per sub-quantizer (uint8 codes)
+ENCODE_CHUNK = 512  # rows encoded per step (bounds the n x m x 256 distance block)
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+
+def _nearest(x: np.ndarray, centroids: np.ndarray, chunk: int = 4096) -> np.ndarray:
+    """Index of the nearest centroid (L2) for each row of x."""
+    c_norms = (centroids ** 2).sum(1)
+    out = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk):
+        block = x[start:start + chunk]
+        out[start:start + chunk] = np.argmin(c_norms[None, :] - 2 * block @ centroids.T, axis=1)
+    return out
+
+
+def _cluster_sums(x: np.ndarray, assign: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-cluster (sum of rows, row count) for an assignment; empty clusters sum to 0."""
+    counts = np.bincount(assign, minlength=k)
+    sums = np.empty((k, x.shape[1]), dtype=np.float64)
+    for d in range(x.shape[1]):
+        sums[:, d] = np.bincount(assign, weights=x[:, d], minlength=k)
+    return sums, counts
+
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; empty clusters are reseeded from random points."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = _nearest(x, centroids)
+        sums, counts = _cluster_sums(x, assign, k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), len(empty), replace=False)]
+    return centroids
+
+
+class _InvertedList:
+    """Ids and PQ codes of one coarse cell, in arrays that grow by doubling."""
+
+    def __init__(self, m: int, ids: Optional[np.ndarray] = None, codes: Optional[np.ndarray] = None):
+        self.ids = ids if ids is not None else np.empty(0, dtype=np.int64)
+        self.codes = codes if codes is not None else np.empty((0, m), dtype=np.uint8)
+        self.size = len(self.ids)
+
+    def append(self, ids: np.ndarray, codes: np.ndarray):
+        needed = self.size + len(ids)
+        if needed > len(self.ids):
+            capacity = max(needed, 2 * len(self.ids), 16)
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_codes = np.empty((capacity, self.codes.shape[1]), dtype=np.uint8)
+            grown_ids[:self.size] = self.ids[:self.size]
+            grown_codes[:self.size] = self.codes[:self.size]
+            self.ids, self.codes = grown_ids, grown_codes
+        self.ids[self.size:needed] = ids
+        self.codes[self.size:needed] = codes
+        self.size = needed
+
+    def remove(self, ids: np.ndarray) -> int:
+        keep = ~np.isin(self.ids[:self.size], ids)
+        removed = self.size - int(keep.sum())
+        if removed:
+            kept = int(keep.sum())
+            self.ids[:kept] = self.ids[:self.size][keep]
+            self.codes[:kept] = self.codes[:self.size][keep]
+            self.size = kept
+        return removed
+
+
+class IVFPQIndex:
+    """Inverted-file index with product-quantized residuals (see module docstring)."""
+
+    def __init__(self, dim: int, nlist: int, m: int):
+        if dim % m:
+            raise ValueError(f"m={m} must divide the vector dimension {dim}")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.centroids: Optional[np.ndarray] = None  # (nlist, dim)
+        self.codebooks: Optional[np.ndarray] = None  # (m, 256, dsub)
+        self.lists: List[_InvertedList] = []
+        self.max_id = 0  # highest id indexed (builds and catch-up advance it)
+        self.change_horizon: Optional[int] = None  # pg_connect.change_horizon() of the last build/catch-up
+        self.snapshot_dir: Optional[str] = None  # full-precision vectors for reranking
+        self.snapshot_ids: Optional[np.ndarray] = None  # row ids of the snapshot (sorted)
+        self.snapshot_stale: set = set()  # ids changed since the snapshot was taken
+        self._snapshot_vectors: Optional[np.ndarray] = None
+        self._lock = threading.RLock()
+        self.refreshed_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return sum(lst.size for lst in self.lists)
+
+    # --- building ---------------------------------------------------------
+
+    def train(self, sample: np.ndarray, iters: int = 20, seed: int = 0):
+        """Learn coarse centroids and sub-quantizer codebooks from a sample of vectors."""
+        x = _normalize(sample)
+        self.centroids = _kmeans(x, self.nlist, iters, seed)
+        self.nlist = len(self.centroids)  # fewer if the sample is smaller than nlist
+        residuals = (x - self.centroids[_nearest(x, self.centroids)]).reshape(len(x), self.m, self.dsub)
+        books = []
+        for j in range(self.m):
+            book = _kmeans(residuals[:, j], KSUB, iters, seed + j + 1)
+            if len(book) < KSUB:  # tiny samples: pad with copies so every code is valid
+                book = np.concatenate([book, np.repeat(book[:1], KSUB - len(book), axis=0)])
+            books.append(book)
+        self.codebooks = np.stack(books).astype(np.float32)
+        self.lists = [_InvertedList(self.m) for _ in range(self.nlist)]
+
+    def _encode(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(list number, uint8 codes [n, m]) for normalised vectors."""
+        assign = _nearest(x, self.centroids)
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        book_norms = (self.codebooks ** 2).sum(-1)  # (m, 256)
+        for start in range(0, len(x), ENCODE_CHUNK):
+            block = x[start:start + ENCODE_CHUNK]
+            residual = (block - self.centroids[assign[start:start + ENCODE_CHUNK]]).reshape(len(block), self.m, self.dsub)
+            # (m, n, dsub) @ (m, dsub, 256): one small matmul per sub-quantizer
+            dots = np.matmul(residual.transpose(1, 0, 2), self.codebooks.transpose(0, 2, 1))
+            codes[start:start + ENCODE_CHUNK] = np.argmin(book_norms[:, None, :] - 2 * dots, axis=2).T
+        return assign, codes
+
+    def add(self, ids: Iterable[int], vectors: np.ndarray):
+        """Encode and append vectors. Ids must not already be in the index (use `update`)."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        assign, codes = self._encode(_normalize(vectors))
+        order = np.argsort(assign, kind='stable')
+        bounds = np.flatnonzero(np.diff(assign[order])) + 1
+        with self._lock:
+            for group in np.split(order, bounds):
+                self.lists[assign[group[0]]].append(ids[group], codes[group])
+
+    def discard(self, ids: Iterable[int]) -> int:
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return 0
+        with self._lock:
+            if self.snapshot_ids is not None:
+                self.snapshot_stale.update(int(i) for i in ids)
+            return sum(lst.remove(ids) for lst in self.lists)
+
+    def update(self, ids: Iterable[int], vectors: np.ndarray):
+        """Replace (or add) the entries of these ids."""
+        ids = list(ids)
+        with self._lock:
+            self.discard(ids)
+            self.add(ids, vectors)
+
+    # --- searching --------------------------------------------------------
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate nearest ids and their estimated squared L2 distances (normalised space)."""
+        q = _normalize(query).reshape(-1)
+        coarse = ((self.centroids - q) ** 2).sum(1)
+        nprobe = min(nprobe, self.nlist)
+        probe = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+        with self._lock:
+            parts = [(i, self.lists[l]) for i, l in enumerate(probe) if self.lists[l].size]
+            if not parts:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            ids = np.concatenate([lst.ids[:lst.size] for _, lst in parts])
+            codes = np.concatenate([lst.codes[:lst.size] for _, lst in parts])
+            which = np.concatenate([np.full(lst.size, i) for i, lst in parts])
+
+        # one lookup table per probed list: partial distances of the query residual to every sub-centroid
+        residual = (q - self.centroids[probe]).reshape(nprobe, self.m, self.dsub).transpose(1, 0, 2)
+        lut = ((residual ** 2).sum(-1)[:, :, None] - 2 * np.matmul(residual, self.codebooks.transpose(0, 2, 1))
+               + (self.codebooks ** 2).sum(-1)[:, None, :])  # (m, nprobe, 256)
+        lut = lut.transpose(1, 0, 2).reshape(-1)  # flat: [list, sub-quantizer, code]
+        # code j of a row in probed list i sits at (i * m + j) * 256 + code
+        offsets = (which[:, None] * self.m + np.arange(self.m)[None, :]) * KSUB
+        distances = lut[offsets + codes].sum(1)
+
+        k = min(k, len(ids))
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+        return ids[top], distances[top]
+
+    def snapshot_vectors(self, ids: List[int]) -> Dict[int, np.ndarray]:
+        """Full-precision vectors of ids still as they were in the snapshot."""
+        if self.snapshot_ids is None:
+            return {}
+        if self._snapshot_vectors is None:
+            self._snapshot_vectors, _ = load_snapshot(self.snapshot_dir)
+        wanted = np.asarray([i for i in ids if i not in self.snapshot_stale], dtype=np.int64)
+        pos = np.searchsorted(self.snapshot_ids, wanted)
+        pos = np.minimum(pos, len(self.snapshot_ids) - 1)
+        found = self.snapshot_ids[pos] == wanted
+        return {int(i): np.asarray(self._snapshot_vectors[p]) for i, p, ok in zip(wanted, pos, found) if ok}
+
+    # --- persistence ------------------------------------------------------
+
+    def save(self, path: str):
+        """Write the index to `path` (an .npz file), replacing it atomically."""
+        with self._lock:
+            sizes = np.array([lst.size for lst in self.lists], dtype=np.int64)
+            ids = np.concatenate([lst.ids[:lst.size] for lst in self.lists]) if self.lists else np.empty(0, np.int64)
+            codes = (np.concatenate([lst.codes[:lst.size] for lst in self.lists]) if self.lists
+                     else np.empty((0, self.m), np.uint8))
+            meta = {'dim': self.dim, 'nlist': self.nlist, 'm': self.m, 'max_id': self.max_id,
+                    'change_horizon': self.change_horizon, 'snapshot_dir': self.snapshot_dir}
+            tmp = f"{path}.tmp.npz"
+            np.savez(tmp, meta=np.array(json.dumps(meta)), centroids=self.centroids, codebooks=self.codebooks,
+                     sizes=sizes, ids=ids, codes=codes,
+                     snapshot_ids=self.snapshot_ids if self.snapshot_ids is not None else np.empty(0, np.int64),
+                     snapshot_stale=np.array(sorted(self.snapshot_stale), dtype=np.int64))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFPQIndex':
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            index = cls(meta['dim'], meta['nlist'], meta['m'])
+            index.centroids = data['centroids']
+            index.codebooks = data['codebooks']
+            index.max_id = meta['max_id']
+            index.change_horizon = meta.get('change_horizon')
+            offsets = np.concatenate(([0], np.cumsum(data['sizes'])))
+            ids, codes = data['ids'], data['codes']
+            index.lists = [_InvertedList(index.m, ids[a:b].copy(), codes[a:b].copy())
+                           for a, b in zip(offsets[:-1], offsets[1:])]
+            if meta.get('snapshot_dir'):
+                index.snapshot_dir = meta['snapshot_dir']
+                index.snapshot_ids = data['snapshot_ids']
+                index.snapshot_stale = set(int(i) for i in data['snapshot_stale'])
+        return index
+
+    def stats(self) -> Dict:
+        sizes = [lst.size for lst in self.lists]
+        return {
+            'vectors': int(sum(sizes)),
+            'nlist': self.nlist,
+            'm': self.m,
+            'code_bytes': int(sum(sizes)) * (self.m + 8),
+            'largest_list': int(max(sizes)) if sizes else 0,
+            'max_id': self.max_id,
+            'change_horizon': self.change_horizon,
+            'rerank_snapshot': self.snapshot_dir,
+        }
+
+
+# --- building from the catalog ----------------------------------------------
+
+def _add_batches(index: IVFPQIndex, batches: Iterator[Tuple[np.ndarray, np.ndarray]], on_batch=None):
+    for ids, vectors in batches:
+        index.add(ids, vectors)
+        index.max_id = max(index.max_id, int(np.max(ids)))
+        if on_batch:
+            on_batch(len(ids))
+
+
+def build_from_db(nlist: int, m: int, train_size: int = 100000, on_batch=None) -> IVFPQIndex:
+    """Train on a random sample of fvector_pg, then stream every row into the index."""
+    sample = pg_connect.sample_vectors(train_size)
+    if not len(sample):
+        raise ValueError("fvector_pg has no vectors to train on")
+    index = IVFPQIndex(sample.shape[1], nlist, m)
+    index.train(sample)
+    # taken before the scan: rows written by transactions still open now are caught up later
+    index.change_horizon = pg_connect.change_horizon()
+    batches = (
+        (np.array([r['id'] for r in rows]), np.stack([r['feature_vector'] for r in rows]))
+        for rows in (
+            [r for r in batch if r['feature_vector'] is not None]
+            for batch in pg_connect.iter_vector_batches(fields=['id', 'feature_vector'])
+        )
+        if rows
+    )
+    _add_batches(index, batches, on_batch)
+    return index
+
+
+def build_from_snapshot(src_dir: str, nlist: int, m: int, train_size: int = 100000,
+                        batch_size: int = 20000, on_batch=None) -> IVFPQIndex:
+    """Build from a vector snapshot; its memory-mapped vectors can then serve the exact rerank."""
+    vectors, metadata = load_snapshot(src_dir)
+    if not len(metadata):
+        raise ValueError(f"snapshot {src_dir} is empty")
+    ids = np.array([record['id'] for record in metadata], dtype=np.int64)
+    if np.any(np.diff(ids) <= 0):
+        raise ValueError(f"snapshot {src_dir} is not ordered by id")
+
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(len(ids), min(train_size, len(ids)), replace=False))
+    index = IVFPQIndex(vectors.shape[1], nlist, m)
+    index.train(np.asarray(vectors[sample_rows]))
+    batches = ((ids[s:s + batch_size], np.asarray(vectors[s:s + batch_size])) for s in range(0, len(ids), batch_size))
+    _add_batches(index, batches, on_batch)
+    index.snapshot_dir = os.path.abspath(src_dir)
+    index.snapshot_ids = ids
+    return index
+
+
+# --- the process-wide index ---------------------------------------------------
+
+_pq_index: Optional[IVFPQIndex] = None
+_pq_index_loaded = False
+_pq_index_lock = threading.Lock()
+
+
+def get_pq_index() -> Optional[IVFPQIndex]:
+    """The index loaded from PQ_INDEX_PATH, or None if it is not configured or not built yet."""
+    global _pq_index, _pq_index_loaded
+    if not _pq_index_loaded:
+        with _pq_index_lock:
+            if not _pq_index_loaded:
+                path = settings.PQ_INDEX_PATH
+                if path and os.path.exists(path):
+                    _pq_index = IVFPQIndex.load(path)
+                    _pq_index.refreshed_at = 0  # catch up with rows saved since the build
+                _pq_index_loaded = True
+    return _pq_index
+
+
+def catch_up(index: IVFPQIndex) -> int:
+    """
+    (Re)index rows inserted or updated by any process since the last catch-up.
+
+    Rows are selected by the transaction that wrote them (`pg_connect.change_horizon`)
+    rather than by id, so rows committed out of id order (a job chunk or bulk save
+    that allocated its ids earlier) and updates made by other processes are not
+    missed. An index without a horizon (built from a snapshot, or saved by an
+    older version) catches up by id once and follows transactions from then on.
+
+    Uses `update`, so rows this process already added through the save hooks are
+    replaced rather than duplicated.
+    """
+    horizon = pg_connect.change_horizon()
+    if index.change_horizon is None:
+        batches = pg_connect.iter_vector_batches(fields=['id', 'feature_vector'], after_id=index.max_id)
+    else:
+        batches = pg_connect.iter_vector_batches(fields=['id', 'feature_vector'], changed_since=index.change_horizon)
+    added = 0
+    for batch in batches:
+        rows = [r for r in batch if r['feature_vector'] is not None]
+        if rows:
+            index.update([r['id'] for r in rows], np.stack([r['feature_vector'] for r in rows]))
+            added += len(rows)
+        if batch:
+            index.max_id = max(index.max_id, batch[-1]['id'])
+    index.change_horizon = horizon
+    index.refreshed_at = time.monotonic()
+    return added
+
+
+def index_vectors(ids: List[int], vectors) -> None:
+    """Save/update hook: (re)index these rows if a PQ index is loaded in this process."""
+    index = get_pq_index()
+    if index is not None and len(ids):
+        index.update(ids, np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+
+
+def discard_vectors(ids: Iterable[int]) -> None:
+    """Delete hook: drop these rows from the PQ index if one is loaded."""
+    index = get_pq_index()
+    if index is not None:
+        index.discard(ids)
+
+
+def search_catalog(query_vector, top_k: int = 10, style_number: Optional[str] = None,
+                   exclude_tenant_id: Optional[str] = None, rerank_factor: Optional[int] = None,
+                   nprobe: Optional[int] = None) -> List[Dict]:
+    """
+    retrieval='pq': approximate candidates from the in-process index, reranked exactly.
+
+    Filters are applied to the candidates, so a selective style/tenant filter can
+    return fewer than top_k results. Results look like `pg_connect.search_similar_vectors`.
+    """
+    index = get_pq_index()
+    if index is None:
+        raise ValueError("no PQ index is loaded (build one with build_pq_index.py and set PQ_INDEX_PATH)")
+    if time.monotonic() - index.refreshed_at >= int(settings.PQ_INDEX_REFRESH_SECONDS):
+        with _pq_index_lock:
+            if time.monotonic() - index.refreshed_at >= int(settings.PQ_INDEX_REFRESH_SECONDS):
+                catch_up(index)
+
+    factor = max(int(rerank_factor or settings.PQ_RERANK_FACTOR), 1)
+    candidates, _ = index.search(query_vector, top_k * factor, int(nprobe or settings.PQ_NPROBE))
+    ids = [int(i) for i in candidates]
+
+    vectors = index.snapshot_vectors(ids) if settings.PQ_RERANK_SOURCE == 'snapshot' else {}
+    missing = [i for i in ids if i not in vectors]
+    rows = pg_connect.get_vectors_by_ids(ids, fields=['id', 'tenant_id', 'style_number', 'image_url'])
+    if missing:
+        vectors.update(pg_connect.fetch_feature_vectors(missing))
+
+    rows = [
+        row for row in rows
+        if row['id'] in vectors
+        and (not style_number or row['style_number'] == style_number)
+        and (not exclude_tenant_id or row['tenant_id'] != exclude_tenant_id)
+    ]
+    if not rows:
+        return []
+    q = _normalize(query_vector).reshape(-1)
+    scores = _normalize(np.stack([vectors[row['id']] for row in rows])) @ q
+    order = np.argsort(-scores)[:top_k]
+    return [
+        {
+            'id': rows[i]['id'],
+            'tenant_id': rows[i]['tenant_id'],
+            'style_number': rows[i].get('style_number'),
+            'image_url': rows[i]['image_url'],
+            'similarity_score': float(scores[i]),
+            'rank': rank,
+        }
+        for rank, i in enumerate(order, start=1)
+    ]
@@ -0,0 +1,197 @@
+# app/utils/priority.py
+"""
+Scheduling of CLIP inference between interactive requests and batch work.
+
+Every forward pass (one image for a search, one batch for a job) takes a slot
+from `inference_scheduler`; at most INFERENCE_CONCURRENCY run at a time. Waiting
+work is queued in two lanes:
+
+    interactive  searches and single-image saves; always served first
+    batch        ingest/sync/re-embed jobs and bulk saves
+
+Batch work takes a slot per batch, so a queued search gets the next free slot
+after the current batch: interactive work preempts batch work at batch
+boundaries. Once the batch at the head of its lane has waited
+JOB_MAX_INTERACTIVE_WAIT_SECONDS it takes the next free slot anyway, so jobs
+still progress under sustained search load.
+
+Within a lane, tenants share the slots by self-clocked weighted fair queuing: a
+unit of work costing `cost` images is tagged finish = max(lane clock, tenant's
+last finish) + cost / weight and the smallest tag goes first, so a tenant's
+backfill cannot starve another tenant queued behind it. Weights come from
+INFERENCE_TENANT_WEIGHTS (default 1). A lane at its queue cap
+(INFERENCE_MAX_QUEUE_INTERACTIVE / _BATCH) rejects new work with
+`InferenceQueueFull`.
+
+Callers say which lane and tenant they are in with `inference_lane(...)`; the
+embedding functions take the slot with `inference_slot(cost)`.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from app.utils.metrics import Counter, Gauge, Histogram, record_stage
+
+
+LANES = ('interactive', 'batch')
+
+QUEUE_DEPTH = Gauge('image_inference_queue_depth', 'Inference work waiting for a slot', ('lane',))
+QUEUE_WAIT_SECONDS = Histogram('image_inference_wait_seconds', 'Wait for an inference slot', ('lane',))
+REJECTED = Counter('image_inference_rejected_total', 'Inference work rejected because its lane queue was full', ('lane',))
+RUNNING = Gauge('image_inference_running', 'Inference slots in use', ('lane',))
+
+
+class InferenceQueueFull(Exception):
+    """Raised when a lane already has its maximum number of waiting units."""
+
+
+class _Waiter:
+    __slots__ = ('lane', 'tenant', 'finish', 'enqueued', 'granted')
+
+    def __init__(self, lane: str, tenant: str, finish: float):
+        self.lane = lane
+        self.tenant = tenant
+        self.finish = finish
+        self.enqueued = time.monotonic()
+        self.granted = False
+
+
+def parse_weights(spec: Optional[str]) -> Dict[str, float]:
+    """'acme=4,trial=0.5' -> {'acme': 4.0, 'trial': 0.5}"""
+    weights = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            tenant, weight = part.split('=', 1)
+            weights[tenant.strip()] = max(float(weight), 1e-3)
+    return weights
+
+
+class InferenceScheduler:
+    """Grants inference slots by lane priority, then per-tenant weighted fair queuing."""
+
+    def __init__(self, concurrency: int, max_queue: Dict[str, int], max_batch_wait: float,
+                 weights: Optional[Dict[str, float]] = None):
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_batch_wait = max_batch_wait
+        self.weights = weights or {}
+        self._cond = threading.Condition()
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {lane: [] for lane in LANES}
+        self._clock: Dict[str, float] = {lane: 0.0 for lane in LANES}
+        self._last_finish: Dict[str, Dict[str, float]] = {lane: {} for lane in LANES}
+        self._running: Dict[str, int] = {lane: 0 for lane in LANES}
+        self._seq = itertools.count()
+
+    def _pick(self) -> Optional[str]:
+        interactive, batch = self._queues['interactive'], self._queues['batch']
+        if batch and (not interactive or time.monotonic() - batch[0][2].enqueued >= self.max_batch_wait):
+            return 'batch'
+        return 'interactive' if interactive else None
+
+    def _dispatch(self):
+        granted = False
+        while sum(self._running.values()) < self.concurrency:
+            lane = self._pick()
+            if lane is None:
+                break
+            _, _, waiter = heapq.heappop(self._queues[lane])
+            waiter.granted = True
+            self._clock[lane] = waiter.finish
+            self._running[lane] += 1
+            QUEUE_DEPTH.dec(lane=lane)
+            RUNNING.inc(lane=lane)
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, lane: str, tenant: str = '', cost: float = 1) -> float:
+        """Block until a slot is granted. Returns the seconds spent waiting."""
+        started = time.monotonic()
+        with self._cond:
+            queue = self._queues[lane]
+            if len(queue) >= self.max_queue.get(lane, 0) > 0:
+                REJECTED.inc(lane=lane)
+                raise InferenceQueueFull(f"{lane} inference queue is full ({len(queue)} waiting)")
+            last_finish = self._last_finish[lane]
+            start = max(self._clock[lane], last_finish.get(tenant, 0.0))
+            waiter = _Waiter(lane, tenant, start + max(cost, 1) / self.weights.get(tenant, 1.0))
+            last_finish[tenant] = waiter.finish
+            if len(last_finish) > 4096:
+                # tags at or behind the clock no longer hold anyone back
+                clock = self._clock[lane]
+                for key in [t for t, f in last_finish.items() if f <= clock]:
+                    del last_finish[key]
+            heapq.heappush(queue, (waiter.finish, next(self._seq), waiter))
+            QUEUE_DEPTH.inc(lane=lane)
+            self._dispatch()
+            while not waiter.granted:
+                self._cond.wait()
+        waited = time.monotonic() - started
+        QUEUE_WAIT_SECONDS.observe(waited, lane=lane)
+        return waited
+
+    def release(self, lane: str):
+        with self._cond:
+            self._running[lane] -= 1
+            RUNNING.dec(lane=lane)
+            self._dispatch()
+
+    def stats(self) -> Dict:
+        """Waiting and running units per lane."""
+        with self._cond:
+            return {
+                'concurrency': self.concurrency,
+                'lanes': {
+                    lane: {
+                        'waiting': len(self._queues[lane]),
+                        'running': self._running[lane],
+                        'max_queue': self.max_queue.get(lane, 0),
+                        'oldest_wait_seconds': round(time.monotonic() - min(w.enqueued for _, _, w in self._queues[lane]), 3)
+                                               if self._queues[lane] else 0.0,
+                    }
+                    for lane in LANES
+                },
+            }
+
+
+inference_scheduler = InferenceScheduler(
+    concurrency=int(settings.INFERENCE_CONCURRENCY),
+    max_queue={
+        'interactive': int(settings.INFERENCE_MAX_QUEUE_INTERACTIVE),
+        'batch': int(settings.INFERENCE_MAX_QUEUE_BATCH),
+    },
+    max_batch_wait=float(settings.JOB_MAX_INTERACTIVE_WAIT_SECONDS),
+    weights=parse_weights(settings.INFERENCE_TENANT_WEIGHTS),
+)
+
+# (lane, tenant) of the code running in this context; propagates into asyncio.to_thread
+_lane: ContextVar[Tuple[str, str]] = ContextVar('inference_lane', default=('interactive', ''))
+
+
+@contextmanager
+def inference_lane(lane: str, tenant_id: Optional[str] = None):
+    """Run the enclosed inference in `lane` ('interactive' or 'batch') on behalf of `tenant_id`."""
+    if lane not in LANES:
+        raise ValueError(f"lane must be one of {', '.join(LANES)}")
+    token = _lane.set((lane, tenant_id or ''))
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+
+@contextmanager
+def inference_slot(cost: float = 1):
+    """Hold an inference slot (for `cost` images) in the current lane for the enclosed forward pass."""
+    lane, tenant = _lane.get()
+    record_stage('inference_wait', inference_scheduler.acquire(lane, tenant, cost))
+    try:
+        yield
+    finally:
+        inference_scheduler.release(lane)
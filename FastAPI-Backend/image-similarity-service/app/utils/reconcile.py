@@ -0,0 +1,200 @@
+# app/utils/reconcile.py
+
+import itertools
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+from app.database import pg_connect
+from app.utils.storage import get_storage
+from app.utils.s3_handler import delete_many_from_s3, image_search_prefix, is_image_key
+from app.utils.dedup import get_phash_index
+from app.utils.pq_index import discard_vectors
+from app.utils.shards import discard_rows
+
+
+SAMPLES_KEPT = 20  # orphans of each kind listed in the report
+FIX_BATCH_SIZE = 1000
+
+
+class ReconcileAborted(Exception):
+    """Raised when a fix would delete more than the safety limit allows."""
+
+
+def merge_join(objects: Iterator[Dict], rows: Iterator[tuple], url_for) -> Iterator[Tuple[Optional[Dict], List[tuple]]]:
+    """
+    Join a key-sorted storage listing with (id, image_url) rows sorted by URL.
+
+    Yields (object, rows) per distinct key/URL: (object, []) for an object no row
+    points to, (None, rows) for rows whose object does not exist, and both for a
+    match. Each side is read once and only its current element is held.
+    """
+    obj = next(objects, None)
+    row = next(rows, None)
+    while obj is not None or row is not None:
+        obj_url = url_for(obj['key']) if obj is not None else None
+        if row is None or (obj is not None and obj_url < row[1]):
+            yield obj, []
+            obj = next(objects, None)
+            continue
+
+        url = row[1]
+        group = []
+        while row is not None and row[1] == url:
+            group.append(row)
+            row = next(rows, None)
+        if obj is not None and obj_url == url:
+            yield obj, group
+            obj = next(objects, None)
+        else:
+            yield None, group
+
+
+def iter_orphans(prefix: str = "", tenant_id: Optional[str] = None, counts: Optional[Dict] = None,
+                 heartbeat: Optional[Callable[[], None]] = None) -> Iterator[Tuple[str, object]]:
+    """
+    Stream orphans under a prefix/tenant: ('object', key) for image objects without
+    a vector and ('vector', (id, image_url)) for vectors without an object.
+
+    Objects modified less than RECONCILE_GRACE_SECONDS ago are never reported, so a
+    save that has uploaded but not yet inserted is left alone. The DB snapshot is
+    taken before the listing starts. If `counts` is given it is filled with
+    listed/stored/matched/orphan_objects/orphan_vectors totals as the scan runs.
+    `heartbeat` is called for every key/URL visited (jobs rate-limit it themselves).
+    """
+    storage = get_storage()
+    key_prefix = image_search_prefix(prefix, tenant_id)
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=int(settings.RECONCILE_GRACE_SECONDS))
+
+    counts = counts if counts is not None else {}
+    for name in ('listed', 'stored', 'matched', 'orphan_objects', 'orphan_vectors', 'recent_objects'):
+        counts.setdefault(name, 0)
+
+    rows = pg_connect.iter_image_urls(storage.url_for(key_prefix))
+    # open the DB cursor (and its snapshot) before listing storage
+    first_row = next(rows, None)
+    rows = itertools.chain([first_row], rows) if first_row is not None else iter(())
+
+    for obj, group in merge_join(storage.list(key_prefix), rows, storage.url_for):
+        if heartbeat:
+            heartbeat()
+        if obj is not None:
+            counts['listed'] += 1
+        counts['stored'] += len(group)
+        if obj is not None and group:
+            counts['matched'] += 1
+        elif group:
+            counts['orphan_vectors'] += len(group)
+            for row in group:
+                yield 'vector', row
+        elif is_image_key(obj['key']):
+            if _as_utc(obj['last_modified']) > cutoff:
+                counts['recent_objects'] += 1
+                continue
+            counts['orphan_objects'] += 1
+            yield 'object', obj['key']
+
+
+def _as_utc(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def scan_orphans(prefix: str = "", tenant_id: Optional[str] = None,
+                 heartbeat: Optional[Callable[[], None]] = None) -> Dict:
+    """
+    Report orphans without changing anything.
+
+    Returns the counts from `iter_orphans` plus up to SAMPLES_KEPT example keys
+    (`sample_objects`) and rows (`sample_vectors`).
+    """
+    counts: Dict = {}
+    sample_objects, sample_vectors = [], []
+    for kind, item in iter_orphans(prefix, tenant_id, counts, heartbeat):
+        if kind == 'object' and len(sample_objects) < SAMPLES_KEPT:
+            sample_objects.append(item)
+        elif kind == 'vector' and len(sample_vectors) < SAMPLES_KEPT:
+            sample_vectors.append({'image_id': item[0], 'image_url': item[1]})
+    return dict(counts, sample_objects=sample_objects, sample_vectors=sample_vectors)
+
+
+def check_fix_limit(report: Dict, force: bool = False):
+    """
+    Raise ReconcileAborted if fixing would delete more than RECONCILE_MAX_DELETE_FRACTION
+    of the vectors or of the objects in scope (e.g. the wrong bucket or prefix).
+    """
+    if force:
+        return
+    max_fraction = float(settings.RECONCILE_MAX_DELETE_FRACTION)
+    for orphans, total, what in ((report['orphan_vectors'], report['stored'], 'vectors'),
+                                 (report['orphan_objects'], report['listed'], 'objects')):
+        if total and orphans / total > max_fraction:
+            raise ReconcileAborted(
+                f"Reconcile would delete {orphans} of {total} {what} "
+                f"(limit {max_fraction:.0%}); re-run with force to apply"
+            )
+
+
+def fix_orphans(prefix: str = "", tenant_id: Optional[str] = None,
+                fix_vectors: bool = True, fix_objects: bool = True,
+                heartbeat: Optional[Callable[[], None]] = None) -> Dict:
+    """
+    Stream the orphans again and delete them in batches of FIX_BATCH_SIZE.
+
+    Vectors are deleted only if they still point at the URL that was seen missing;
+    objects only if no row references them by the time the batch is applied.
+
+    Returns counts of deleted_vectors, deleted_objects and failed_objects, and up
+    to SAMPLES_KEPT keys that could not be deleted (`sample_failed_objects`).
+    """
+    storage = get_storage()
+    result = {'deleted_vectors': 0, 'deleted_objects': 0, 'failed_objects': 0, 'sample_failed_objects': []}
+    vectors: List[tuple] = []
+    keys: List[str] = []
+
+    def flush_vectors():
+        deleted = pg_connect.delete_vectors_if_unchanged(vectors)
+        # keep this process's in-memory indexes in step, like the purge job
+        get_phash_index().discard_many(deleted)
+        discard_vectors(deleted)
+        discard_rows(deleted)
+        result['deleted_vectors'] += len(deleted)
+        vectors.clear()
+
+    def flush_objects():
+        # a save may have inserted its row after our snapshot
+        referenced = pg_connect.filter_stored_urls([storage.url_for(k) for k in keys])
+        doomed = [k for k in keys if storage.url_for(k) not in referenced]
+        failed = delete_many_from_s3(doomed)
+        result['deleted_objects'] += len(doomed) - len(failed)
+        result['failed_objects'] += len(failed)
+        samples = result['sample_failed_objects']
+        samples.extend(failed[:SAMPLES_KEPT - len(samples)])
+        keys.clear()
+
+    for kind, item in iter_orphans(prefix, tenant_id, heartbeat=heartbeat):
+        if kind == 'vector' and fix_vectors:
+            vectors.append(item)
+            if len(vectors) >= FIX_BATCH_SIZE:
+                flush_vectors()
+        elif kind == 'object' and fix_objects:
+            keys.append(item)
+            if len(keys) >= FIX_BATCH_SIZE:
+                flush_objects()
+    if vectors:
+        flush_vectors()
+    if keys:
+        flush_objects()
+    return result
+
+
+def format_reconcile_report(report: Dict) -> str:
+    return (
+        f"listed {report['listed']}, stored {report['stored']}: {report['matched']} matched, "
+        f"{report['orphan_objects']} objects without vector, "
+        f"{report['orphan_vectors']} vectors without object, "
+        f"{report['recent_objects']} recent objects skipped"
+    )
@@ -1,18 +1,10 @@
 # app/s3_helper.py
 
-import boto3
 import os
-from botocore.exceptions import NoCredentialsError, ClientError
 from config import settings
-from typing import List, Dict, Optional
-
-# Initialize the S3 client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=settings.AWS_ACCESS_KEY,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_REGION,
-)
+from typing import Iterator, List, Dict, Optional
+from app.utils.storage import get_storage, ObjectNotFound
+from app.utils.image_cache import get_image_cache
 
 BUCKET_NAME = settings.AWS_BUCKET_NAME
 
@@ -22,120 +14,146 @@ IMG_EXTS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif', '.webp'}
 
 def upload_to_s3(file_bytes, object_name):
     """
-    Uploads a file to S3 and returns the file URL.
+    Uploads a file to the configured storage backend and returns the file URL.
     """
-    try:
-        # Upload the file to S3
-        s3_client.put_object(Bucket=BUCKET_NAME, Key=object_name, Body=file_bytes)
-        # Create the file URL
-        s3_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{object_name}"
-        return s3_url
-    except NoCredentialsError:
-        raise Exception("AWS credentials not available")
+    return get_storage().put(object_name, file_bytes)
 
 
 def delete_from_s3(object_name):
     """
-    Deletes a file from S3.
+    Deletes a file from the configured storage backend.
     """
-    try:
-        # Delete the file from S3
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=object_name)
-    except NoCredentialsError:
-        raise Exception("AWS credentials not available")
+    get_storage().delete(object_name)
+    cache = get_image_cache()
+    if cache is not None:
+        cache.invalidate(object_name)
+
+
+def delete_many_from_s3(object_names: List[str]) -> List[str]:
+    """
+    Deletes several files (S3 DeleteObjects, 1000 keys per request).
+    Returns the keys that could not be deleted.
+    """
+    failed = get_storage().delete_many(object_names)
+    cache = get_image_cache()
+    if cache is not None:
+        for object_name in object_names:
+            cache.invalidate(object_name)
+    return failed
 
 
 def download_from_s3(object_name: str) -> bytes:
     """
-    Downloads a file from S3 and returns the file bytes.
+    Downloads a file from storage and returns the file bytes.
+    
+    Reads go through the on-disk image cache (see `app.utils.image_cache`)
+    unless it is disabled or the backend is already local.
     
     Args:
-        object_name: The S3 object key to download
+        object_name: The object key to download
         
     Returns:
         File content as bytes
     """
+    storage = get_storage()
+    cache = get_image_cache() if storage.name != "local" else None
     try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=object_name)
-        return response['Body'].read()
-    except NoCredentialsError:
-        raise Exception("AWS credentials not available")
-    except ClientError as e:
-        if e.response['Error']['Code'] == 'NoSuchKey':
-            raise Exception(f"Object {object_name} not found in bucket {BUCKET_NAME}")
-        raise Exception(f"Error downloading from S3: {e}")
+        if cache is not None:
+            return cache.get(storage, object_name)
+        return storage.get(object_name)
+    except ObjectNotFound:
+        raise
+    except Exception as e:
+        raise Exception(f"Error downloading from storage: {e}")
+
+
+def key_from_url(image_url: str) -> str:
+    """
+    Extract the object key from a stored image URL.
+    """
+    return get_storage().key_from_url(image_url)
 
 
 def download_from_s3_url(image_url: str) -> bytes:
     """
-    Downloads a file from S3 using the full S3 URL.
+    Downloads a file from storage using the full stored URL.
     
     Args:
-        image_url: Full S3 URL (e.g., https://bucket.s3.amazonaws.com/key)
+        image_url: Full object URL (e.g., https://bucket.s3.amazonaws.com/key)
         
     Returns:
         File content as bytes
     """
-    # Extract object key from URL
-    object_name = image_url.split(f"{BUCKET_NAME}.s3.amazonaws.com/")[-1]
-    return download_from_s3(object_name)
+    return download_from_s3(key_from_url(image_url))
+
+
+def is_image_key(key: str) -> bool:
+    _, ext = os.path.splitext(key.lower())
+    return ext in IMG_EXTS
+
+
+def image_search_prefix(prefix: str = "", tenant_id: Optional[str] = None) -> str:
+    """
+    Key prefix listed for a prefix/tenant_id filter.
+    """
+    # If tenant_id is provided and no prefix, use tenant_id as prefix
+    if tenant_id and not prefix:
+        return f"{tenant_id}/"
+    if tenant_id and prefix:
+        return f"{prefix}{tenant_id}/"
+    return prefix
+
+
+def iter_images_from_s3(prefix: str = "", tenant_id: Optional[str] = None, start_after: str = "") -> Iterator[Dict]:
+    """
+    Yields image files from storage, sorted by key, with optional prefix and tenant_id filter.
+    
+    Same arguments and item format as `list_images_from_s3`, but streams the
+    listing page by page instead of building the whole list in memory.
+    `start_after` resumes the listing after the given key.
+    """
+    storage = get_storage()
+    for obj in storage.list(image_search_prefix(prefix, tenant_id), start_after=start_after):
+        key = obj['key']
+        # Check if it's an image file
+        if not is_image_key(key):
+            continue
+
+        # Parse tenant_id and style_type from key
+        parsed_tenant_id, style_type = parse_s3_key(key)
+
+        # Filter by tenant_id if specified
+        if tenant_id and parsed_tenant_id != tenant_id:
+            continue
+
+        yield {
+            'key': key,
+            'url': storage.url_for(key),
+            'tenant_id': parsed_tenant_id,
+            'style_type': style_type,
+            'layout_code': layout_code_from_key(key),
+            'size': obj['size'],
+            'etag': obj['etag'],
+            'last_modified': obj['last_modified'].isoformat()
+        }
 
 
 def list_images_from_s3(prefix: str = "", tenant_id: Optional[str] = None) -> List[Dict]:
     """
-    Lists all image files from S3 bucket with optional prefix and tenant_id filter.
+    Lists all image files from storage with optional prefix and tenant_id filter.
     
     Args:
-        prefix: S3 prefix to filter objects (e.g., 'images/' or 'tenant123/')
+        prefix: Key prefix to filter objects (e.g., 'images/' or 'tenant123/')
         tenant_id: Optional tenant ID to filter images. If provided, will look for images
                    in the path structure: <tenant_id>/... or filter by key prefix
         
     Returns:
-        List of dicts containing: key, url, tenant_id, style_type, size, last_modified
+        List of dicts containing: key, url, tenant_id, style_type, layout_code, size, etag, last_modified
     """
     try:
-        # If tenant_id is provided and no prefix, use tenant_id as prefix
-        search_prefix = prefix
-        if tenant_id and not prefix:
-            search_prefix = f"{tenant_id}/"
-        elif tenant_id and prefix:
-            search_prefix = f"{prefix}{tenant_id}/"
-        
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=BUCKET_NAME, Prefix=search_prefix)
-        
-        images = []
-        for page in page_iterator:
-            for obj in page.get('Contents', []):
-                key = obj['Key']
-                # Check if it's an image file
-                _, ext = os.path.splitext(key.lower())
-                if ext not in IMG_EXTS:
-                    continue
-                
-                # Parse tenant_id and style_type from key
-                parsed_tenant_id, style_type = parse_s3_key(key)
-                
-                # Filter by tenant_id if specified
-                if tenant_id and parsed_tenant_id != tenant_id:
-                    continue
-                
-                image_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}"
-                images.append({
-                    'key': key,
-                    'url': image_url,
-                    'tenant_id': parsed_tenant_id,
-                    'style_type': style_type,
-                    'size': obj['Size'],
-                    'last_modified': obj['LastModified'].isoformat()
-                })
-        
-        return images
-        
-    except NoCredentialsError:
-        raise Exception("AWS credentials not available")
-    except ClientError as e:
-        raise Exception(f"Error listing S3 objects: {e}")
+        return list(iter_images_from_s3(prefix=prefix, tenant_id=tenant_id))
+    except Exception as e:
+        raise Exception(f"Error listing storage objects: {e}")
 
 
 def parse_s3_key(key: str) -> tuple:
@@ -159,6 +177,16 @@ def parse_s3_key(key: str) -> tuple:
     return tenant_id, style_type
 
 
+def layout_code_from_key(key: str) -> str:
+    """
+    The layout code of an S3 object key: its file name without extension.
+
+    Ingest (the background job and create_embeddings_s3.py) stores it as the
+    row's style_number, like the layout_code of an upload.
+    """
+    return os.path.splitext(os.path.basename(key))[0]
+
+
 def get_image_url(object_key: str) -> str:
     """
     Generate the full S3 URL for an object key.
@@ -169,7 +197,7 @@ def get_image_url(object_key: str) -> str:
     Returns:
         Full S3 URL
     """
-    return f"https://{BUCKET_NAME}.s3.amazonaws.com/{object_key}"
+    return get_storage().url_for(object_key)
 
 
 def get_image_by_tenant_id(tenant_id: str) -> Optional[bytes]:
@@ -189,14 +217,12 @@ def get_image_by_tenant_id(tenant_id: str) -> Optional[bytes]:
         Image bytes if found, None otherwise
     """
     try:
-        # List images under tenant_id prefix
-        images = list_images_from_s3(tenant_id=tenant_id)
+        # Stop listing at the first image under the tenant_id prefix
+        first_image = next(iter_images_from_s3(tenant_id=tenant_id), None)
         
-        if not images:
+        if not first_image:
             return None
         
-        # Get the first image
-        first_image = images[0]
         image_key = first_image['key']
         
         # Download and return the image
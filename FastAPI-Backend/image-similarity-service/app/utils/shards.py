@@ -0,0 +1,566 @@
+# app/utils/shards.py
+"""
+Scatter-gather search over an in-memory catalog split across local worker processes.
+
+Rows are hashed into NUM_BUCKETS buckets, by id (`id % 256`) or by tenant (md5 of
+tenant_id, so a tenant's rows stay on one shard), and every bucket belongs to one
+shard process. A shard loads the normalised float32 vectors of its buckets from
+fvector_pg together with tenant and style codes, and answers a query with one
+matrix product over its rows (applying the exclude_tenant_id / style_number
+filters before its own top-k). It catches up with the rows inserted or updated by
+any process since its last read, selected by writing transaction rather than by
+id (see `pq_index.catch_up`), so rows committed out of id order are not missed
+and rows moved to another tenant's bucket are dropped. Rows deleted elsewhere are
+dropped when a search finds them gone from the table. The coordinator sends a
+query to every shard at once and merges the per-shard top-k with a heap.
+
+Adding a shard moves whole buckets from the fullest shards: the new shard loads
+them from the database, and only then do the donors drop them, so no row is ever
+missing from the search (a row briefly present twice is de-duplicated in the merge).
+"""
+
+import time
+import heapq
+import hashlib
+import logging
+import itertools
+import threading
+import multiprocessing
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from config import settings
+from app.database import pg_connect
+
+
+logger = logging.getLogger(__name__)
+
+NUM_BUCKETS = 256
+STALE_REFILL_ROUNDS = 3  # searches re-run after dropping winners deleted elsewhere
+
+
+def bucket_of(key: str, image_id: int, tenant_id: Optional[str]) -> int:
+    """Python side of `pg_connect.bucket_sql`."""
+    if key == 'id':
+        return image_id % NUM_BUCKETS
+    return int(hashlib.md5((tenant_id or '').encode('utf-8')).hexdigest()[:8], 16) % NUM_BUCKETS
+
+
+class _ShardData:
+    """One shard's rows: ids, vectors, tenant/style codes and buckets, in arrays that grow by doubling."""
+
+    def __init__(self, key: str, buckets: Iterable[int]):
+        self.key = key
+        self.buckets = set(buckets)
+        self.size = 0
+        self.ids = np.empty(0, dtype=np.int64)
+        self.vectors: Optional[np.ndarray] = None
+        self.tenants = np.empty(0, dtype=np.int32)
+        self.styles = np.empty(0, dtype=np.int32)
+        self.row_buckets = np.empty(0, dtype=np.int16)
+        self.codes: Dict[str, Dict[str, int]] = {'tenant': {}, 'style': {}}
+        self.max_id = 0
+        self.change_horizon: Optional[int] = None
+        self.refreshed_at = time.monotonic()
+
+    def _code(self, kind: str, value: Optional[str]) -> int:
+        table = self.codes[kind]
+        return table.setdefault(value or '', len(table))
+
+    def _grow(self, needed: int, dim: int):
+        capacity = max(needed, 2 * len(self.ids), 1024)
+        def grown(arr, shape, dtype):
+            out = np.empty(shape, dtype=dtype)
+            out[:self.size] = arr[:self.size]
+            return out
+        self.ids = grown(self.ids, capacity, np.int64)
+        self.tenants = grown(self.tenants, capacity, np.int32)
+        self.styles = grown(self.styles, capacity, np.int32)
+        self.row_buckets = grown(self.row_buckets, capacity, np.int16)
+        if self.vectors is None:
+            self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.vectors = grown(self.vectors, (capacity, dim), np.float32)
+
+    def discard(self, ids: Iterable[int]) -> int:
+        ids = np.asarray(list(ids), dtype=np.int64)
+        return self._keep(~np.isin(self.ids[:self.size], ids)) if len(ids) else 0
+
+    def drop_buckets(self, buckets: Iterable[int]) -> int:
+        buckets = set(buckets)
+        self.buckets -= buckets
+        return self._keep(~np.isin(self.row_buckets[:self.size], list(buckets)))
+
+    def _keep(self, keep: np.ndarray) -> int:
+        kept = int(keep.sum())
+        removed = self.size - kept
+        if removed:
+            for name in ('ids', 'tenants', 'styles', 'row_buckets', 'vectors'):
+                arr = getattr(self, name)
+                arr[:kept] = arr[:self.size][keep]
+            self.size = kept
+        return removed
+
+    def upsert(self, rows: List[Dict]) -> int:
+        """Add rows (id, tenant_id, style_number, feature_vector) that fall in this shard's buckets."""
+        rows = [r for r in rows if r.get('feature_vector') is not None
+                and bucket_of(self.key, r['id'], r['tenant_id']) in self.buckets]
+        if not rows:
+            return 0
+        self.discard(r['id'] for r in rows)
+        vectors = np.asarray([r['feature_vector'] for r in rows], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        needed = self.size + len(rows)
+        if needed > len(self.ids):
+            self._grow(needed, vectors.shape[1])
+        end = self.size + len(rows)
+        self.ids[self.size:end] = [r['id'] for r in rows]
+        self.tenants[self.size:end] = [self._code('tenant', r['tenant_id']) for r in rows]
+        self.styles[self.size:end] = [self._code('style', r.get('style_number')) for r in rows]
+        self.row_buckets[self.size:end] = [bucket_of(self.key, r['id'], r['tenant_id']) for r in rows]
+        self.vectors[self.size:end] = vectors
+        self.size = end
+        return len(rows)
+
+    def load(self) -> int:
+        """Read this shard's buckets from fvector_pg."""
+        horizon = pg_connect.change_horizon()
+        loaded = 0
+        for batch in pg_connect.iter_vector_batches(
+                fields=['id', 'tenant_id', 'style_number', 'feature_vector'],
+                buckets=(self.key, NUM_BUCKETS, sorted(self.buckets))):
+            loaded += self.upsert(batch)
+            self.max_id = max(self.max_id, batch[-1]['id'])
+        self.change_horizon = horizon
+        self.refreshed_at = time.monotonic()
+        return loaded
+
+    def catch_up(self) -> int:
+        """
+        Re-read rows inserted or updated since the last load or catch-up. Changed rows
+        of every bucket are read, so a row whose tenant moved it out of this shard's
+        buckets is dropped here while its new shard picks it up.
+        """
+        horizon = pg_connect.change_horizon()
+        loaded = 0
+        for batch in pg_connect.iter_vector_batches(
+                fields=['id', 'tenant_id', 'style_number', 'feature_vector'],
+                changed_since=self.change_horizon):
+            self.discard(r['id'] for r in batch
+                         if bucket_of(self.key, r['id'], r['tenant_id']) not in self.buckets)
+            loaded += self.upsert(batch)
+            self.max_id = max(self.max_id, batch[-1]['id'])
+        self.change_horizon = horizon
+        self.refreshed_at = time.monotonic()
+        return loaded
+
+    def _codes_of(self, kind: str, values: Iterable[str]) -> List[int]:
+        table = self.codes[kind]
+        return [table[v] for v in values if v in table]
+
+    def search(self, query: np.ndarray, k: int, style_number: Optional[str],
+               exclude_tenant_id: Optional[str], image_ids: Optional[List[int]] = None,
+               style_numbers: Optional[List[str]] = None, tenant_ids: Optional[List[str]] = None) -> List[tuple]:
+        """Top k (score, id); with filters or allow-lists only the matching rows are multiplied."""
+        if not self.size:
+            return []
+        mask = None
+        def restrict(keep):
+            nonlocal mask
+            mask = keep if mask is None else mask & keep
+        if style_number:
+            code = self.codes['style'].get(style_number)
+            if code is None:
+                return []
+            restrict(self.styles[:self.size] == code)
+        if exclude_tenant_id and exclude_tenant_id in self.codes['tenant']:
+            restrict(self.tenants[:self.size] != self.codes['tenant'][exclude_tenant_id])
+        if image_ids is not None:
+            restrict(np.isin(self.ids[:self.size], np.asarray(image_ids, dtype=np.int64)))
+        if style_numbers is not None:
+            restrict(np.isin(self.styles[:self.size], self._codes_of('style', style_numbers)))
+        if tenant_ids is not None:
+            restrict(np.isin(self.tenants[:self.size], self._codes_of('tenant', tenant_ids)))
+
+        if mask is None:
+            scores, ids = self.vectors[:self.size] @ query, self.ids[:self.size]
+        else:
+            rows = np.flatnonzero(mask)
+            if not rows.size:
+                return []
+            scores, ids = self.vectors[rows] @ query, self.ids[rows]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), int(ids[i])) for i in top]
+
+    def health(self) -> Dict:
+        return {
+            'rows': self.size,
+            'buckets': len(self.buckets),
+            'tenants': len(self.codes['tenant']),
+            'vector_bytes': int(self.size * (self.vectors.shape[1] * 4 if self.vectors is not None else 0)),
+            'max_id': self.max_id,
+            'change_horizon': self.change_horizon,
+            'refreshed_seconds_ago': round(time.monotonic() - self.refreshed_at, 1),
+        }
+
+
+def _shard_main(conn, key: str, buckets: List[int], refresh_seconds: int):
+    """Shard process: load, then serve (request_id, command, args) messages until 'stop'."""
+    data = _ShardData(key, buckets)
+    try:
+        data.load()
+        conn.send((None, 'ready', data.health()))
+    except Exception as e:
+        conn.send((None, 'error', f"load failed: {e}"))
+        return
+
+    served, busy = 0, 0.0
+    while True:
+        request_id, command, args = conn.recv()
+        started = time.perf_counter()
+        try:
+            if command == 'stop':
+                conn.send((request_id, 'ok', None))
+                return
+            if command == 'search':
+                if time.monotonic() - data.refreshed_at >= refresh_seconds:
+                    data.catch_up()
+                result = data.search(*args)
+                served += 1
+                busy += time.perf_counter() - started
+            elif command == 'upsert':
+                result = data.upsert(args)
+            elif command == 'discard':
+                result = data.discard(args)
+            elif command == 'drop_buckets':
+                result = data.drop_buckets(args)
+            elif command == 'health':
+                result = dict(data.health(), searches=served,
+                              avg_search_ms=round(busy / served * 1000, 2) if served else None)
+            else:
+                raise ValueError(f"unknown command {command}")
+            conn.send((request_id, 'ok', result))
+        except Exception as e:
+            conn.send((request_id, 'error', str(e)))
+
+
+class ShardError(Exception):
+    """Raised when a shard does not answer or reports an error."""
+
+
+class _Shard:
+    """Coordinator-side handle: the process, its pipe, and the lock that pairs requests with replies."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, number: int, key: str, buckets: List[int]):
+        self.number = number
+        self.buckets = set(buckets)
+        self.lock = threading.Lock()
+        self.ready = False
+        self.last_error: Optional[str] = None
+        ctx = multiprocessing.get_context('spawn')
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_shard_main, args=(child, key, sorted(buckets), int(settings.SHARD_REFRESH_SECONDS)),
+            name=f"image-shard-{number}", daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    def _loaded(self, status: str, result):
+        if status != 'ready':
+            self.last_error = result
+            raise ShardError(f"shard {self.number}: {result}")
+        self.ready = True
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        """Block until the shard has loaded its buckets (the first message it sends)."""
+        with self.lock:
+            if self.ready:
+                return
+            try:
+                if not self.conn.poll(timeout):
+                    raise ShardError(f"shard {self.number} did not finish loading")
+                _, status, result = self.conn.recv()
+            except (EOFError, OSError):
+                self.last_error = "exited while loading"
+                raise ShardError(f"shard {self.number}: {self.last_error}")
+            self._loaded(status, result)
+
+    def send(self, command: str, args=None) -> int:
+        request_id = next(self._ids)
+        try:
+            self.conn.send((request_id, command, args))
+        except OSError as e:  # the process exited
+            self.last_error = str(e)
+            raise ShardError(f"shard {self.number}: {e}")
+        return request_id
+
+    def receive(self, request_id: int, timeout: float):
+        """Wait for the reply to `request_id`, skipping late replies to timed-out requests."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0 or not self.conn.poll(remaining):
+                    self.last_error = f"no reply within {timeout}s"
+                    raise ShardError(f"shard {self.number}: {self.last_error}")
+                reply_id, status, result = self.conn.recv()
+            except (EOFError, OSError):
+                self.last_error = "exited"
+                raise ShardError(f"shard {self.number}: {self.last_error}")
+            if reply_id is None:
+                self._loaded(status, result)
+                continue
+            if reply_id != request_id:
+                continue
+            if status != 'ok':
+                self.last_error = result
+                raise ShardError(f"shard {self.number}: {result}")
+            self.last_error = None
+            return result
+
+    def request(self, command: str, args=None, timeout: Optional[float] = None):
+        with self.lock:
+            request_id = self.send(command, args)
+            return self.receive(request_id, timeout or float(settings.SHARD_TIMEOUT_SECONDS))
+
+    def write(self, command: str, args):
+        """
+        Apply a write. A shard that is still loading gets it queued behind the load
+        (its reply is skipped by a later receive) instead of blocking the caller.
+        """
+        if self.ready:
+            self.request(command, args)
+        else:
+            with self.lock:
+                self.send(command, args)
+
+
+class ShardCoordinator:
+    """Owns the shard processes, routes writes to them and merges their search results."""
+
+    def __init__(self, count: int, key: str = 'id'):
+        if key not in ('id', 'tenant'):
+            raise ValueError("SHARD_KEY must be 'id' or 'tenant'")
+        self.key = key
+        self.count = count
+        self.shards: List[_Shard] = []
+        self._lock = threading.Lock()  # guards the shard list (adding shards)
+
+    def start(self, wait: bool = True):
+        """Start one process per shard; each loads its buckets from the database."""
+        self.shards = [
+            _Shard(n, self.key, [b for b in range(NUM_BUCKETS) if b % self.count == n])
+            for n in range(self.count)
+        ]
+        if wait:
+            self.wait_ready()
+
+    def wait_ready(self, timeout: Optional[float] = None):
+        for shard in self.shards:
+            if not shard.ready:
+                shard.wait_ready(timeout)
+
+    @property
+    def ready(self) -> bool:
+        if not self.shards:
+            return False
+        for shard in self.shards:
+            if not shard.ready and shard.conn.poll(0):
+                try:
+                    shard.wait_ready(0)
+                except ShardError as e:
+                    logger.error("%s", e)
+        return all(shard.ready for shard in self.shards)
+
+    def _owner(self, image_id: int, tenant_id: Optional[str]) -> _Shard:
+        bucket = bucket_of(self.key, image_id, tenant_id)
+        return next(shard for shard in self.shards if bucket in shard.buckets)
+
+    def _gather(self, shards: List[_Shard], args: tuple, top_k: int) -> List[tuple]:
+        """Send one search to every shard and merge their partial top-k into (score, id), best first."""
+        timeout = float(settings.SHARD_TIMEOUT_SECONDS)
+        # lock every shard in a fixed order, send to all, then collect: the shards scan in parallel
+        pending = []
+        try:
+            for shard in shards:
+                shard.lock.acquire()
+                pending.append((shard, shard.send('search', args)))
+            partials = [shard.receive(request_id, timeout) for shard, request_id in pending]
+        finally:
+            for shard, _ in pending:
+                shard.lock.release()
+
+        best, seen = [], set()
+        for score, image_id in heapq.merge(*(sorted(p, reverse=True) for p in partials), reverse=True):
+            if image_id not in seen:  # a moving bucket can briefly live on two shards
+                seen.add(image_id)
+                best.append((score, image_id))
+                if len(best) == top_k:
+                    break
+        return best
+
+    def search(self, query_vector, top_k: int = 10, style_number: Optional[str] = None,
+               exclude_tenant_id: Optional[str] = None, image_ids: Optional[List[int]] = None,
+               style_numbers: Optional[List[str]] = None, tenant_ids: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Fan the query out to every shard, merge their top_k with a heap, and load the
+        metadata of the winners. Results look like `pg_connect.search_similar_vectors`.
+        Allow-lists (image_ids, style_numbers, tenant_ids) restrict each shard's
+        matrix product to the matching rows.
+
+        Catch-up only sees inserted and updated rows, so a row deleted by another
+        process stays in its shard until a search finds it missing from the table.
+        Such winners are discarded from the shards and the search runs again (at
+        most STALE_REFILL_ROUNDS times), so the result is not cut short by them.
+        Raises ShardError if a shard does not answer within SHARD_TIMEOUT_SECONDS.
+        """
+        q = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+        q /= max(float(np.linalg.norm(q)), 1e-12)
+        args = (q, top_k, style_number, exclude_tenant_id, image_ids, style_numbers, tenant_ids)
+
+        with self._lock:
+            shards = list(self.shards)
+        for _ in range(STALE_REFILL_ROUNDS):
+            best = self._gather(shards, args, top_k)
+            rows = {row['id']: row for row in pg_connect.get_vectors_by_ids(
+                [image_id for _, image_id in best], fields=['id', 'tenant_id', 'style_number', 'image_url'])}
+            stale = [image_id for _, image_id in best if image_id not in rows]
+            if not stale:
+                break
+            self.discard(stale)  # deleted by another process since the shard loaded it
+
+        results = []
+        for score, image_id in best:
+            row = rows.get(image_id)
+            if row is None:
+                continue  # still stale after the last refill round
+            results.append({
+                'id': image_id,
+                'tenant_id': row['tenant_id'],
+                'style_number': row.get('style_number'),
+                'image_url': row['image_url'],
+                'similarity_score': score,
+                'rank': len(results) + 1,
+            })
+        return results
+
+    def upsert(self, rows: List[Dict]):
+        """Send saved/updated rows (id, tenant_id, style_number, feature_vector) to their shards."""
+        with self._lock:
+            shards = list(self.shards)
+        by_shard: Dict[int, List[Dict]] = {}
+        for row in rows:
+            by_shard.setdefault(self._owner(row['id'], row['tenant_id']).number, []).append(row)
+        ids = [row['id'] for row in rows]
+        for shard in shards:
+            if shard.number in by_shard:
+                shard.write('upsert', by_shard[shard.number])
+            elif self.key == 'tenant':
+                shard.write('discard', ids)  # an update may have moved the row to another tenant
+
+    def discard(self, ids: List[int]):
+        with self._lock:
+            shards = list(self.shards)
+        for shard in shards:
+            shard.write('discard', list(ids))
+
+    def add_shard(self) -> Dict:
+        """
+        Start one more shard and move buckets to it from the fullest shards until every
+        shard owns NUM_BUCKETS // count or one more. Searches keep running throughout.
+        """
+        with self._lock:
+            number = max(shard.number for shard in self.shards) + 1
+            target = NUM_BUCKETS // (len(self.shards) + 1)
+            moved: Dict[int, List[int]] = {}
+            donors = sorted(self.shards, key=lambda s: len(s.buckets), reverse=True)
+            taken: List[int] = []
+            while len(taken) < target:
+                donor = max(donors, key=lambda s: len(s.buckets) - len(moved.get(s.number, [])))
+                available = sorted(donor.buckets - set(moved.get(donor.number, [])))
+                bucket = available[-1]
+                moved.setdefault(donor.number, []).append(bucket)
+                taken.append(bucket)
+
+        shard = _Shard(number, self.key, taken)
+        shard.wait_ready()  # loaded from the database before anything is dropped elsewhere
+
+        with self._lock:
+            self.shards.append(shard)
+            for donor in self.shards:
+                if donor.number in moved:
+                    donor.buckets -= set(moved[donor.number])
+        for donor in list(self.shards):
+            if donor.number in moved:
+                donor.request('drop_buckets', moved[donor.number], timeout=60)
+        self.count = len(self.shards)
+        return {'shard': number, 'buckets_moved': {str(k): len(v) for k, v in moved.items()}}
+
+    def health(self) -> List[Dict]:
+        """Per-shard status; a shard that does not answer is reported with its error."""
+        with self._lock:
+            shards = list(self.shards)
+        report = []
+        for shard in shards:
+            entry = {'shard': shard.number, 'pid': shard.process.pid, 'alive': shard.process.is_alive(),
+                     'ready': shard.ready, 'buckets': len(shard.buckets)}
+            if shard.ready and entry['alive']:
+                try:
+                    entry.update(shard.request('health'))
+                    entry['healthy'] = True
+                except ShardError as e:
+                    entry.update(healthy=False, error=str(e))
+            else:
+                entry.update(healthy=False, error=shard.last_error or ('loading' if entry['alive'] else 'exited'))
+            report.append(entry)
+        return report
+
+    def stop(self):
+        for shard in self.shards:
+            try:
+                shard.request('stop', timeout=5)
+            except (ShardError, OSError):
+                pass
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
+        self.shards = []
+
+
+_coordinator: Optional[ShardCoordinator] = None
+_coordinator_lock = threading.Lock()
+
+
+def get_shard_coordinator() -> Optional[ShardCoordinator]:
+    """The process-wide coordinator, or None when SHARD_COUNT is 0 (sharded search disabled)."""
+    global _coordinator
+    if _coordinator is None and int(settings.SHARD_COUNT) > 0:
+        with _coordinator_lock:
+            if _coordinator is None:
+                _coordinator = ShardCoordinator(int(settings.SHARD_COUNT), settings.SHARD_KEY)
+    return _coordinator
+
+
+def index_rows(rows: List[Dict]) -> None:
+    """Save/update hook: send rows (id, tenant_id, style_number, feature_vector) to their shards."""
+    coordinator = get_shard_coordinator()
+    if coordinator is not None and coordinator.shards and rows:
+        try:
+            coordinator.upsert(rows)
+        except ShardError as e:
+            logger.error("sharded index not updated: %s", e)
+
+
+def discard_rows(ids: Iterable[int]) -> None:
+    """Delete hook: drop these ids from every shard."""
+    coordinator = get_shard_coordinator()
+    ids = list(ids)
+    if coordinator is not None and coordinator.shards and ids:
+        try:
+            coordinator.discard(ids)
+        except ShardError as e:
+            logger.error("sharded index not updated: %s", e)
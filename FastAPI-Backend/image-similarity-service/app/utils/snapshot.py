@@ -0,0 +1,199 @@
+# app/utils/snapshot.py
+"""
+On-disk snapshots of the vector catalog.
+
+A snapshot is a directory with:
+    vectors.npy     float32 matrix, one row per image (loadable with np.load, mmap_mode='r')
+    metadata.jsonl  one JSON object per row, same order: id, tenant_id, style_number,
+                    image_url, etag, phash (16 hex digits), date_created (ISO 8601),
+                    model_id (embedding model of the vector)
+    manifest.json   count, dim, dtype and the tenant/style filter used for the export
+
+Export streams from a server-side cursor and writes rows as they arrive; import
+streams the files back with binary COPY. Neither holds more than one batch.
+"""
+
+import os
+import json
+import shutil
+import struct
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.database import pg_connect
+
+
+SNAPSHOT_FORMAT = "fvector-snapshot"
+SNAPSHOT_VERSION = 1
+VECTORS_FILE = "vectors.npy"
+METADATA_FILE = "metadata.jsonl"
+MANIFEST_FILE = "manifest.json"
+
+# fixed-size .npy header, rewritten with the final row count when the export ends
+NPY_HEADER_LEN = 128
+
+
+class SnapshotError(Exception):
+    """Raised for an unreadable snapshot or inconsistent vector data."""
+
+
+def _npy_header(rows: int, dim: int) -> bytes:
+    header = "{'descr': '<f4', 'fortran_order': False, 'shape': (%d, %d), }" % (rows, dim)
+    header = header.ljust(NPY_HEADER_LEN - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+def _metadata_record(row: Dict) -> Dict:
+    created = row.get('date_created')
+    return {
+        'id': row['id'],
+        'tenant_id': row['tenant_id'],
+        'style_number': row.get('style_number'),
+        'image_url': row.get('image_url'),
+        'etag': row.get('etag'),
+        'phash': format(row['phash'], '016x') if row.get('phash') is not None else None,
+        'date_created': created.isoformat() if created else None,
+        'model_id': row.get('model_id'),
+    }
+
+
+def export_snapshot(out_dir: str, tenant_id: Optional[str] = None, style_number: Optional[str] = None,
+                    fetch_size: Optional[int] = None,
+                    on_batch: Optional[Callable[[int], None]] = None) -> Dict:
+    """
+    Write the vectors (optionally of one tenant/style) to a new snapshot directory.
+
+    Files are written to `<out_dir>.partial` and renamed once complete, so an
+    interrupted export never leaves something that looks like a snapshot.
+    `on_batch(rows_in_batch)` is called after each batch is written.
+
+    Returns:
+        The manifest (count, dim, ...), also stored as manifest.json
+    """
+    if os.path.exists(out_dir):
+        raise SnapshotError(f"{out_dir} already exists")
+    partial = f"{out_dir}.partial"
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    count, skipped, dim = 0, 0, None
+    with open(os.path.join(partial, VECTORS_FILE), 'wb') as vf, \
+            open(os.path.join(partial, METADATA_FILE), 'w', encoding='utf-8') as mf:
+        vf.write(_npy_header(0, 0))
+        for batch in pg_connect.iter_vector_batches(tenant_id, style_number, fetch_size=fetch_size):
+            rows = [row for row in batch if row['feature_vector'] is not None]
+            skipped += len(batch) - len(rows)
+            if rows:
+                dims = {len(row['feature_vector']) for row in rows}
+                dim = dim or min(dims)
+                if dims != {dim}:
+                    raise SnapshotError(f"mixed vector dimensions in export: {sorted(dims | {dim})}")
+                vf.write(np.asarray([row['feature_vector'] for row in rows], dtype='<f4').tobytes())
+                for row in rows:
+                    mf.write(json.dumps(_metadata_record(row)) + '\n')
+                count += len(rows)
+            if on_batch:
+                on_batch(len(batch))
+        vf.seek(0)
+        vf.write(_npy_header(count, dim or 0))
+
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'count': count,
+        'dim': dim or 0,
+        'dtype': 'float32',
+        'tenant_id': tenant_id,
+        'style_number': style_number,
+        'skipped_without_vector': skipped,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(partial, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.rename(partial, out_dir)
+    return manifest
+
+
+def read_manifest(src_dir: str) -> Dict:
+    try:
+        with open(os.path.join(src_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise SnapshotError(f"not a snapshot directory: {src_dir} ({e})")
+    if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError(f"unsupported snapshot format in {src_dir}")
+    return manifest
+
+
+def _open_vectors(src_dir: str, manifest: Dict) -> np.ndarray:
+    if manifest['count'] == 0:
+        # an empty file cannot be memory-mapped
+        return np.zeros((0, manifest['dim']), dtype=np.float32)
+    vectors = np.load(os.path.join(src_dir, VECTORS_FILE), mmap_mode='r')
+    if vectors.shape != (manifest['count'], manifest['dim']):
+        raise SnapshotError(f"snapshot {src_dir} is incomplete")
+    return vectors
+
+
+def load_snapshot(src_dir: str) -> Tuple[np.ndarray, List[Dict]]:
+    """
+    Open a snapshot for building a local index: (vectors, metadata).
+
+    The vectors are memory-mapped (read-only), so only the pages used are read.
+    """
+    manifest = read_manifest(src_dir)
+    vectors = _open_vectors(src_dir, manifest)
+    with open(os.path.join(src_dir, METADATA_FILE), encoding='utf-8') as f:
+        metadata = [json.loads(line) for line in f]
+    if len(metadata) != manifest['count']:
+        raise SnapshotError(f"snapshot {src_dir} is incomplete")
+    return vectors, metadata
+
+
+def iter_snapshot(src_dir: str, batch_size: int = 5000) -> Iterator[Tuple[np.ndarray, List[Dict]]]:
+    """Stream (vectors, metadata) batches from a snapshot, with metadata ready for `pg_connect.copy_vectors`."""
+    manifest = read_manifest(src_dir)
+    vectors = _open_vectors(src_dir, manifest)
+
+    start = 0
+    with open(os.path.join(src_dir, METADATA_FILE), encoding='utf-8') as f:
+        while start < manifest['count']:
+            metadata = []
+            for line in f:
+                record = json.loads(line)
+                if record.get('phash') is not None:
+                    record['phash'] = int(record['phash'], 16)
+                if record.get('date_created'):
+                    record['date_created'] = datetime.fromisoformat(record['date_created'])
+                metadata.append(record)
+                if len(metadata) >= batch_size:
+                    break
+            if not metadata:
+                raise SnapshotError(f"snapshot {src_dir} has fewer metadata rows than vectors")
+            yield np.asarray(vectors[start:start + len(metadata)]), metadata
+            start += len(metadata)
+
+
+def import_snapshot(src_dir: str, replace: bool = False, keep_ids: bool = False, batch_size: int = 5000) -> int:
+    """
+    Load a snapshot into fvector_pg with binary COPY.
+
+    Args:
+        src_dir: Snapshot directory
+        replace: Delete the rows in the snapshot's scope (its tenant/style filter,
+                 or the whole table) in the same transaction first
+        keep_ids: Keep the exported ids (restoring a table) instead of assigning new ones
+
+    Returns:
+        Number of rows loaded
+    """
+    manifest = read_manifest(src_dir)
+    return pg_connect.copy_vectors(
+        iter_snapshot(src_dir, batch_size),
+        keep_ids=keep_ids,
+        replace=replace,
+        tenant_id=manifest.get('tenant_id'),
+        style_number=manifest.get('style_number'),
+    )
@@ -0,0 +1,514 @@
+# app/utils/storage.py
+
+import os
+import time
+import uuid
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import settings
+from app.utils.metrics import STORAGE_QUEUE_SECONDS, STORAGE_SECONDS, record_stage
+
+
+class StorageError(Exception):
+    """Raised when a storage backend operation fails."""
+
+
+class ObjectNotFound(StorageError):
+    """Raised when the requested object key does not exist."""
+
+
+class StorageBackend(ABC):
+    """Object storage interface used by the image service.
+
+    Public methods time every call so that I/O latency can be compared
+    between backends (see `latency_stats`). Subclasses implement the
+    underscore-prefixed methods.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    # --- timing helpers ------------------------------------------------
+    def _record(self, op: str, started: float):
+        elapsed = time.perf_counter() - started
+        STORAGE_SECONDS.observe(elapsed, backend=self.name, op=op)
+        record_stage(f"storage_{op}", elapsed)
+        with self._stats_lock:
+            stat = self._stats.setdefault(op, {"count": 0, "total_s": 0.0, "max_s": 0.0})
+            stat["count"] += 1
+            stat["total_s"] += elapsed
+            stat["max_s"] = max(stat["max_s"], elapsed)
+
+    def latency_stats(self) -> Dict[str, Dict[str, float]]:
+        """Return per-operation call count, mean and max latency (milliseconds)."""
+        with self._stats_lock:
+            return {
+                op: {
+                    "count": int(s["count"]),
+                    "mean_ms": round(s["total_s"] / s["count"] * 1000, 3) if s["count"] else 0.0,
+                    "max_ms": round(s["max_s"] * 1000, 3),
+                }
+                for op, s in self._stats.items()
+            }
+
+    # --- public API ----------------------------------------------------
+    def put(self, key: str, data, content_type: Optional[str] = None) -> str:
+        """Store `data` (bytes or file-like) under `key` and return its URL."""
+        started = time.perf_counter()
+        try:
+            self._put(key, data, content_type)
+            return self.url_for(key)
+        finally:
+            self._record("put", started)
+
+    def get(self, key: str) -> bytes:
+        """Return the object content. Raises ObjectNotFound if missing."""
+        started = time.perf_counter()
+        try:
+            return self._get(key)
+        finally:
+            self._record("get", started)
+
+    def fetch(self, key: str) -> Tuple[bytes, str]:
+        """Return (content, etag) for `key`. Raises ObjectNotFound if missing."""
+        started = time.perf_counter()
+        try:
+            return self._fetch(key)
+        finally:
+            self._record("get", started)
+
+    def stat(self, key: str) -> Optional[Dict]:
+        """Return {key, size, etag, last_modified} for `key`, or None if missing."""
+        started = time.perf_counter()
+        try:
+            return self._stat(key)
+        finally:
+            self._record("stat", started)
+
+    def delete(self, key: str):
+        """Delete a single object. Deleting a missing key is not an error."""
+        started = time.perf_counter()
+        try:
+            self._delete(key)
+        finally:
+            self._record("delete", started)
+
+    def delete_many(self, keys: List[str]) -> List[str]:
+        """Delete several objects. Returns the keys that could not be deleted."""
+        if not keys:
+            return []
+        started = time.perf_counter()
+        try:
+            return self._delete_many(list(keys))
+        finally:
+            self._record("delete_many", started)
+
+    def list(self, prefix: str = "", start_after: str = "") -> Iterator[Dict]:
+        """Yield {key, size, etag, last_modified} for objects under `prefix`, sorted by key.
+
+        If `start_after` is given, only keys strictly greater than it are returned.
+        """
+        started = time.perf_counter()
+        try:
+            yield from self._list(prefix, start_after)
+        finally:
+            self._record("list", started)
+
+    def presign(self, key: str, expires_in: int = 3600) -> str:
+        """Return a time-limited URL that can be used to fetch the object."""
+        started = time.perf_counter()
+        try:
+            return self._presign(key, expires_in)
+        finally:
+            self._record("presign", started)
+
+    @abstractmethod
+    def url_for(self, key: str) -> str:
+        """Return the canonical (stored) URL for an object key."""
+
+    @abstractmethod
+    def key_from_url(self, url: str) -> str:
+        """Inverse of `url_for`."""
+
+    # --- backend hooks -------------------------------------------------
+    @abstractmethod
+    def _put(self, key: str, data, content_type: Optional[str]): ...
+
+    @abstractmethod
+    def _get(self, key: str) -> bytes: ...
+
+    @abstractmethod
+    def _stat(self, key: str) -> Optional[Dict]: ...
+
+    @abstractmethod
+    def _delete(self, key: str): ...
+
+    @abstractmethod
+    def _list(self, prefix: str, start_after: str) -> Iterator[Dict]: ...
+
+    @abstractmethod
+    def _presign(self, key: str, expires_in: int) -> str: ...
+
+    def _fetch(self, key: str) -> Tuple[bytes, str]:
+        data = self._get(key)
+        meta = self._stat(key)
+        if meta is None:
+            raise ObjectNotFound(f"Object {key} was removed while reading")
+        return data, meta["etag"]
+
+    def _delete_many(self, keys: List[str]) -> List[str]:
+        failed = []
+        for key in keys:
+            try:
+                self._delete(key)
+            except Exception:
+                failed.append(key)
+        return failed
+
+
+class S3Storage(StorageBackend):
+    """AWS S3 backend. The boto3 client is created on first use."""
+
+    name = "s3"
+
+    # S3 DeleteObjects accepts at most 1000 keys per request
+    DELETE_BATCH_SIZE = 1000
+
+    def __init__(self, bucket: Optional[str] = None):
+        super().__init__()
+        self.bucket = bucket or settings.AWS_BUCKET_NAME
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+
+                    self._client = boto3.client(
+                        "s3",
+                        aws_access_key_id=settings.AWS_ACCESS_KEY,
+                        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                        region_name=settings.AWS_REGION,
+                    )
+        return self._client
+
+    def url_for(self, key: str) -> str:
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def key_from_url(self, url: str) -> str:
+        return url.split(f"{self.bucket}.s3.amazonaws.com/")[-1]
+
+    def _wrap(self, e: Exception, key: Optional[str] = None) -> Exception:
+        from botocore.exceptions import NoCredentialsError, ClientError
+
+        if isinstance(e, NoCredentialsError):
+            return StorageError("AWS credentials not available")
+        if isinstance(e, ClientError):
+            code = e.response.get("Error", {}).get("Code")
+            if code in ("NoSuchKey", "404", "NotFound"):
+                return ObjectNotFound(f"Object {key} not found in bucket {self.bucket}")
+            return StorageError(f"S3 error: {e}")
+        return e
+
+    def _put(self, key, data, content_type):
+        extra = {"ContentType": content_type} if content_type else {}
+        try:
+            if hasattr(data, "read"):
+                self.client.upload_fileobj(data, self.bucket, key, ExtraArgs=extra or None)
+            else:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=data, **extra)
+        except Exception as e:
+            raise self._wrap(e, key)
+
+    def _get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+            return response["Body"].read()
+        except Exception as e:
+            raise self._wrap(e, key)
+
+    def _fetch(self, key):
+        # GetObject returns the ETag, so no extra HEAD round trip is needed
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key)
+            return response["Body"].read(), response["ETag"].strip('"')
+        except Exception as e:
+            raise self._wrap(e, key)
+
+    def _stat(self, key):
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            err = self._wrap(e, key)
+            if isinstance(err, ObjectNotFound):
+                return None
+            raise err
+        return {
+            "key": key,
+            "size": response["ContentLength"],
+            "etag": response["ETag"].strip('"'),
+            "last_modified": response["LastModified"],
+        }
+
+    def _delete(self, key):
+        try:
+            self.client.delete_object(Bucket=self.bucket, Key=key)
+        except Exception as e:
+            raise self._wrap(e, key)
+
+    def _delete_many(self, keys):
+        def delete_chunk(chunk):
+            try:
+                response = self.client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": k} for k in chunk], "Quiet": True},
+                )
+                return [err["Key"] for err in response.get("Errors", [])]
+            except Exception:
+                return chunk
+
+        chunks = [keys[i:i + self.DELETE_BATCH_SIZE] for i in range(0, len(keys), self.DELETE_BATCH_SIZE)]
+        if len(chunks) == 1:
+            return delete_chunk(chunks[0])
+        # boto3 clients are thread-safe; DeleteObjects requests run side by side
+        workers = min(int(settings.STORAGE_DELETE_WORKERS), len(chunks))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return [key for failed in pool.map(delete_chunk, chunks) for key in failed]
+
+    def _list(self, prefix, start_after):
+        params = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            params["StartAfter"] = start_after
+        try:
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(**params):
+                for obj in page.get("Contents", []):
+                    yield {
+                        "key": obj["Key"],
+                        "size": obj["Size"],
+                        "etag": obj["ETag"].strip('"'),
+                        "last_modified": obj["LastModified"],
+                    }
+        except Exception as e:
+            raise self._wrap(e)
+
+    def _presign(self, key, expires_in):
+        try:
+            return self.client.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": self.bucket, "Key": key},
+                ExpiresIn=expires_in,
+            )
+        except Exception as e:
+            raise self._wrap(e, key)
+
+
+class LocalStorage(StorageBackend):
+    """Filesystem backend rooted at a local directory (e.g. an NVMe mount).
+
+    Writes go to a temporary file in the target directory and are renamed into
+    place, so readers never see partial objects. The ETag is derived from
+    size and mtime, which is enough to detect replaced objects.
+    """
+
+    name = "local"
+
+    def __init__(self, root: Optional[str] = None, base_url: Optional[str] = None):
+        super().__init__()
+        self.root = os.path.abspath(root or settings.LOCAL_STORAGE_DIR or "images")
+        self.base_url = (base_url or settings.LOCAL_STORAGE_URL or f"file://{self.root}").rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.root, key))
+        if not path.startswith(self.root + os.sep):
+            raise StorageError(f"Invalid object key: {key}")
+        return path
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+    def key_from_url(self, url: str) -> str:
+        return url.split(f"{self.base_url}/")[-1]
+
+    @staticmethod
+    def _etag(st: os.stat_result) -> str:
+        return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+    def _put(self, key, data, content_type):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                if hasattr(data, "read"):
+                    while True:
+                        chunk = data.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                else:
+                    f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise StorageError(f"Error writing {key}: {e}")
+
+    def _get(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ObjectNotFound(f"Object {key} not found in {self.root}")
+
+    def _fetch(self, key):
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read(), self._etag(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            raise ObjectNotFound(f"Object {key} not found in {self.root}")
+
+    def _stat(self, key):
+        try:
+            st = os.stat(self._path(key))
+        except FileNotFoundError:
+            return None
+        return {
+            "key": key,
+            "size": st.st_size,
+            "etag": self._etag(st),
+            "last_modified": datetime.fromtimestamp(st.st_mtime, tz=timezone.utc),
+        }
+
+    def _delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _list(self, prefix, start_after):
+        # Walk in the same order S3 lists keys (lexicographic by full key).
+        # Directories sort as "<name>/" so that "a-b" comes before "a/b".
+        def walk(directory):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                return
+            entries.sort(key=lambda e: e.name + "/" if e.is_dir(follow_symlinks=False) else e.name)
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from walk(entry.path)
+                elif not entry.name.endswith(".tmp"):
+                    yield entry
+
+        # Start from the deepest directory fully covered by the prefix
+        prefix_dir = os.path.dirname(prefix)
+        start = os.path.join(self.root, prefix_dir) if prefix_dir else self.root
+        for entry in walk(start):
+            key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+            if not key.startswith(prefix) or key <= start_after:
+                continue
+            st = entry.stat()
+            yield {
+                "key": key,
+                "size": st.st_size,
+                "etag": self._etag(st),
+                "last_modified": datetime.fromtimestamp(st.st_mtime, tz=timezone.utc),
+            }
+
+    def _presign(self, key, expires_in):
+        # Local objects are served (or mounted) as-is; there is nothing to sign.
+        return self.url_for(key)
+
+
+class AsyncStorage:
+    """Asyncio wrapper around a StorageBackend.
+
+    Every call runs in the default thread pool so route handlers can await
+    storage I/O without blocking the event loop.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+
+    @property
+    def name(self) -> str:
+        return self.backend.name
+
+    def url_for(self, key: str) -> str:
+        return self.backend.url_for(key)
+
+    def key_from_url(self, url: str) -> str:
+        return self.backend.key_from_url(url)
+
+    async def _run(self, op: str, fn, *args):
+        """Run `fn` in the default thread pool, recording how long it waited for a thread."""
+        submitted = time.perf_counter()
+
+        def call():
+            STORAGE_QUEUE_SECONDS.observe(time.perf_counter() - submitted, op=op)
+            return fn(*args)
+
+        return await asyncio.to_thread(call)
+
+    async def put(self, key: str, data, content_type: Optional[str] = None) -> str:
+        return await self._run("put", self.backend.put, key, data, content_type)
+
+    async def get(self, key: str) -> bytes:
+        return await self._run("get", self.backend.get, key)
+
+    async def fetch(self, key: str) -> Tuple[bytes, str]:
+        return await self._run("get", self.backend.fetch, key)
+
+    async def stat(self, key: str) -> Optional[Dict]:
+        return await self._run("stat", self.backend.stat, key)
+
+    async def delete(self, key: str):
+        await self._run("delete", self.backend.delete, key)
+
+    async def delete_many(self, keys: List[str]) -> List[str]:
+        return await self._run("delete_many", self.backend.delete_many, keys)
+
+    async def list(self, prefix: str = "", start_after: str = "") -> List[Dict]:
+        return await self._run("list", lambda: list(self.backend.list(prefix, start_after)))
+
+    async def presign(self, key: str, expires_in: int = 3600) -> str:
+        return await self._run("presign", self.backend.presign, key, expires_in)
+
+
+BACKENDS = {
+    "s3": S3Storage,
+    "local": LocalStorage,
+}
+
+_storage: Optional[StorageBackend] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> StorageBackend:
+    """Return the process-wide storage backend selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                backend_name = (settings.STORAGE_BACKEND or "s3").lower()
+                if backend_name not in BACKENDS:
+                    raise StorageError(f"Unknown storage backend: {backend_name}")
+                _storage = BACKENDS[backend_name]()
+    return _storage
+
+
+def get_async_storage() -> AsyncStorage:
+    return AsyncStorage(get_storage())
@@ -0,0 +1,113 @@
+# app/utils/sync.py
+
+from typing import Dict, List, Optional
+
+from config import settings
+from app.database import pg_connect
+from app.utils.storage import get_storage
+from app.utils.s3_handler import iter_images_from_s3, image_search_prefix
+
+
+class SyncAborted(Exception):
+    """Raised when a sync would delete more vectors than the safety limit allows."""
+
+
+def compute_sync_diff(prefix: str = "", tenant_id: Optional[str] = None) -> Dict:
+    """
+    Compare storage against fvector_pg by image URL and ETag.
+
+    Only rows whose image_url falls under the listed prefix are considered, so
+    vectors saved from other buckets/backends are never touched. The DB index is
+    read *before* listing storage: a row saved by the API while the listing runs
+    is then simply not part of this diff, instead of being seen as vanished.
+
+    Args:
+        prefix: Optional storage prefix to sync
+        tenant_id: Optional tenant ID to restrict the sync to
+
+    Returns:
+        Dict with:
+            to_embed: image infos (as from `iter_images_from_s3`) that are new or whose
+                      ETag changed; changed ones carry `replace_ids`
+            to_delete: ids of rows whose object is gone, plus duplicate rows for one URL
+            to_adopt: (id, etag) for rows stored without an ETag (recorded, not re-embedded)
+            summary: counts for each category
+    """
+    storage = get_storage()
+    url_prefix = storage.url_for(image_search_prefix(prefix, tenant_id))
+
+    # image_url -> ids (newest first) and the ETag of the newest row
+    stored: Dict[str, Dict] = {}
+    for row_id, image_url, etag in pg_connect.fetch_image_index(url_prefix):
+        entry = stored.setdefault(image_url, {'ids': [], 'etag': etag})
+        entry['ids'].append(row_id)
+
+    to_embed: List[Dict] = []
+    to_delete: List[int] = []
+    to_adopt: List[tuple] = []
+    counts = {'listed': 0, 'stored': len(stored), 'added': 0, 'changed': 0,
+              'unchanged': 0, 'adopted': 0, 'deleted': 0, 'duplicates': 0}
+
+    for info in iter_images_from_s3(prefix=prefix, tenant_id=tenant_id):
+        counts['listed'] += 1
+        entry = stored.pop(info['url'], None)
+        if entry is None:
+            counts['added'] += 1
+            to_embed.append(info)
+            continue
+
+        newest, extra = entry['ids'][0], entry['ids'][1:]
+        if extra:
+            counts['duplicates'] += len(extra)
+            to_delete.extend(extra)
+
+        if entry['etag'] == info['etag']:
+            counts['unchanged'] += 1
+        elif entry['etag'] is None:
+            # saved before ETags were tracked; trust the vector and record the ETag
+            counts['adopted'] += 1
+            to_adopt.append((newest, info['etag']))
+        else:
+            counts['changed'] += 1
+            to_embed.append(dict(info, replace_ids=[newest]))
+
+    # whatever is left in the index has no object in storage any more
+    for entry in stored.values():
+        counts['deleted'] += len(entry['ids'])
+        to_delete.extend(entry['ids'])
+
+    return {
+        'to_embed': to_embed,
+        'to_delete': to_delete,
+        'to_adopt': to_adopt,
+        'summary': counts,
+    }
+
+
+def check_delete_limit(diff: Dict, force: bool = False):
+    """
+    Raise SyncAborted if the diff deletes more than SYNC_MAX_DELETE_FRACTION of
+    the stored vectors in scope. Guards scheduled runs against an empty or
+    misconfigured listing wiping the table.
+    """
+    if force:
+        return
+    summary = diff['summary']
+    stored = summary['stored']
+    if not stored or not summary['deleted']:
+        return
+    max_fraction = float(settings.SYNC_MAX_DELETE_FRACTION)
+    if summary['deleted'] / stored > max_fraction:
+        raise SyncAborted(
+            f"Sync would delete {summary['deleted']} of {stored} stored images "
+            f"(limit {max_fraction:.0%}); re-run with force to apply"
+        )
+
+
+def format_sync_summary(summary: Dict) -> str:
+    return (
+        f"listed {summary['listed']}, stored {summary['stored']}: "
+        f"+{summary['added']} added, ~{summary['changed']} changed, "
+        f"-{summary['deleted']} deleted, {summary['duplicates']} duplicates, "
+        f"{summary['adopted']} adopted, {summary['unchanged']} unchanged"
+    )
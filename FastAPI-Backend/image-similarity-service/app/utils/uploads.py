@@ -0,0 +1,133 @@
+# app/utils/uploads.py
+
+import tempfile
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException, UploadFile
+from PIL import Image, UnidentifiedImageError
+
+from config import settings
+from app.utils.metrics import stage
+
+
+MB = 1024 * 1024
+READ_CHUNK_SIZE = 1 * MB
+
+# Formats accepted on upload (PIL format names)
+ALLOWED_FORMATS = {'JPEG', 'PNG', 'BMP', 'TIFF', 'GIF', 'WEBP'}
+
+# Pillow raises DecompressionBombError above 2x this many pixels on open; we
+# reject anything above the limit ourselves in `sniff_image`.
+Image.MAX_IMAGE_PIXELS = int(settings.MAX_IMAGE_PIXELS)
+
+
+def max_upload_bytes() -> int:
+    return int(settings.MAX_UPLOAD_MB) * MB
+
+
+async def spool_upload(upload: UploadFile, max_bytes: Optional[int] = None) -> tempfile.SpooledTemporaryFile:
+    """
+    Copy an upload into a temp file that stays in memory up to UPLOAD_SPOOL_MB
+    and rolls over to disk beyond that, reading in fixed-size chunks.
+
+    Raises 413 as soon as more than `max_bytes` (default MAX_UPLOAD_MB) were read.
+    The returned file is positioned at 0; the caller closes it.
+    """
+    max_bytes = max_bytes or max_upload_bytes()
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // MB} MB upload limit")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=int(settings.UPLOAD_SPOOL_MB) * MB)
+    total = 0
+    try:
+        while True:
+            chunk = await upload.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // MB} MB upload limit")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def sniff_image(fileobj) -> Dict:
+    """
+    Read only the image header to get format and dimensions, without decoding pixels.
+
+    Raises 415 for files that are not a supported image and 413 for images over
+    MAX_IMAGE_PIXELS (including decompression bombs).
+    """
+    max_pixels = int(settings.MAX_IMAGE_PIXELS)
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            fmt, (width, height) = img.format, img.size
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail=f"Image exceeds the {max_pixels} pixel limit")
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="File is not a supported image")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=415, detail=f"Corrupt image: {e}")
+    finally:
+        fileobj.seek(0)
+
+    if fmt not in ALLOWED_FORMATS:
+        raise HTTPException(status_code=415, detail=f"Unsupported image format: {fmt}")
+    if width * height > max_pixels:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is {width}x{height}; the limit is {max_pixels} pixels",
+        )
+    return {'format': fmt, 'width': width, 'height': height}
+
+
+def decode_image(fileobj, max_side: Optional[int] = None) -> Image.Image:
+    """
+    Decode an image to RGB, at most `max_side` (default IMAGE_DECODE_MAX_SIDE) pixels on its longest side.
+
+    JPEGs are scaled down by the decoder itself (`draft`), so a large photo is never
+    materialised at full resolution. CLIP only sees 224x224 anyway.
+    """
+    max_side = max_side or int(settings.IMAGE_DECODE_MAX_SIDE)
+    fileobj.seek(0)
+    try:
+        with Image.open(fileobj) as img:
+            img.draft('RGB', (max_side, max_side))
+            rgb = img.convert('RGB')
+    except Image.DecompressionBombError:
+        raise HTTPException(status_code=413, detail="Image exceeds the pixel limit")
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=415, detail="File is not a supported image")
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=415, detail=f"Corrupt image: {e}")
+    finally:
+        fileobj.seek(0)
+
+    if max(rgb.size) > max_side:
+        rgb.thumbnail((max_side, max_side), Image.BICUBIC)
+    return rgb
+
+
+async def read_image_upload(upload: UploadFile, decode: bool = True) -> Tuple[tempfile.SpooledTemporaryFile, Optional[Image.Image], Dict]:
+    """
+    Spool, validate and (optionally) decode an uploaded image.
+
+    Returns (file, image, info): the spooled file (positioned at 0, for uploading
+    to storage; caller closes it), the decoded RGB image or None, and the sniffed
+    format/width/height.
+    """
+    with stage('read_upload'):
+        spool = await spool_upload(upload)
+    try:
+        with stage('decode'):
+            info = sniff_image(spool)
+            image = decode_image(spool) if decode else None
+    except BaseException:
+        spool.close()
+        raise
+    return spool, image, info
@@ -0,0 +1,126 @@
+# app/utils/write_coalescer.py
+"""
+Group commit for single-row vector inserts.
+
+Requests that save one image (`save-image`, `search-and-store`) hand their row to
+the coalescer and await the id. A writer thread collects rows for up to
+WRITE_COALESCE_MS after the first one arrives (or until WRITE_COALESCE_MAX_ROWS)
+and inserts them with one multi-row INSERT in one transaction, so a burst of
+uploads costs one connection and one commit instead of one each. Rows that
+arrive while a batch is being written simply wait for the next one.
+
+If the batch fails, its rows are retried one by one so a single bad row only
+fails its own request. WRITE_COALESCE_MS=0 turns the coalescer off and inserts
+directly.
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from app.database import pg_connect
+from app.utils.metrics import Histogram, stage
+
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_ROWS = Histogram('image_write_batch_rows', 'Rows per coalesced insert',
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+
+
+class WriteCoalescer:
+    """Collects rows from many threads/requests and inserts them in batches from one writer thread."""
+
+    def __init__(self, window_seconds: float, max_rows: int):
+        self.window_seconds = window_seconds
+        self.max_rows = max(1, max_rows)
+        self._queue: "queue.Queue[Tuple[Dict, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="write-coalescer", daemon=True)
+                self._thread.start()
+
+    def submit(self, row: Dict) -> Future:
+        """Queue a row (see `pg_connect.bulk_upsert_vectors`); the future resolves to its id."""
+        future = Future()
+        self._ensure_started()
+        self._queue.put((row, future))
+        return future
+
+    def _collect(self) -> List[Tuple[Dict, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.exception("Write coalescer flush failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _flush(self, batch: List[Tuple[Dict, Future]]):
+        WRITE_BATCH_ROWS.observe(len(batch))
+        try:
+            with stage("db_insert_batch"):
+                ids = pg_connect.bulk_upsert_vectors([row for row, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # one bad row fails the whole statement: retry singly so it only fails its own request
+            for row, future in batch:
+                try:
+                    future.set_result(pg_connect.bulk_upsert_vectors([row])[0])
+                except Exception as row_error:
+                    future.set_exception(row_error)
+            return
+        for (_, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+
+
+_coalescer: Optional[WriteCoalescer] = None
+_coalescer_lock = threading.Lock()
+
+
+def get_write_coalescer() -> Optional[WriteCoalescer]:
+    """The process-wide coalescer, or None with WRITE_COALESCE_MS=0."""
+    global _coalescer
+    window_ms = float(settings.WRITE_COALESCE_MS)
+    if window_ms <= 0:
+        return None
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = WriteCoalescer(window_ms / 1000.0, int(settings.WRITE_COALESCE_MAX_ROWS))
+    return _coalescer
+
+
+async def insert_vector(row: Dict) -> int:
+    """
+    Insert one row (tenant_id, style_number, image_url, feature_vector, phash) and
+    return its id, batched with concurrent inserts when the coalescer is on.
+    """
+    coalescer = get_write_coalescer()
+    with stage("db_insert"):
+        if coalescer is None:
+            return (await asyncio.to_thread(pg_connect.bulk_upsert_vectors, [row]))[0]
+        return await asyncio.wrap_future(coalescer.submit(row))
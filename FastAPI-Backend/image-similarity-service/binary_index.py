@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Set up sign-bit (binary) quantized retrieval and measure its recall.
+
+Searches with retrieval=binary shortlist rows by Hamming distance on a
+`feature_bits bit(dim)` column (96 bytes per 768-dim vector) and rerank
+BINARY_RERANK_FACTOR * top_k of them by exact cosine; see
+app/database/binary_quantization.py.
+
+Examples:
+    python binary_index.py enable                  # column + trigger, backfill, HNSW index if pgvector >= 0.7
+    python binary_index.py benchmark --queries 200 --top-k 10 --factors 2 5 10 20
+    python binary_index.py status
+    python binary_index.py disable
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import settings
+from app.database import binary_quantization as bq
+from app.database import pg_connect
+
+
+def run_enable(args):
+    dim = int(settings.PGVECTOR_DIM)
+    print(f"Adding feature_bits bit({dim}) column and sync trigger")
+    bq.enable(dim)
+
+    started = time.time()
+    state = {'last': started}
+
+    def progress(updated, last_id):
+        now = time.time()
+        if now - state['last'] >= 2:
+            state['last'] = now
+            print(f"  {updated} rows (up to id {last_id}, {updated / (now - started):.0f}/s)", flush=True)
+
+    updated = bq.backfill(dim, batch_size=args.batch_size, on_batch=progress)
+    print(f"Computed sign bits for {updated} rows in {time.time() - started:.1f}s")
+
+    if pg_connect.pgvector_version() >= (0, 7) and not args.no_index:
+        started = time.time()
+        print("Building HNSW Hamming index (CONCURRENTLY)")
+        bq.build_index(m=args.m, ef_construction=args.ef_construction)
+        print(f"Index built in {time.time() - started:.1f}s")
+    else:
+        print("No HNSW index: shortlists use a sequential bit_count scan")
+
+
+def run_benchmark(args):
+    report = bq.benchmark(queries=args.queries, top_k=args.top_k, factors=tuple(args.factors))
+    print(f"{report['queries']} queries, top_k={report['top_k']}, index: {report['index'] or 'none'}")
+    for mode, stats in report['modes'].items():
+        recall = f"{stats['recall']:.4f}" if stats['recall'] is not None else "n/a"
+        print(f"  {mode:<12} recall@{report['top_k']} {recall}  p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms")
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('command', choices=['enable', 'benchmark', 'status', 'disable'])
+    p.add_argument('--batch-size', type=int, default=5000, help='Ids per backfill transaction')
+    p.add_argument('--no-index', action='store_true', help='Skip the HNSW index')
+    p.add_argument('--m', type=int, default=16, help='HNSW m (links per node)')
+    p.add_argument('--ef-construction', type=int, default=64, help='HNSW ef_construction')
+    p.add_argument('--queries', type=int, default=100, help='Stored vectors used as queries for benchmark')
+    p.add_argument('--top-k', type=int, default=10)
+    p.add_argument('--factors', type=int, nargs='+', default=[1, 2, 5, 10, 20], help='Rerank factors to compare')
+    p.add_argument('--json', action='store_true', help='Also print the benchmark report as JSON')
+    args = p.parse_args()
+
+    try:
+        if args.command == 'enable':
+            run_enable(args)
+        elif args.command == 'benchmark':
+            run_benchmark(args)
+        elif args.command == 'status':
+            print(json.dumps(bq.status(), indent=2))
+        else:
+            bq.disable()
+            print("Removed feature_bits, its trigger and index; restart the services.")
+    except bq.BinaryIndexError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Build the in-process IVF-PQ index used by retrieval=pq searches.
+
+Trains coarse centroids and PQ codebooks on a sample, encodes every vector to
+PQ_M bytes and writes an .npz file that the service loads from PQ_INDEX_PATH at
+startup; see app/utils/pq_index.py. Build from the database, or from a vector
+snapshot (vector_snapshot.py export) whose memory-mapped vectors can then serve
+the exact rerank (PQ_RERANK_SOURCE=snapshot).
+
+Examples:
+    python build_pq_index.py indexes/catalog.pq.npz
+    python build_pq_index.py indexes/catalog.pq.npz --snapshot snapshots/all --nlist 2048
+    python build_pq_index.py indexes/catalog.pq.npz --evaluate 200     # also report recall@10 vs exact
+"""
+import os
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from config import settings
+from app.database import pg_connect
+from app.utils.pq_index import build_from_db, build_from_snapshot, _normalize
+from app.utils.snapshot import SnapshotError
+
+
+def evaluate(index, queries: int, top_k: int, nprobe: int, factor: int):
+    """Recall@k of PQ candidates (with exact rerank) against exact search in Postgres."""
+    sample = pg_connect.sample_vectors(queries)
+    recalls, timings = [], []
+    for vector in sample:
+        truth = {r['id'] for r in pg_connect.search_similar_vectors(vector, top_k=top_k)}
+        started = time.perf_counter()
+        ids, _ = index.search(vector, top_k * factor, nprobe)
+        timings.append(time.perf_counter() - started)
+        rows = pg_connect.fetch_feature_vectors([int(i) for i in ids])
+        found = list(rows)
+        scores = _normalize(np.stack([rows[i] for i in found])) @ _normalize(vector) if found else []
+        top = {found[i] for i in np.argsort(-np.asarray(scores))[:top_k]}
+        if truth:
+            recalls.append(len(truth & top) / len(truth))
+    print(f"recall@{top_k} {np.mean(recalls):.4f} over {len(recalls)} queries "
+          f"(nprobe {nprobe}, rerank x{factor}); index search p50 {np.percentile(timings, 50) * 1000:.1f} ms")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('out', help='Index file to write (.npz)')
+    p.add_argument('--snapshot', default=None, help='Build from this snapshot directory instead of the database')
+    p.add_argument('--nlist', type=int, default=int(settings.PQ_NLIST), help='Coarse cells')
+    p.add_argument('--m', type=int, default=int(settings.PQ_M), help='Sub-quantizers (bytes per vector)')
+    p.add_argument('--train-size', type=int, default=100000, help='Vectors sampled for training')
+    p.add_argument('--evaluate', type=int, default=0, metavar='N', help='Measure recall on N stored vectors after building')
+    p.add_argument('--top-k', type=int, default=10)
+    args = p.parse_args()
+
+    started = time.time()
+    state = {'rows': 0, 'last': started}
+
+    def progress(rows):
+        state['rows'] += rows
+        now = time.time()
+        if now - state['last'] >= 2:
+            state['last'] = now
+            print(f"  {state['rows']} vectors encoded ({state['rows'] / (now - started):.0f}/s)", flush=True)
+
+    try:
+        if args.snapshot:
+            index = build_from_snapshot(args.snapshot, args.nlist, args.m, args.train_size, on_batch=progress)
+        else:
+            index = build_from_db(args.nlist, args.m, args.train_size, on_batch=progress)
+    except (ValueError, SnapshotError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    index.save(args.out)
+    stats = index.stats()
+    print(f"Indexed {stats['vectors']} vectors in {time.time() - started:.1f}s: {stats['nlist']} cells, "
+          f"{stats['m']} bytes/code, {stats['code_bytes'] / 2**20:.1f} MB of codes and ids -> {args.out}")
+    if args.evaluate:
+        evaluate(index, args.evaluate, args.top_k, int(settings.PQ_NPROBE), int(settings.PQ_RERANK_FACTOR))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,18 @@ class Settings(BaseSettings):
     AWS_REGION: Optional[str] = None
     AWS_BUCKET_NAME: Optional[str] = None
     
+    # Storage backend: "s3" (default) or "local"
+    STORAGE_BACKEND: Optional[str] = "s3"
+    LOCAL_STORAGE_DIR: Optional[str] = "images"
+    LOCAL_STORAGE_URL: Optional[str] = None  # defaults to file://<LOCAL_STORAGE_DIR>
+    STORAGE_DELETE_WORKERS: Optional[str] = "4"  # concurrent 1000-key DeleteObjects requests
+    
+    # On-disk read-through cache for downloaded images (shared by all workers)
+    IMAGE_CACHE_ENABLED: bool = True
+    IMAGE_CACHE_DIR: Optional[str] = "/tmp/image-cache"
+    IMAGE_CACHE_MAX_MB: Optional[str] = "2048"
+    IMAGE_CACHE_TTL_SECONDS: Optional[str] = "3600"  # revalidate ETag after this age
+    
     # PostgreSQL / Neon (pgvector)
     DATABASE_URL: Optional[str] = None
     POSTGRES_DSN: Optional[str] = None
@@ -31,8 +43,92 @@ class Settings(BaseSettings):
     POSTGRES_PORT: Optional[str] = "5432"
     POSTGRES_DB: Optional[str] = None
     
+    # Background jobs (ingestion etc.)
+    JOB_WORKER_ENABLED: bool = True  # run a job runner in this process
+    JOB_POLL_SECONDS: Optional[str] = "5"
+    JOB_STALE_AFTER_SECONDS: Optional[str] = "300"  # re-claim jobs without a heartbeat for this long
+    JOB_CHUNK_SIZE: Optional[str] = "64"  # images per committed chunk (checkpoint granularity)
+    JOB_BATCH_SIZE: Optional[str] = "16"  # images per CLIP forward pass
+    JOB_DOWNLOAD_WORKERS: Optional[str] = "8"
+    JOB_MAX_INTERACTIVE_WAIT_SECONDS: Optional[str] = "2"  # max time a queued batch yields to searches
+    JOB_BATCH_PAUSE_MS: Optional[str] = "0"  # extra pause between batches
+
+    # CLIP inference scheduling: interactive lane first, weighted fair share per tenant within a lane
+    INFERENCE_CONCURRENCY: Optional[str] = "1"  # forward passes running at once in this process
+    INFERENCE_MAX_QUEUE_INTERACTIVE: Optional[str] = "64"  # waiting searches/saves beyond this get 503; 0 = unbounded
+    INFERENCE_MAX_QUEUE_BATCH: Optional[str] = "32"  # waiting batches beyond this fail; 0 = unbounded
+    INFERENCE_TENANT_WEIGHTS: Optional[str] = ""  # e.g. "acme=4,trial=0.5"; tenants not listed weigh 1
+
+    # Upload limits
+    MAX_REQUEST_MB: Optional[str] = "512"  # whole request body, checked from Content-Length before reading
+    MAX_UPLOAD_MB: Optional[str] = "25"  # per uploaded image
+    UPLOAD_SPOOL_MB: Optional[str] = "2"  # uploads larger than this are spooled to disk
+    MAX_IMAGE_PIXELS: Optional[str] = "50000000"  # width * height; larger images (and decompression bombs) get 413
+    IMAGE_DECODE_MAX_SIDE: Optional[str] = "1024"  # uploads are decoded at most this large (CLIP uses 224)
+
+    # Near-duplicate detection (perceptual hash)
+    PHASH_DEDUP_ENABLED: bool = True  # reuse the CLIP vector of a near-duplicate from the same tenant
+    PHASH_MAX_DISTANCE: Optional[str] = "4"  # max Hamming distance (of 64 bits) for a duplicate
+    PHASH_INDEX_TTL_SECONDS: Optional[str] = "300"  # reload a tenant's hashes after this long
+
+    # Bulk save (/img/save-images)
+    BULK_SAVE_MAX_ITEMS: Optional[str] = "500"  # images per request
+    BULK_SAVE_UPLOAD_WORKERS: Optional[str] = "8"
+    BULK_SAVE_BATCH_SIZE: Optional[str] = "16"  # images per CLIP forward pass
+
+    # Batch delete (/img/delete-images) and purge jobs (/img/purge-images)
+    BULK_DELETE_MAX_IDS: Optional[str] = "1000"  # ids per synchronous request
+    PURGE_CHUNK_SIZE: Optional[str] = "5000"  # rows deleted (and committed) per purge job chunk
+    IMAGE_LOOKUP_MAX_IDS: Optional[str] = "1000"  # ids per GET /img/images request
+
+    # Streaming reads (pg_connect.iter_vectors) and vector snapshots (vector_snapshot.py, /img/export-vectors)
+    VECTOR_FETCH_SIZE: Optional[str] = "2000"  # rows per server-side cursor round trip
+    SNAPSHOT_DIR: Optional[str] = "snapshots"  # where export jobs write their snapshots
+
+    # Storage -> vector DB sync
+    SYNC_MAX_DELETE_FRACTION: Optional[str] = "0.5"  # refuse to delete more than this share of stored vectors unless forced
+
+    # Orphan reconciliation (/img/reconcile-storage)
+    RECONCILE_GRACE_SECONDS: Optional[str] = "3600"  # never treat objects newer than this as orphans
+    RECONCILE_MAX_DELETE_FRACTION: Optional[str] = "0.1"  # refuse to fix more than this share of vectors/objects unless forced
+
+    # Grouped search (group_by_style): candidates fetched per requested group, and the cap when widening
+    SEARCH_GROUP_OVERFETCH: Optional[str] = "5"
+    SEARCH_GROUP_MAX_FETCH: Optional[str] = "2000"
+
     # pgvector settings
     PGVECTOR_DIM: Optional[str] = "768"  # CLIP ViT-L/14 embedding dimension
+    VECTOR_STORAGE: Optional[str] = "vector"  # "halfvec": new tables store halfvec(PGVECTOR_DIM) + HNSW index (pgvector >= 0.7)
+    HNSW_EF_SEARCH: Optional[str] = "40"  # minimum hnsw.ef_search for searches on a halfvec column (raised to the LIMIT)
+    BINARY_RERANK_FACTOR: Optional[str] = "10"  # retrieval=binary: rows shortlisted by Hamming distance per row returned
+    SEARCH_ALLOW_LIST_MAX: Optional[str] = "10000"  # most image_ids + style_numbers + tenant_ids values one search may restrict to
+
+    # In-process IVF-PQ index (retrieval=pq), built with build_pq_index.py
+    PQ_INDEX_PATH: Optional[str] = None  # .npz index file loaded at startup; unset disables retrieval=pq
+    PQ_NLIST: Optional[str] = "1024"  # coarse cells (build time; ~sqrt(N) to 4*sqrt(N))
+    PQ_M: Optional[str] = "96"  # sub-quantizers = code bytes per vector (build time; must divide PGVECTOR_DIM)
+    PQ_NPROBE: Optional[str] = "16"  # cells scanned per query
+    PQ_RERANK_FACTOR: Optional[str] = "10"  # candidates reranked exactly per row returned
+    PQ_RERANK_SOURCE: Optional[str] = "db"  # "db" or "snapshot" (memory-mapped vectors.npy the index was built from)
+    PQ_INDEX_REFRESH_SECONDS: Optional[str] = "60"  # pick up rows inserted/updated by other processes this often
+
+    # Per-stage timing: Server-Timing response header and Prometheus /metrics
+    METRICS_ENABLED: bool = True
+
+    # Sharded in-memory search (retrieval=sharded) across local worker processes
+    SHARD_COUNT: Optional[str] = "0"  # shard processes started with the server; 0 disables retrieval=sharded
+    SHARD_KEY: Optional[str] = "id"  # "id" (hash of id) or "tenant" (all of a tenant's rows on one shard)
+    SHARD_TIMEOUT_SECONDS: Optional[str] = "5"  # a shard slower than this fails the search with 503
+    SHARD_REFRESH_SECONDS: Optional[str] = "60"  # shards re-read rows written by other processes this often
+
+    # Group commit of single-image inserts (save-image, search-and-store)
+    WRITE_COALESCE_MS: Optional[str] = "5"  # collect concurrent inserts this long into one INSERT; 0 disables
+    WRITE_COALESCE_MAX_ROWS: Optional[str] = "200"  # flush earlier once this many rows are waiting
+
+    # Embedding sets (one per model); the active set is fvector_pg.feature_vector
+    EMBEDDING_MODEL: Optional[str] = "openai/clip-vit-large-patch14"  # model of existing rows / first active set
+    EMBEDDING_SET_REFRESH_SECONDS: Optional[str] = "5"  # processes pick up a switch of the active model this often
+    REEMBED_ACTIVATE_MAX_MISSING: Optional[str] = "500"  # rows the switch may embed while writes wait
 
     class Config:
         env_file = ".env"
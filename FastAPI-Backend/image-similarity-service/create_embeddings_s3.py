@@ -1,24 +1,42 @@
 #!/usr/bin/env python3
-"""Download images from S3, compute CLIP embeddings (image_size=224), and upsert into Vector Database.
+"""Download images from S3 (or the local storage backend), compute CLIP embeddings (image_size=224), and upsert into Vector Database.
+
+The backfill runs as a staged pipeline connected by bounded queues, so network
+I/O, image decoding, CLIP inference and database writes overlap:
+
+    list -> [download x --workers] -> [decode/preprocess x --decoders] -> [CLIP, --batch-size] -> [bulk insert, --insert-chunk]
 
 Assumptions:
 - S3 object keys are like `<tenant_id>/<...>/<layout_code>.<ext>` or `<tenant_id>/<layout_code>.<ext>`.
-- `style_type` will be inferred from the second path segment if present (otherwise left empty).
+- The file name (layout code) is stored as `style_number`.
+- `style_type` is inferred from the second path segment if present (only shown in dry runs).
+
+Examples:
+    python create_embeddings_s3.py --prefix "" --workers 16 --batch-size 32
+    python create_embeddings_s3.py --shard 0/4 --resume      # one of four parallel machines
+    python create_embeddings_s3.py --sync                    # mirror adds/changes/deletes (cron-safe)
 """
 import argparse
 import os
-from datetime import datetime
-
-import boto3
-from tqdm import tqdm
+import queue
+import sys
+import threading
+import time
+import zlib
 
-from config import settings
-from app.utils.embedding_extractor import compute_clip_embedding
+from app.utils.embedding_extractor import load_rgb_image, preprocess_clip_image, embed_clip_pixels
+from app.utils.dedup import dhash
+from app.utils.s3_handler import layout_code_from_key
+from app.utils.storage import get_storage
+from app.utils.sync import SyncAborted, compute_sync_diff, check_delete_limit, format_sync_summary
 from app.database import pg_connect
 
 
 IMG_EXTS = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff'}
 
+# Sentinel passed down the queues when a stage has no more work
+_DONE = object()
+
 
 def is_image_key(key: str) -> bool:
     _, ext = os.path.splitext(key.lower())
@@ -28,63 +46,333 @@ def is_image_key(key: str) -> bool:
 def parse_key(key: str):
     parts = key.split('/')
     tenant_id = parts[0] if parts else 'unknown'
-    layout_code = os.path.splitext(os.path.basename(key))[0]
+    layout_code = layout_code_from_key(key)
     style_type = parts[1] if len(parts) > 2 else ''
     return tenant_id, layout_code, style_type
 
 
+def parse_shard(value: str):
+    """Parse `i/n` into (i, n) with 0 <= i < n."""
+    try:
+        index, count = (int(v) for v in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("--shard must look like i/n, e.g. 0/4")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError("--shard i/n requires 0 <= i < n")
+    return index, count
+
+
+def in_shard(key: str, shard) -> bool:
+    index, count = shard
+    # crc32 is stable across processes and machines (unlike hash())
+    return zlib.crc32(key.encode('utf-8')) % count == index
+
+
+class PipelineStats:
+    """Thread-safe counters for the live progress line."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.counts = {'listed': 0, 'skipped': 0, 'downloaded': 0, 'decoded': 0,
+                       'embedded': 0, 'inserted': 0, 'failed': 0, 'bytes': 0}
+
+    def add(self, name: str, value: int = 1):
+        with self._lock:
+            self.counts[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts), time.monotonic() - self.started
+
+
+def report_progress(stats: PipelineStats, queues, stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        c, elapsed = stats.snapshot()
+        rate = c['inserted'] / elapsed if elapsed else 0.0
+        mb_s = c['bytes'] / elapsed / 1e6 if elapsed else 0.0
+        depths = '/'.join(str(q.qsize()) for q in queues)
+        sys.stderr.write(
+            f"\r[{elapsed:7.1f}s] listed={c['listed']} skipped={c['skipped']} "
+            f"downloaded={c['downloaded']} embedded={c['embedded']} inserted={c['inserted']} "
+            f"failed={c['failed']} | {rate:.1f} img/s, {mb_s:.1f} MB/s | queues={depths}   "
+        )
+        sys.stderr.flush()
+
+
+def start_stage(name, count, func, in_q, out_q, downstream_count):
+    """Start `count` worker threads applying `func` to items from `in_q`.
+
+    `func` returns the item to put on `out_q`, or None to drop it. When
+    every worker has seen its end sentinel, one sentinel per downstream worker
+    is put on `out_q`. Returns the thread that closes the stage.
+    """
+    def worker():
+        while True:
+            item = in_q.get()
+            if item is _DONE:
+                return
+            result = func(item)
+            if result is not None:
+                out_q.put(result)
+
+    workers = [threading.Thread(target=worker, name=f'{name}-{i}', daemon=True) for i in range(count)]
+    for t in workers:
+        t.start()
+
+    def closer():
+        for t in workers:
+            t.join()
+        if out_q is not None:
+            for _ in range(downstream_count):
+                out_q.put(_DONE)
+
+    closing = threading.Thread(target=closer, name=f'{name}-closer', daemon=True)
+    closing.start()
+    return closing
+
+
+def list_keys(args, stats: PipelineStats):
+    """Image keys to embed for a full backfill, honouring --shard and --resume."""
+    storage = get_storage()
+    existing_urls = set()
+    if args.resume:
+        existing_urls = pg_connect.fetch_image_urls()
+        print(f"Resume: {len(existing_urls)} images already embedded will be skipped")
+
+    for obj in storage.list(args.prefix):
+        key = obj['key']
+        if not is_image_key(key) or (args.shard and not in_shard(key, args.shard)):
+            continue
+        stats.add('listed')
+        if storage.url_for(key) in existing_urls:
+            stats.add('skipped')
+            continue
+        yield key
+
+
+def run_pipeline(args, keys=None, replace_ids=None, stats=None):
+    """Embed and insert images through the staged pipeline.
+
+    Args:
+        keys: Iterable of object keys to embed; defaults to `list_keys(args)`
+        replace_ids: Optional {key: [row ids]} of rows each new vector replaces
+    """
+    storage = get_storage()
+    stats = stats or PipelineStats()
+    replace_ids = replace_ids or {}
+    if keys is None:
+        keys = list_keys(args, stats)
+
+    key_q = queue.Queue(maxsize=args.workers * 4)
+    raw_q = queue.Queue(maxsize=args.workers * 2)
+    pixel_q = queue.Queue(maxsize=args.batch_size * 4)
+    insert_q = queue.Queue(maxsize=4)
+
+    def download(key):
+        try:
+            data, etag = storage.fetch(key)
+        except Exception as e:
+            stats.add('failed')
+            print(f"\nError downloading {key}: {e}", file=sys.stderr)
+            return None
+        stats.add('downloaded')
+        stats.add('bytes', len(data))
+        return key, etag, data
+
+    def decode(item):
+        key, etag, data = item
+        try:
+            image = load_rgb_image(data)
+            phash = dhash(image)
+            pixels = preprocess_clip_image(image)
+        except Exception as e:
+            stats.add('failed')
+            print(f"\nError decoding {key}: {e}", file=sys.stderr)
+            return None
+        stats.add('decoded')
+        return key, (etag, phash), pixels
+
+    def embedder():
+        def flush(batch):
+            try:
+                vectors = embed_clip_pixels([p for _, _, p in batch])
+            except Exception as e:
+                stats.add('failed', len(batch))
+                print(f"\nError embedding batch starting at {batch[0][0]}: {e}", file=sys.stderr)
+                return
+            stats.add('embedded', len(batch))
+            insert_q.put([(key, meta, vec) for (key, meta, _), vec in zip(batch, vectors)])
+
+        batch = []
+        while True:
+            item = pixel_q.get()
+            if item is _DONE:
+                break
+            batch.append(item)
+            if len(batch) >= args.batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+        insert_q.put(_DONE)
+
+    def writer():
+        pending = []
+
+        def flush():
+            rows, delete_ids = [], []
+            for key, (etag, phash), vec in pending:
+                tenant_id, layout_code, _ = parse_key(key)
+                # style_number is the layout code, not the style_type path segment
+                rows.append({
+                    'tenant_id': tenant_id,
+                    'style_number': layout_code,
+                    'image_url': storage.url_for(key),
+                    'feature_vector': vec,
+                    'etag': etag,
+                    'phash': phash,
+                })
+                delete_ids.extend(replace_ids.get(key, ()))
+            try:
+                # replaced rows are deleted in the same transaction as the new ones are inserted
+                pg_connect.replace_vectors(rows, delete_ids)
+                stats.add('inserted', len(rows))
+            except Exception as e:
+                stats.add('failed', len(rows))
+                print(f"\nError inserting {len(rows)} rows: {e}", file=sys.stderr)
+            pending.clear()
+
+        while True:
+            item = insert_q.get()
+            if item is _DONE:
+                break
+            pending.extend(item)
+            if len(pending) >= args.insert_chunk:
+                flush()
+        if pending:
+            flush()
+
+    stop = threading.Event()
+    reporter = threading.Thread(
+        target=report_progress, args=(stats, (key_q, raw_q, pixel_q, insert_q), stop, args.progress_interval),
+        daemon=True,
+    )
+    reporter.start()
+
+    start_stage('download', args.workers, download, key_q, raw_q, downstream_count=args.decoders)
+    start_stage('decode', args.decoders, decode, raw_q, pixel_q, downstream_count=1)
+    embed_thread = threading.Thread(target=embedder, name='embed', daemon=True)
+    write_thread = threading.Thread(target=writer, name='write', daemon=True)
+    embed_thread.start()
+    write_thread.start()
+
+    # List in the main thread; bounded queues apply back-pressure to the listing
+    queued = 0
+    try:
+        for key in keys:
+            key_q.put(key)
+            queued += 1
+            if args.limit and queued >= args.limit:
+                print('\nReached limit', args.limit)
+                break
+    finally:
+        for _ in range(args.workers):
+            key_q.put(_DONE)
+
+    write_thread.join()
+    stop.set()
+
+    c, elapsed = stats.snapshot()
+    print(
+        f"\nDone in {elapsed:.1f}s. Listed {c['listed']}, skipped {c['skipped']}, "
+        f"inserted {c['inserted']}, failed {c['failed']} "
+        f"({c['inserted'] / elapsed if elapsed else 0:.1f} img/s)"
+    )
+
+
+def dry_run(args):
+    storage = get_storage()
+    existing_urls = pg_connect.fetch_image_urls() if args.resume else set()
+    processed = 0
+    for obj in storage.list(args.prefix):
+        key = obj['key']
+        if not is_image_key(key) or (args.shard and not in_shard(key, args.shard)):
+            continue
+        if storage.url_for(key) in existing_urls:
+            continue
+        tenant_id, layout_code, style_type = parse_key(key)
+        print('DRY:', key, tenant_id, layout_code, style_type)
+        processed += 1
+        if args.limit and processed >= args.limit:
+            print('Reached limit', args.limit)
+            break
+    print('Done. Would process', processed)
+
+
+def run_sync(args):
+    """Mirror storage adds, changes and deletes under --prefix into fvector_pg."""
+    diff = compute_sync_diff(prefix=args.prefix)
+    print('Sync diff:', format_sync_summary(diff['summary']))
+    try:
+        check_delete_limit(diff, force=args.force)
+    except SyncAborted as e:
+        print(f"Aborted: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.dry_run:
+        for info in diff['to_embed']:
+            print('DRY:', 'replace' if info.get('replace_ids') else 'add', info['key'])
+        print('DRY: delete', len(diff['to_delete']), 'rows')
+        return
+
+    pg_connect.set_vector_etags(diff['to_adopt'])
+    deleted = pg_connect.delete_vectors_by_ids(diff['to_delete'])
+    print(f"Deleted {len(deleted)} stale rows, recorded ETags for {len(diff['to_adopt'])} rows")
+
+    if diff['to_embed']:
+        stats = PipelineStats()
+        stats.add('listed', len(diff['to_embed']))
+        run_pipeline(
+            args,
+            keys=(info['key'] for info in diff['to_embed']),
+            replace_ids={info['key']: info['replace_ids'] for info in diff['to_embed'] if info.get('replace_ids')},
+            stats=stats,
+        )
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--prefix', default='', help='S3 prefix to scan')
     p.add_argument('--limit', type=int, default=0, help='Max objects to process (0 = all)')
     p.add_argument('--dry-run', action='store_true')
+    p.add_argument('--workers', type=int, default=8, help='Concurrent downloader threads')
+    p.add_argument('--decoders', type=int, default=2, help='Decode/preprocess threads')
+    p.add_argument('--batch-size', type=int, default=16, help='Images per CLIP forward pass')
+    p.add_argument('--insert-chunk', type=int, default=256, help='Rows per bulk INSERT')
+    p.add_argument('--shard', type=parse_shard, default=None,
+                   help='Process only keys where crc32(key) %% n == i, given as i/n')
+    p.add_argument('--resume', action='store_true',
+                   help='Skip objects whose URL is already stored in fvector_pg')
+    p.add_argument('--progress-interval', type=float, default=2.0, help='Seconds between progress lines')
+    p.add_argument('--sync', action='store_true',
+                   help='Embed only new/changed objects (by ETag) and delete vectors whose object is gone')
+    p.add_argument('--force', action='store_true',
+                   help='With --sync, apply deletes even above SYNC_MAX_DELETE_FRACTION')
     args = p.parse_args()
 
-    s3 = boto3.client(
-        's3',
-        aws_access_key_id=settings.AWS_ACCESS_KEY,
-        aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-        region_name=settings.AWS_REGION,
-    )
-
-    bucket = settings.AWS_BUCKET_NAME
+    if args.sync and (args.shard or args.resume):
+        p.error('--sync cannot be combined with --shard or --resume')
 
     # Postgres (pgvector)
     pg_connect.init_table()
 
-    paginator = s3.get_paginator('list_objects_v2')
-    page_iterator = paginator.paginate(Bucket=bucket, Prefix=args.prefix)
-
-    processed = 0
-    for page in page_iterator:
-        for obj in page.get('Contents', []):
-            key = obj['Key']
-            if not is_image_key(key):
-                continue
-
-            tenant_id, layout_code, style_type = parse_key(key)
-            image_url = f"https://{bucket}.s3.amazonaws.com/{key}"
-
-            if args.dry_run:
-                print('DRY:', key, tenant_id, layout_code, style_type)
-            else:
-                try:
-                    resp = s3.get_object(Bucket=bucket, Key=key)
-                    data = resp['Body'].read()
-                    emb = compute_clip_embedding(data, image_size=224)
-
-                    # upsert into Postgres pgvector table
-                    pg_connect.upsert_vector(tenant_id, style_type or '', image_url, emb)
-                    print('Upserted:', tenant_id, layout_code)
-                except Exception as e:
-                    print('Error processing', key, e)
-
-            processed += 1
-            if args.limit and processed >= args.limit:
-                print('Reached limit', args.limit)
-                return
-
-    print('Done. Processed', processed)
+    if args.sync:
+        run_sync(args)
+    elif args.dry_run:
+        dry_run(args)
+    else:
+        run_pipeline(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""Convert stored embeddings from float32 `vector` to `halfvec` (pgvector >= 0.7), online.
+
+halfvec halves the bytes per vector (768 dims: ~3 KB -> ~1.5 KB) and gets an HNSW
+index. The conversion runs next to the live service: a trigger keeps the new column
+current while existing rows are converted in batches; see app/database/halfvec_migration.py.
+
+Examples:
+    python migrate_halfvec.py                        # prepare, backfill, build index, compare
+    python migrate_halfvec.py compare --queries 200 --top-k 10 --ef-search 100
+    python migrate_halfvec.py status
+    python migrate_halfvec.py swap                   # switch searches to halfvec; restart services after
+    python migrate_halfvec.py rollback               # before swap: drop the halfvec column again
+"""
+import argparse
+import json
+import sys
+import time
+
+from config import settings
+from app.database import halfvec_migration as migration
+
+
+def run_migrate(args):
+    dim = int(settings.PGVECTOR_DIM)
+    print(f"Adding halfvec({dim}) column and sync trigger")
+    migration.prepare(dim)
+
+    started = time.time()
+    state = {'last': started}
+
+    def progress(converted, last_id):
+        now = time.time()
+        if now - state['last'] >= 2:
+            state['last'] = now
+            print(f"  {converted} rows converted (up to id {last_id}, {converted / (now - started):.0f}/s)", flush=True)
+
+    converted = migration.backfill(dim, batch_size=args.batch_size, on_batch=progress)
+    print(f"Converted {converted} rows in {time.time() - started:.1f}s")
+
+    started = time.time()
+    print("Building HNSW index (CONCURRENTLY)")
+    migration.build_index(m=args.m, ef_construction=args.ef_construction)
+    print(f"Index built in {time.time() - started:.1f}s")
+    run_compare(args)
+    print("Run `python migrate_halfvec.py swap` to switch over, or `rollback` to undo.")
+
+
+def run_compare(args):
+    report = migration.compare(queries=args.queries, top_k=args.top_k, ef_search=args.ef_search)
+    print(f"{report['queries']} queries, top_k={report['top_k']}, ef_search={report['ef_search']}")
+    for mode, stats in report['modes'].items():
+        recall = f"{stats['recall']:.4f}" if stats['recall'] is not None else "n/a"
+        print(f"  {mode:<14} recall@{report['top_k']} {recall}  p50 {stats['p50_ms']} ms  p95 {stats['p95_ms']} ms")
+    sizes = report['bytes_per_vector']
+    print(f"  bytes/vector: float32 {sizes['float32']}, halfvec {sizes['halfvec']}; "
+          f"HNSW index {(report['hnsw_index_bytes'] or 0) / 2**20:.1f} MB")
+    if args.json:
+        print(json.dumps(report, indent=2))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument('command', nargs='?', default='migrate',
+                   choices=['migrate', 'compare', 'status', 'swap', 'rollback'])
+    p.add_argument('--batch-size', type=int, default=5000, help='Ids per backfill transaction')
+    p.add_argument('--m', type=int, default=16, help='HNSW m (links per node)')
+    p.add_argument('--ef-construction', type=int, default=64, help='HNSW ef_construction')
+    p.add_argument('--queries', type=int, default=100, help='Stored vectors used as queries for compare')
+    p.add_argument('--top-k', type=int, default=10)
+    p.add_argument('--ef-search', type=int, default=int(settings.HNSW_EF_SEARCH), help='hnsw.ef_search for compare')
+    p.add_argument('--json', action='store_true', help='Also print the compare report as JSON')
+    args = p.parse_args()
+
+    try:
+        if args.command == 'migrate':
+            run_migrate(args)
+        elif args.command == 'compare':
+            run_compare(args)
+        elif args.command == 'status':
+            print(json.dumps(migration.status(), indent=2))
+        elif args.command == 'swap':
+            migration.swap()
+            print("feature_vector is now halfvec; restart the services so searches use the HNSW index.")
+            print("Reclaim the float32 data with VACUUM FULL fvector_pg (locks the table) or pg_repack.")
+        else:
+            migration.rollback()
+            print("Removed the halfvec column, trigger and index.")
+    except migration.MigrationError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
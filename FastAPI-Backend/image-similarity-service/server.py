@@ -2,6 +2,9 @@ import uvicorn
 from app import create_app
 from config import settings
 from app.database import pg_connect
+from app.utils.jobs import get_job_runner
+from app.utils.pq_index import get_pq_index
+from app.utils.shards import get_shard_coordinator
 
 app = create_app()
 
@@ -12,5 +15,38 @@ async def startup_db():
     pg_connect.init_table()
 
 
+@app.on_event("startup")
+async def startup_pq_index():
+    """Load the in-process PQ index (retrieval=pq) if PQ_INDEX_PATH points at one"""
+    get_pq_index()
+
+
+@app.on_event("startup")
+async def startup_shards():
+    """Start the shard processes (retrieval=sharded) if SHARD_COUNT > 0; they load in the background"""
+    coordinator = get_shard_coordinator()
+    if coordinator is not None:
+        coordinator.start(wait=False)
+
+
+@app.on_event("shutdown")
+async def shutdown_shards():
+    coordinator = get_shard_coordinator()
+    if coordinator is not None:
+        coordinator.stop()
+
+
+@app.on_event("startup")
+async def startup_jobs():
+    """Start the background job runner (ingestion etc.) for this process"""
+    if settings.JOB_WORKER_ENABLED:
+        get_job_runner().start()
+
+
+@app.on_event("shutdown")
+async def shutdown_jobs():
+    get_job_runner().stop()
+
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=5000)
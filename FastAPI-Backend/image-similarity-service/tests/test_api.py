@@ -162,8 +162,8 @@ def test_save_image(server_url, image_path, tenant_id, style_type="test"):
         return False
 
 
-def test_create_embeddings_from_s3(server_url, tenant_id, prefix="", limit=5):
-    """Test creating embeddings from S3 images"""
+def test_create_embeddings_from_s3(server_url, tenant_id, prefix="", limit=5, poll_timeout=300):
+    """Test creating embeddings from S3 images (background job + status polling)"""
     print_header("Testing Create Embeddings from S3")
     
     try:
@@ -173,28 +173,44 @@ def test_create_embeddings_from_s3(server_url, tenant_id, prefix="", limit=5):
             "limit": limit
         }
         
-        print_info(f"Creating embeddings for tenant_id: {tenant_id}")
+        print_info(f"Submitting embedding job for tenant_id: {tenant_id}")
         start_time = time.time()
         
         resp = requests.post(
             f"{server_url}/img/create-embeddings-from-s3",
             data=data,
-            timeout=300  # 5 min timeout for batch processing
+            timeout=30
         )
         
-        elapsed = time.time() - start_time
-        
-        if resp.status_code == 200:
-            result = resp.json()
-            print_success(f"Embeddings created in {elapsed:.2f}s")
-            print(f"   Status: {result.get('status')}")
-            print(f"   Processed: {result.get('processed_count')}")
-            print(f"   Failed: {result.get('failed_count')}")
-            return True
-        else:
-            print_error(f"Failed to create embeddings: {resp.status_code}")
+        if resp.status_code != 200:
+            print_error(f"Failed to submit embedding job: {resp.status_code}")
             print(f"   Response: {resp.text}")
             return False
+
+        job_id = resp.json().get('job_id')
+        print_success(f"Job {job_id} queued")
+
+        # Poll the job until it finishes
+        while time.time() - start_time < poll_timeout:
+            job = requests.get(f"{server_url}/img/jobs/{job_id}", timeout=10).json()
+            if job.get('status') in ('completed', 'failed', 'cancelled'):
+                break
+            time.sleep(2)
+        else:
+            print_error(f"Job {job_id} did not finish within {poll_timeout}s")
+            return False
+
+        elapsed = time.time() - start_time
+        if job.get('status') != 'completed':
+            print_error(f"Job {job_id} ended with status {job.get('status')}: {job.get('error')}")
+            return False
+
+        print_success(f"Embeddings created in {elapsed:.2f}s")
+        print(f"   Total: {job.get('total')}")
+        print(f"   Processed: {job.get('processed')}")
+        print(f"   Failed: {job.get('failed')}")
+        print(f"   Throughput: {job.get('throughput_images_per_s')} images/s")
+        return True
             
     except Exception as e:
         print_error(f"Error creating embeddings: {e}")
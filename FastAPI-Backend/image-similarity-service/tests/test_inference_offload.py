@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Search requests must wait for an inference slot off the event loop.
+
+Unlike test_api.py this does not need a running server, AWS, Postgres or CLIP:
+the app is served in process through httpx, the CLIP call is replaced by one
+that only takes a slot from a fresh InferenceScheduler, and the search itself
+returns no rows.
+
+While a batch job holds the only slot, a search waits for it; /status must
+still answer at once, and the search must finish once the slot is released.
+
+Usage:
+  python tests/test_inference_offload.py
+  pytest tests/test_inference_offload.py
+"""
+import io
+import sys
+import time
+import asyncio
+import threading
+from pathlib import Path
+
+# Add project root to path
+proj_root = Path(__file__).resolve().parents[1]
+if str(proj_root) not in sys.path:
+    sys.path.insert(0, str(proj_root))
+
+import httpx
+import numpy as np
+from PIL import Image
+
+from app import create_app
+from app.routes import search as search_routes
+from app.utils import priority
+
+
+def make_png() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (120, 80, 40)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def run_held_slot_scenario():
+    scheduler = priority.InferenceScheduler(
+        concurrency=1, max_queue={'interactive': 8, 'batch': 8}, max_batch_wait=60.0,
+    )
+    originals = (priority.inference_scheduler, search_routes.get_feature_vector_pretrained,
+                 search_routes.search_vectors)
+
+    def fake_embedding(image, i_type, tenant_id=None):
+        with priority.inference_slot(1):
+            return np.zeros(768, dtype=np.float32)
+
+    priority.inference_scheduler = scheduler
+    search_routes.get_feature_vector_pretrained = fake_embedding
+    search_routes.search_vectors = lambda **kwargs: []
+
+    # a job's batch holds the only slot; if the loop were blocked this timer is
+    # the only thing that would free it, and /status would come back late
+    scheduler.acquire('batch')
+    released = threading.Event()
+
+    def release_batch():
+        if not released.is_set():
+            released.set()
+            scheduler.release('batch')
+
+    timer = threading.Timer(3.0, release_batch)
+    timer.start()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=create_app())
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            search = asyncio.create_task(client.post(
+                "/img/search-image", files={"image": ("query.png", make_png(), "image/png")},
+            ))
+            for _ in range(100):
+                if scheduler.stats()['lanes']['interactive']['waiting']:
+                    break
+                await asyncio.sleep(0.01)
+
+            started = time.monotonic()
+            status = await client.get("/status")
+            status_seconds = time.monotonic() - started
+            search_pending = not search.done()
+
+            release_batch()
+            response = await asyncio.wait_for(search, timeout=5)
+            return status, status_seconds, search_pending, response
+
+    try:
+        return asyncio.run(scenario())
+    finally:
+        timer.cancel()
+        release_batch()
+        (priority.inference_scheduler, search_routes.get_feature_vector_pretrained,
+         search_routes.search_vectors) = originals
+
+
+def test_held_batch_slot_does_not_stall_status():
+    status, status_seconds, search_pending, response = run_held_slot_scenario()
+    assert status.status_code == 200
+    assert status_seconds < 1.0, f"/status took {status_seconds:.2f}s while a search waited for a slot"
+    assert search_pending, "the search finished before the batch slot was released"
+    assert response.status_code == 200, response.text
+    assert response.json() == []
+
+
+if __name__ == "__main__":
+    test_held_batch_slot_does_not_stall_status()
+    print("ok")
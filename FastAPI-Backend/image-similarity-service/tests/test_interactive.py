@@ -165,11 +165,13 @@ def create_embeddings_from_s3(server_url):
     try:
         data = {"tenant_id": tenant_id, "prefix": prefix, "limit": int(limit)}
         
-        print("Creating embeddings (this may take a while)...")
-        resp = requests.post(f"{server_url}/img/create-embeddings-from-s3", data=data, timeout=300)
+        print("Queueing embedding job...")
+        resp = requests.post(f"{server_url}/img/create-embeddings-from-s3", data=data, timeout=30)
         
         print(f"Status: {resp.status_code}")
         print(f"Response: {json.dumps(resp.json(), indent=2)}")
+        if resp.status_code == 200:
+            print(f"Check progress with: GET {server_url}{resp.json().get('status_url')}")
     except Exception as e:
         print(f"Error: {e}")
 
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+k-means centroid updates of the IVF-PQ index (app/utils/pq_index.py).
+
+Unlike test_api.py this does not need a running server, AWS or Postgres.
+
+Cluster sums are checked against a plain loop, including assignments whose
+last clusters are empty (those used to lose the final row of the last
+non-empty cluster), and a full `_kmeans` run must end with every centroid at
+the mean of the rows assigned to it.
+
+Usage:
+  python tests/test_pq_kmeans.py
+  pytest tests/test_pq_kmeans.py
+"""
+import sys
+from pathlib import Path
+
+# Add project root to path
+proj_root = Path(__file__).resolve().parents[1]
+if str(proj_root) not in sys.path:
+    sys.path.insert(0, str(proj_root))
+
+import numpy as np
+
+from app.utils.pq_index import _cluster_sums, _kmeans, _nearest
+
+
+def naive_sums(x, assign, k):
+    sums = np.zeros((k, x.shape[1]))
+    counts = np.zeros(k, dtype=np.int64)
+    for row, cluster in zip(x, assign):
+        sums[cluster] += row
+        counts[cluster] += 1
+    return sums, counts
+
+
+def test_empty_trailing_clusters():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(50, 8)).astype(np.float32)
+    assign = rng.integers(0, 5, size=len(x))
+    assign[-1] = 4  # the final row belongs to the last non-empty cluster
+    sums, counts = _cluster_sums(x, assign, k=8)  # clusters 5-7 are empty
+    expected_sums, expected_counts = naive_sums(x, assign, 8)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_allclose(sums, expected_sums, rtol=1e-6, atol=1e-5)
+
+
+def test_empty_middle_and_first_clusters():
+    rng = np.random.default_rng(2)
+    x = rng.normal(size=(30, 4)).astype(np.float32)
+    assign = rng.choice([1, 3, 6], size=len(x))
+    sums, counts = _cluster_sums(x, assign, k=7)
+    expected_sums, expected_counts = naive_sums(x, assign, 7)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_allclose(sums, expected_sums, rtol=1e-6, atol=1e-5)
+
+
+def test_kmeans_centroids_are_cluster_means():
+    rng = np.random.default_rng(3)
+    x = np.concatenate([rng.normal(loc, 0.1, size=(40, 6)) for loc in (-3, 0, 3)]).astype(np.float32)
+    centroids = _kmeans(x, k=3, iters=25)
+    assign = _nearest(x, centroids)
+    sums, counts = naive_sums(x, assign, 3)
+    assert (counts > 0).all()
+    np.testing.assert_allclose(centroids, sums / counts[:, None], rtol=1e-5, atol=1e-5)
+
+
+if __name__ == "__main__":
+    test_empty_trailing_clusters()
+    test_empty_middle_and_first_clusters()
+    test_kmeans_centroids_are_cluster_means()
+    print("ok")
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Storage-to-DB diff of the sync job (app/utils/sync.py, run_sync_job in app/utils/jobs.py).
+
+Unlike test_api.py this does not need a running server, AWS or Postgres: the
+storage listing and the DB image index are replaced by in-memory fakes.
+
+One listing covers every bucket of the diff (added, changed, unchanged,
+adopted, duplicates, vanished), the delete guard is checked with and without
+force, and a sync job must stop before deleting anything when the guard trips
+and hand the deleted ids to the in-memory indexes when it does not.
+
+Usage:
+  python tests/test_sync_diff.py
+  pytest tests/test_sync_diff.py
+"""
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add project root to path
+proj_root = Path(__file__).resolve().parents[1]
+if str(proj_root) not in sys.path:
+    sys.path.insert(0, str(proj_root))
+
+from config import settings
+from app.database import pg_connect
+from app.utils import jobs, sync
+
+URL = "s3://bucket/images/"
+
+
+class FakeStorage:
+    def url_for(self, key):
+        return URL + key
+
+
+class FakeIndex:
+    def __init__(self):
+        self.discarded = []
+
+    def discard_many(self, ids):
+        self.discarded.extend(ids)
+
+
+class FakeContext:
+    def __init__(self, params):
+        self.job_id = 1
+        self.params = params
+        self.consumed = 0
+        self.total = None
+
+    def set_total(self, total):
+        self.total = total
+
+    def commit_chunk(self, *args, **kwargs):
+        raise AssertionError("nothing to embed")
+
+
+@contextmanager
+def patched(obj, **attrs):
+    originals = {name: getattr(obj, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for name, value in originals.items():
+            setattr(obj, name, value)
+
+
+def image(name, etag):
+    return {'key': f"images/{name}", 'url': URL + name, 'etag': etag}
+
+
+# (id, image_url, etag), newest row of a URL first as fetch_image_index returns them
+ROWS = [
+    (10, URL + "same.jpg", "e-same"),
+    (20, URL + "edited.jpg", "e-old"),
+    (30, URL + "legacy.jpg", None),
+    (42, URL + "twice.jpg", "e-twice"),
+    (41, URL + "twice.jpg", "e-twice"),
+    (40, URL + "twice.jpg", "e-twice"),
+    (50, URL + "gone.jpg", "e-gone"),
+]
+
+LISTING = [
+    image("same.jpg", "e-same"),
+    image("edited.jpg", "e-new"),
+    image("legacy.jpg", "e-legacy"),
+    image("twice.jpg", "e-twice"),
+    image("new.jpg", "e-added"),
+]
+
+
+@contextmanager
+def fake_sources(rows=ROWS, listing=LISTING):
+    with patched(sync, get_storage=FakeStorage,
+                 iter_images_from_s3=lambda prefix="", tenant_id=None: iter(listing)), \
+         patched(pg_connect, fetch_image_index=lambda url_prefix: iter(rows)):
+        yield
+
+
+def test_diff_buckets():
+    with fake_sources():
+        diff = sync.compute_sync_diff()
+
+    assert [info['url'] for info in diff['to_embed']] == [URL + "edited.jpg", URL + "new.jpg"]
+    assert diff['to_embed'][0]['replace_ids'] == [20]
+    assert 'replace_ids' not in diff['to_embed'][1]
+    assert sorted(diff['to_delete']) == [40, 41, 50]
+    assert diff['to_adopt'] == [(30, "e-legacy")]
+    assert diff['summary'] == {'listed': 5, 'stored': 5, 'added': 1, 'changed': 1, 'unchanged': 2,
+                               'adopted': 1, 'deleted': 1, 'duplicates': 2}
+
+
+def test_delete_limit():
+    with fake_sources(listing=[]):
+        diff = sync.compute_sync_diff()
+    assert diff['summary']['deleted'] == len(ROWS)
+
+    with patched(settings, SYNC_MAX_DELETE_FRACTION="0.5"):
+        try:
+            sync.check_delete_limit(diff)
+        except sync.SyncAborted:
+            pass
+        else:
+            raise AssertionError("deleting every stored image should abort")
+        sync.check_delete_limit(diff, force=True)
+
+        # one vanished image out of five stays under the limit
+        with fake_sources():
+            sync.check_delete_limit(sync.compute_sync_diff())
+        # nothing stored in scope yet
+        with fake_sources(rows=[]):
+            sync.check_delete_limit(sync.compute_sync_diff())
+
+
+def run_sync(listing, force, deleted, indexes):
+    with fake_sources(listing=listing), \
+         patched(pg_connect, set_job_result=lambda job_id, summary: None,
+                 set_vector_etags=lambda pairs: None,
+                 delete_vectors_by_ids=lambda ids: deleted.extend(ids) or list(ids)), \
+         patched(jobs, get_phash_index=lambda: indexes['phash'],
+                 discard_vectors=indexes['vectors'].discard_many,
+                 discard_rows=indexes['rows'].discard_many), \
+         patched(settings, SYNC_MAX_DELETE_FRACTION="0.5"):
+        jobs.run_sync_job(FakeContext({'force': force}))
+
+
+def make_indexes():
+    return {'phash': FakeIndex(), 'vectors': FakeIndex(), 'rows': FakeIndex()}
+
+
+def test_sync_job_aborts_before_deleting():
+    deleted = []
+    try:
+        run_sync([], False, deleted, make_indexes())
+    except sync.SyncAborted:
+        pass
+    else:
+        raise AssertionError("sync of an empty listing should abort")
+    assert deleted == []
+
+
+def test_forced_sync_job_discards_deleted_ids():
+    deleted, indexes = [], make_indexes()
+    run_sync([image("same.jpg", "e-same")], True, deleted, indexes)
+    assert sorted(deleted) == [20, 30, 40, 41, 42, 50]
+    for index in indexes.values():
+        assert sorted(index.discarded) == sorted(deleted)
+
+
+if __name__ == "__main__":
+    test_diff_buckets()
+    test_delete_limit()
+    test_sync_job_aborts_before_deleting()
+    test_forced_sync_job_discards_deleted_ids()
+    print("ok")
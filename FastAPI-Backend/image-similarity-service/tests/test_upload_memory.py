@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Peak memory checks for upload handling (app/utils/uploads.py).
+
+Unlike test_api.py this does not need a running server, AWS or Postgres.
+
+1. Spooling a large upload keeps the Python heap bounded (tracemalloc),
+   where `await image.read()` holds the whole file.
+2. Decoding a large JPEG with `decode_image` has a much lower peak RSS than
+   a full-resolution decode (each case runs in a fresh subprocess).
+3. Oversized files, huge images and non-images are rejected with 413/415.
+
+Usage:
+  python tests/test_upload_memory.py
+  pytest tests/test_upload_memory.py
+"""
+import io
+import os
+import sys
+import asyncio
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+
+# Add project root to path
+proj_root = Path(__file__).resolve().parents[1]
+if str(proj_root) not in sys.path:
+    sys.path.insert(0, str(proj_root))
+
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+from PIL import Image
+
+from app.utils.uploads import spool_upload, sniff_image, decode_image, read_image_upload, MB
+
+
+def make_upload(path, filename="image.jpg"):
+    return UploadFile(file=open(path, "rb"), filename=filename)
+
+
+def make_jpeg(path, size=(8000, 6000)):
+    Image.new("RGB", size, (120, 80, 40)).save(path, "JPEG", quality=90)
+
+
+def peak_python_heap(coro_factory):
+    tracemalloc.start()
+    try:
+        result = asyncio.run(coro_factory())
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def test_spool_upload_keeps_heap_bounded():
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        f.write(os.urandom(20 * MB))
+        path = f.name
+    try:
+        async def read_all():
+            upload = make_upload(path)
+            try:
+                return len(await upload.read())
+            finally:
+                await upload.close()
+
+        async def spool():
+            upload = make_upload(path)
+            try:
+                spooled = await spool_upload(upload, max_bytes=64 * MB)
+                spooled.close()
+            finally:
+                await upload.close()
+
+        _, read_peak = peak_python_heap(read_all)
+        _, spool_peak = peak_python_heap(spool)
+        print(f"read(): {read_peak / MB:.1f} MB peak, spool_upload: {spool_peak / MB:.1f} MB peak")
+        assert read_peak > 19 * MB
+        assert spool_peak < 5 * MB
+    finally:
+        os.remove(path)
+
+
+def _child_peak_rss(mode, path):
+    """Run in a subprocess: decode `path` and print peak RSS in MB."""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(path, "rb") as f:
+        if mode == "full":
+            Image.open(f).convert("RGB")
+        else:
+            decode_image(f)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux
+    print((peak - baseline) / 1024)
+
+
+def measure_decode_rss(mode, path):
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", mode, path],
+        check=True, capture_output=True, text=True, cwd=proj_root,
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def test_decode_image_peak_rss():
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        path = f.name
+    try:
+        make_jpeg(path)
+        full = measure_decode_rss("full", path)
+        bounded = measure_decode_rss("bounded", path)
+        print(f"full decode: +{full:.0f} MB RSS, decode_image: +{bounded:.0f} MB RSS")
+        # 8000x6000 RGB is ~144 MB; the draft decode should need a fraction of that
+        assert full > 100
+        assert bounded < full / 4
+    finally:
+        os.remove(path)
+
+
+def expect_status(status, func, *args):
+    try:
+        func(*args)
+    except HTTPException as e:
+        assert e.status_code == status, (e.status_code, e.detail)
+        return e.detail
+    raise AssertionError(f"expected HTTP {status}")
+
+
+def test_rejects_bad_uploads():
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        f.write(os.urandom(2 * MB))
+        path = f.name
+    try:
+        async def too_big():
+            upload = make_upload(path)
+            try:
+                await spool_upload(upload, max_bytes=1 * MB)
+            finally:
+                await upload.close()
+
+        expect_status(413, lambda: asyncio.run(too_big()))
+        with open(path, "rb") as f:
+            expect_status(415, sniff_image, f)
+    finally:
+        os.remove(path)
+
+    # 10000x10000 bilevel PNG: tiny file, 100M pixels once decoded
+    bomb = io.BytesIO()
+    Image.new("1", (10000, 10000)).save(bomb, "PNG")
+    print(f"pixel bomb: {len(bomb.getvalue()) / 1024:.0f} KB file")
+    expect_status(413, sniff_image, bomb)
+
+    ok = io.BytesIO()
+    Image.new("RGB", (3000, 2000)).save(ok, "JPEG")
+    assert sniff_image(ok) == {"format": "JPEG", "width": 3000, "height": 2000}
+    assert max(decode_image(ok).size) <= 1024
+
+
+def test_read_image_upload():
+    with tempfile.NamedTemporaryFile(suffix=".jpg", delete=False) as f:
+        Image.new("RGB", (640, 480)).save(f, "JPEG")
+        path = f.name
+    try:
+        async def read():
+            upload = make_upload(path)
+            try:
+                return await read_image_upload(upload)
+            finally:
+                await upload.close()
+
+        spooled, image, info = asyncio.run(read())
+        with spooled:
+            assert spooled.read() == Path(path).read_bytes()
+        assert image.size == (640, 480) and image.mode == "RGB"
+        assert info["format"] == "JPEG"
+    finally:
+        os.remove(path)
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        _child_peak_rss(sys.argv[2], sys.argv[3])
+        return
+
+    for test in (test_spool_upload_keeps_heap_bounded, test_decode_image_peak_rss,
+                 test_rejects_bad_uploads, test_read_image_upload):
+        print(f"== {test.__name__}")
+        test()
+    print("All upload memory tests passed")
+
+
+if __name__ == "__main__":
+    main()
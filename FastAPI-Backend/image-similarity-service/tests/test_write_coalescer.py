@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Group commit of single-image inserts (app/utils/write_coalescer.py).
+
+Unlike test_api.py this does not need a running server, AWS or Postgres:
+`pg_connect.bulk_upsert_vectors` is replaced by a fake that records each
+statement and hands out ids.
+
+Rows submitted together must go out as one INSERT (split at max_rows) and get
+their own ids back. When a batch fails it is retried row by row, so a bad row
+only fails its own future; an error outside the insert fails every future of
+the batch instead of leaving callers waiting.
+
+Usage:
+  python tests/test_write_coalescer.py
+  pytest tests/test_write_coalescer.py
+"""
+import sys
+import threading
+from pathlib import Path
+
+# Add project root to path
+proj_root = Path(__file__).resolve().parents[1]
+if str(proj_root) not in sys.path:
+    sys.path.insert(0, str(proj_root))
+
+from app.database import pg_connect
+from app.utils import write_coalescer
+from app.utils.write_coalescer import WriteCoalescer
+
+TIMEOUT = 5
+WINDOW = 0.5  # long enough that rows submitted back to back share a batch
+
+
+class FakeInsert:
+    """Stands in for bulk_upsert_vectors; rows with 'bad' set fail their statement."""
+
+    def __init__(self):
+        self.statements = []
+        self.next_id = 1
+        self.lock = threading.Lock()
+
+    def __call__(self, rows):
+        with self.lock:
+            self.statements.append([row['image_url'] for row in rows])
+            if any(row.get('bad') for row in rows):
+                raise ValueError("bad row")
+            ids = list(range(self.next_id, self.next_id + len(rows)))
+            self.next_id += len(rows)
+            return ids
+
+
+def row(name, bad=False):
+    return {'image_url': name, 'bad': bad}
+
+
+def run_with_insert(insert, scenario):
+    original = pg_connect.bulk_upsert_vectors
+    pg_connect.bulk_upsert_vectors = insert
+    try:
+        scenario()
+    finally:
+        pg_connect.bulk_upsert_vectors = original
+
+
+def test_rows_are_batched():
+    insert = FakeInsert()
+
+    def scenario():
+        coalescer = WriteCoalescer(window_seconds=WINDOW, max_rows=3)
+        futures = [coalescer.submit(row(f"img{i}")) for i in range(5)]
+        ids = [f.result(TIMEOUT) for f in futures]
+        assert insert.statements == [["img0", "img1", "img2"], ["img3", "img4"]]
+        assert ids == [1, 2, 3, 4, 5]
+
+    run_with_insert(insert, scenario)
+
+
+def test_bad_row_only_fails_its_own_future():
+    insert = FakeInsert()
+
+    def scenario():
+        coalescer = WriteCoalescer(window_seconds=WINDOW, max_rows=10)
+        futures = [coalescer.submit(r) for r in (row("a"), row("b", bad=True), row("c"))]
+        assert futures[0].result(TIMEOUT) == 1
+        try:
+            futures[1].result(TIMEOUT)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("the bad row should fail")
+        assert futures[2].result(TIMEOUT) == 2
+        # one batched attempt, then one statement per row
+        assert insert.statements == [["a", "b", "c"], ["a"], ["b"], ["c"]]
+
+    run_with_insert(insert, scenario)
+
+
+def test_flush_error_fails_whole_batch():
+    insert = FakeInsert()
+
+    def scenario():
+        coalescer = WriteCoalescer(window_seconds=WINDOW, max_rows=10)
+        original_observe = write_coalescer.WRITE_BATCH_ROWS.observe
+
+        def failing_observe(value):
+            raise RuntimeError("metrics down")
+
+        write_coalescer.WRITE_BATCH_ROWS.observe = failing_observe
+        try:
+            futures = [coalescer.submit(r) for r in (row("a"), row("b"))]
+            for future in futures:
+                try:
+                    future.result(TIMEOUT)
+                except RuntimeError:
+                    pass
+                else:
+                    raise AssertionError("every row of the failed batch should fail")
+        finally:
+            write_coalescer.WRITE_BATCH_ROWS.observe = original_observe
+
+        assert insert.statements == []
+        # the writer thread survives and keeps serving later rows
+        assert coalescer.submit(row("c")).result(TIMEOUT) == 1
+
+    run_with_insert(insert, scenario)
+
+
+if __name__ == "__main__":
+    test_rows_are_batched()
+    test_bad_row_only_fails_its_own_future()
+    test_flush_error_fails_whole_batch()
+    print("ok")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Export the vector catalog to an on-disk snapshot, or load a snapshot back.
+
+A snapshot is a directory with `vectors.npy` (float32 matrix), `metadata.jsonl`
+(one row per vector, same order) and `manifest.json`; see app/utils/snapshot.py.
+Export streams rows through a server-side cursor and import uses binary COPY,
+so neither side holds the catalog in memory.
+
+Examples:
+    python vector_snapshot.py export snapshots/all
+    python vector_snapshot.py export snapshots/tenant_abc --tenant-id tenant_abc
+    python vector_snapshot.py import snapshots/tenant_abc --replace    # rebuild that tenant's rows
+    python vector_snapshot.py import snapshots/all --replace --keep-ids  # restore the whole table
+"""
+import argparse
+import sys
+import time
+
+from app.database import pg_connect
+from app.utils.snapshot import SnapshotError, export_snapshot, import_snapshot, read_manifest
+
+
+def run_export(args):
+    started = time.time()
+    state = {'rows': 0, 'last': started}
+
+    def progress(rows):
+        state['rows'] += rows
+        now = time.time()
+        if now - state['last'] >= 2:
+            state['last'] = now
+            print(f"  {state['rows']} rows ({state['rows'] / (now - started):.0f}/s)", flush=True)
+
+    manifest = export_snapshot(args.out, tenant_id=args.tenant_id, style_number=args.style_number,
+                               fetch_size=args.fetch_size, on_batch=progress)
+    elapsed = time.time() - started
+    print(f"Exported {manifest['count']} vectors (dim {manifest['dim']}) to {args.out} in {elapsed:.1f}s")
+    if manifest['skipped_without_vector']:
+        print(f"Skipped {manifest['skipped_without_vector']} rows without a vector")
+
+
+def run_import(args):
+    manifest = read_manifest(args.src)
+    scope = manifest.get('tenant_id') or 'all tenants'
+    if manifest.get('style_number'):
+        scope += f", style {manifest['style_number']}"
+    print(f"Importing {manifest['count']} vectors ({scope}){' replacing existing rows' if args.replace else ''}")
+
+    started = time.time()
+    pg_connect.init_table()
+    count = import_snapshot(args.src, replace=args.replace, keep_ids=args.keep_ids, batch_size=args.batch_size)
+    print(f"Imported {count} vectors in {time.time() - started:.1f}s")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = p.add_subparsers(dest='command', required=True)
+
+    ex = sub.add_parser('export', help='Write vectors and metadata to a new snapshot directory')
+    ex.add_argument('out', help='Snapshot directory to create')
+    ex.add_argument('--tenant-id', default=None, help='Only export this tenant')
+    ex.add_argument('--style-number', default=None, help='Only export this style number')
+    ex.add_argument('--fetch-size', type=int, default=None, help='Rows per cursor fetch (default VECTOR_FETCH_SIZE)')
+
+    im = sub.add_parser('import', help='Load a snapshot into fvector_pg with binary COPY')
+    im.add_argument('src', help='Snapshot directory')
+    im.add_argument('--replace', action='store_true',
+                    help="Delete the rows in the snapshot's tenant/style scope first (same transaction)")
+    im.add_argument('--keep-ids', action='store_true', help='Keep the exported ids instead of assigning new ones')
+    im.add_argument('--batch-size', type=int, default=5000, help='Rows per COPY batch')
+
+    args = p.parse_args()
+    try:
+        if args.command == 'export':
+            run_export(args)
+        else:
+            run_import(args)
+    except SnapshotError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,11 +2,27 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from config import settings
 from app.database.db_connect import database
+import asyncio
 import logging as log
 
 ALLOWED_ORIGINS = [settings.CLIENT_URL]
 
 
+async def warm_score_cache():
+    # Intern the corpus operation names and pre-score the common ones in the
+    # background, so the first searches already hit the pair cache
+    # (imported here: get_data imports `database` from this package)
+    from app.utils.get_data import get_operation_name_counts
+    from app.utils.text_compare import warm_score_cache as warm
+
+    try:
+        names, counts = await get_operation_name_counts()
+        stats = await asyncio.to_thread(warm, names, counts)
+        log.info(f"Score cache warmed: {stats}")
+    except Exception as e:
+        log.warning(f"Score cache warm-up failed: {e}")
+
+
 def create_app():
     app = FastAPI(
         title="OB Similarity API", version="0.1.0", description="API for OB similarity"
@@ -19,6 +35,8 @@ def create_app():
         log.basicConfig(level=log.INFO, format="%(asctime)s:    %(message)s")
         log.info("Connected to Database")
         # print("--- Connected to Database ---")
+        if settings.OB_PAIR_CACHE_SIZE > 0:
+            app.state.score_cache_warmup = asyncio.create_task(warm_score_cache())
 
     @app.on_event("shutdown")
     async def shutdown():
@@ -1,5 +1,6 @@
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
+from app.utils import score_cache
 
 
 status_router = APIRouter()
@@ -14,3 +15,9 @@ async def index():
             "description": "Operation breakdown similarity search engine is up and running",
         },
     )
+
+
+@status_router.get("/status/score-cache")
+async def score_cache_status():
+    """Interned operation names and the pair-score cache's size and hit rate."""
+    return JSONResponse(status_code=200, content=score_cache.stats())
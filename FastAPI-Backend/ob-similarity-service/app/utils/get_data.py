@@ -386,4 +386,22 @@ async def get_ob_by_layout_code(tenant_id: int, layout_code: str):
             for row in data
         ]
     }
-    return ob_data
\ No newline at end of file
+    return ob_data
+
+async def get_operation_name_counts():
+    """Distinct operation names of all layouts with how many operations use each (for the score cache)"""
+    query = """
+    SELECT 
+        layout_operation.operation_name,
+        COUNT(*) AS uses
+    FROM 
+        layout_operation
+    GROUP BY 
+        layout_operation.operation_name;
+    """
+    results = await fetch_from_db(query, {})
+    if not results:
+        return [], []
+    names = [row["operation_name"] for row in results if row["operation_name"]]
+    counts = [int(row["uses"]) for row in results if row["operation_name"]]
+    return names, counts
@@ -0,0 +1,219 @@
+# app/utils/score_cache.py
+"""
+Interned operation names and a cache of their pair scores.
+
+The operation names of all tenants ("TACK SIDE SEAMS UPPER+UNDER", ...) come
+from a vocabulary of a few thousand, so every `/ob/search` scores mostly the
+same pairs again. `OperationVocabulary` gives each preprocessed name an integer
+id, and `PairScoreCache` keeps the score of (query id, reference id) pairs in
+OB_PAIR_CACHE_SHARDS LRU shards, OB_PAIR_CACHE_SIZE pairs in total, each behind
+its own lock. `cached_score_matrix` scores the distinct names of a search
+through the cache and only sends the missing pairs to the fuzzy scorer, so a
+warm search is mostly dictionary lookups.
+
+Names met after the vocabulary holds OB_VOCABULARY_SIZE names are scored but
+not cached. At startup `warm` interns every operation name in the corpus and
+scores the OB_PAIR_CACHE_WARM_NAMES most used ones against all of them, as many
+as fit in half the cache.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from config import settings
+
+
+# score matrix of preprocessed names: (queries, references) -> float32 array
+Scorer = Callable[[List[str], List[str]], np.ndarray]
+
+
+class OperationVocabulary:
+    """Maps preprocessed operation names to dense integer ids."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def name(self, name_id: int) -> str:
+        return self._names[name_id]
+
+    def intern(self, names: List[str]) -> np.ndarray:
+        """Ids of `names`, adding new ones; -1 for new names once the vocabulary is full."""
+        ids = self._ids
+        out = [ids.get(name, -1) for name in names]
+        if -1 in out:
+            with self._lock:
+                for i, name in enumerate(names):
+                    if out[i] == -1:
+                        name_id = ids.get(name)
+                        if name_id is None and len(self._names) < self.max_size:
+                            name_id = ids[name] = len(self._names)
+                            self._names.append(name)
+                        out[i] = -1 if name_id is None else name_id
+        return np.asarray(out, dtype=np.int64)
+
+
+class _Shard:
+    __slots__ = ("lock", "entries", "hits", "misses", "evictions")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[int, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+class PairScoreCache:
+    """Bounded LRU of pair scores keyed by (query id << 32 | reference id), split over locked shards."""
+
+    def __init__(self, max_pairs: int, shards: int):
+        self.shards = [_Shard() for _ in range(max(1, shards))]
+        self.shard_capacity = max(1, max_pairs // len(self.shards))
+
+    @property
+    def max_pairs(self) -> int:
+        return self.shard_capacity * len(self.shards)
+
+    def _by_shard(self, keys: np.ndarray):
+        shard_of = keys % len(self.shards)
+        for index, shard in enumerate(self.shards):
+            positions = np.flatnonzero(shard_of == index)
+            if len(positions):
+                yield shard, positions
+
+    def get_many(self, keys: np.ndarray):
+        """(scores, found) for `keys`; scores of keys not found are 0."""
+        scores = np.zeros(len(keys), dtype=np.float32)
+        found = np.zeros(len(keys), dtype=bool)
+        for shard, positions in self._by_shard(keys):
+            hit_positions, hit_scores = [], []
+            with shard.lock:
+                entries = shard.entries
+                for position, key in zip(positions.tolist(), keys[positions].tolist()):
+                    score = entries.get(key)
+                    if score is not None:
+                        entries.move_to_end(key)
+                        hit_positions.append(position)
+                        hit_scores.append(score)
+                shard.hits += len(hit_positions)
+                shard.misses += len(positions) - len(hit_positions)
+            scores[hit_positions] = hit_scores
+            found[hit_positions] = True
+        return scores, found
+
+    def put_many(self, keys: np.ndarray, scores: np.ndarray):
+        for shard, positions in self._by_shard(keys):
+            with shard.lock:
+                entries = shard.entries
+                entries.update(zip(keys[positions].tolist(), scores[positions].tolist()))
+                overflow = len(entries) - self.shard_capacity
+                for _ in range(max(0, overflow)):
+                    entries.popitem(last=False)
+                shard.evictions += max(0, overflow)
+
+    def clear(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.entries.clear()
+
+    def stats(self) -> Dict:
+        """Size, hits, misses and hit rate summed over the shards."""
+        size = hits = misses = evictions = 0
+        for shard in self.shards:
+            with shard.lock:
+                size += len(shard.entries)
+                hits += shard.hits
+                misses += shard.misses
+                evictions += shard.evictions
+        return {
+            "pairs": size,
+            "max_pairs": self.max_pairs,
+            "shards": len(self.shards),
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 4) if hits + misses else None,
+            "evictions": evictions,
+        }
+
+
+vocabulary = OperationVocabulary(settings.OB_VOCABULARY_SIZE)
+pair_cache = PairScoreCache(settings.OB_PAIR_CACHE_SIZE, settings.OB_PAIR_CACHE_SHARDS)
+
+
+def cached_score_matrix(queries: List[str], references: List[str], scorer: Scorer) -> np.ndarray:
+    """
+    `scorer(queries, references)` for preprocessed names, with every distinct
+    interned pair looked up in (and missing pairs added to) the pair cache.
+    """
+    query_ids = vocabulary.intern(queries)
+    reference_ids = vocabulary.intern(references)
+
+    # names that could not be interned get per-call negative ids and skip the cache
+    local: Dict[str, int] = {}
+    for ids, names in ((query_ids, queries), (reference_ids, references)):
+        for i in np.flatnonzero(ids < 0).tolist():
+            ids[i] = local.setdefault(names[i], -len(local) - 1)
+    local_names = {name_id: name for name, name_id in local.items()}
+
+    def name_of(name_id: int) -> str:
+        return vocabulary.name(name_id) if name_id >= 0 else local_names[name_id]
+
+    unique_queries, query_index = np.unique(query_ids, return_inverse=True)
+    unique_references, reference_index = np.unique(reference_ids, return_inverse=True)
+    keys = ((unique_queries[:, None] << 32) | unique_references[None, :]).ravel()
+    cacheable = ((unique_queries[:, None] >= 0) & (unique_references[None, :] >= 0)).ravel()
+
+    scores = np.zeros(len(keys), dtype=np.float32)
+    found = np.zeros(len(keys), dtype=bool)
+    scores[cacheable], found[cacheable] = pair_cache.get_many(keys[cacheable])
+
+    missing = ~found.reshape(len(unique_queries), len(unique_references))
+    if missing.any():
+        # score the rows x columns that hold a missing pair in one scorer call
+        rows = np.flatnonzero(missing.any(axis=1))
+        columns = np.flatnonzero(missing.any(axis=0))
+        computed = scorer(
+            [name_of(name_id) for name_id in unique_queries[rows].tolist()],
+            [name_of(name_id) for name_id in unique_references[columns].tolist()],
+        )
+        grid = scores.reshape(missing.shape)
+        grid[np.ix_(rows, columns)] = np.where(
+            missing[np.ix_(rows, columns)], computed, grid[np.ix_(rows, columns)]
+        )
+        new = (missing & cacheable.reshape(missing.shape)).ravel()
+        pair_cache.put_many(keys[new], scores[new])
+
+    return scores.reshape(len(unique_queries), len(unique_references))[query_index][:, reference_index]
+
+
+def warm(names: List[str], counts: List[int], scorer: Scorer) -> Dict:
+    """
+    Intern the corpus `names` (preprocessed, distinct) and cache the scores of the
+    OB_PAIR_CACHE_WARM_NAMES most used ones (by `counts`) against all of them.
+    Fewer names are warmed when their rows would not fit in half the pair cache,
+    so warming neither evicts its own pairs nor leaves searches no room.
+    """
+    name_ids = vocabulary.intern(names)
+    interned = np.flatnonzero(name_ids >= 0)
+    rows = min(settings.OB_PAIR_CACHE_WARM_NAMES, pair_cache.max_pairs // 2 // max(1, len(interned)))
+    top = [i for i in np.argsort(counts, kind="stable")[::-1].tolist() if name_ids[i] >= 0]
+    top = top[:rows]
+    if top and len(interned):
+        scores = scorer([names[i] for i in top], [names[i] for i in interned.tolist()])
+        keys = (name_ids[top][:, None] << 32) | name_ids[interned][None, :]
+        pair_cache.put_many(keys.ravel(), scores.ravel())
+    return {"warmed_names": len(top), **stats()}
+
+
+def stats() -> Dict:
+    """Vocabulary size plus the pair cache's size and hit rate."""
+    return {"vocabulary": len(vocabulary), "max_vocabulary": vocabulary.max_size, **pair_cache.stats()}
@@ -0,0 +1,77 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.utils import score_cache
+from config import settings
+
+
+calls = []
+
+
+def exact_scorer(queries, references):
+    # stand-in fuzzy scorer: 100 for equal names, else the number of shared letters
+    calls.append((list(queries), list(references)))
+    return np.array([[100.0 if q == r else float(len(set(q) & set(r))) for r in references] for q in queries],
+                    dtype=np.float32)
+
+
+class TestPairScoreCache(unittest.TestCase):
+
+    def setUp(self):
+        calls.clear()
+        self.vocabulary = score_cache.OperationVocabulary(3)
+        self.cache = score_cache.PairScoreCache(max_pairs=40, shards=4)
+        patches = [mock.patch.object(score_cache, "vocabulary", self.vocabulary),
+                   mock.patch.object(score_cache, "pair_cache", self.cache)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_hits_and_misses(self):
+        keys = np.array([1, 2, 3, 4], dtype=np.int64)
+        self.cache.put_many(keys[:2], np.array([10, 20], dtype=np.float32))
+        scores, found = self.cache.get_many(keys)
+        self.assertEqual(found.tolist(), [True, True, False, False])
+        self.assertEqual(scores.tolist(), [10, 20, 0, 0])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_rate"]), (2, 2, 0.5))
+
+    def test_second_search_is_served_from_cache(self):
+        queries, references = ["hem", "cuff"], ["hem", "cuff", "hem"]
+        first = score_cache.cached_score_matrix(queries, references, exact_scorer)
+        second = score_cache.cached_score_matrix(queries, references, exact_scorer)
+        np.testing.assert_array_equal(first, second)
+        np.testing.assert_array_equal(first, exact_scorer(queries, references))
+        self.assertEqual(len(calls), 2)  # the first search and the direct call above
+        self.assertEqual(self.cache.stats()["hits"], 4)
+
+    def test_names_beyond_the_vocabulary(self):
+        # the vocabulary holds 3 names; the others get per-call negative ids and skip the cache
+        queries = ["hem", "cuff", "collar", "placket", "cuff"]
+        references = ["placket", "hem", "sleeve", "collar"]
+        scores = score_cache.cached_score_matrix(queries, references, exact_scorer)
+        np.testing.assert_array_equal(scores, exact_scorer(queries, references))
+        # hem, cuff and collar are interned; only their pairs with hem and collar are cached
+        self.assertEqual(len(self.vocabulary), 3)
+        self.assertEqual(self.cache.stats()["pairs"], 3 * 2)
+
+        again = score_cache.cached_score_matrix(queries, references, exact_scorer)
+        np.testing.assert_array_equal(again, scores)
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (6, 6))
+
+    def test_warm_fits_in_the_cache(self):
+        self.vocabulary.max_size = 100
+        names = [f"operation {i}" for i in range(10)]
+        with mock.patch.object(settings, "OB_PAIR_CACHE_WARM_NAMES", 200):
+            result = score_cache.warm(names, list(range(len(names))), exact_scorer)
+        # half of 40 pairs / 10 names: the 2 most used names are warmed
+        self.assertEqual(result["warmed_names"], 2)
+        self.assertEqual(result["pairs"], 20)
+        self.assertEqual(result["evictions"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
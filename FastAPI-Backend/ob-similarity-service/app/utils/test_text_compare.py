@@ -1,3 +1,12 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from app.utils import text_compare
+from config import settings
+
+
 # import unittest
 # from text_compare import get_similarity_score
 
@@ -31,3 +40,53 @@
 
 # if __name__ == "__main__":
 #     unittest.main()
+
+
+OPERATION_NAMES = [
+    "GATHER UNDERBREAST IN/ EX", "Gather Underbust (Inside/Outside)", "Attach Lining to Cup Sides",
+    "Top Stitch Neckline Elastic", "TACK SIDE SEAMS UPPER+UNDER", "Join Side Seam",
+    "Attach Strap to Cup", "Overlock Side Seams", "Hem Bottom", "Cover Stitch Hem",
+    "Attach Hook & Eye Tape", "Bartack Strap Ends", "Set Underwire Channel",
+    "Zig-Zag Elastic at Waist", "Attach Care Label", "Trim Threads & Inspect",
+    "Join Shoulder Seam", "Binding Neckline", "Attach Sleeve", "Close Sleeve Seam",
+    "Attach Cuff", "Topstitch Front Placket", "Attach Collar", "Make Button Holes",
+]
+
+
+def _ops(indexes):
+    return [(OPERATION_NAMES[i], "SNLS") for i in indexes]
+
+
+class TestScoreEngines(unittest.TestCase):
+    """OB_SCORE_ENGINE=matrix against the per-pair loop, within the tolerance stated in fuzz_score_matrix."""
+
+    query = _ops([0, 2, 4, 7, 10, 13, 16, 20])
+    layouts = [_ops(range(start, start + size)) for start in range(0, 16, 3) for size in (3, 6, 8)]
+
+    def scores(self, engine):
+        with mock.patch.object(settings, "OB_SCORE_ENGINE", engine), \
+                mock.patch.object(settings, "OB_PAIR_CACHE_SIZE", 0):
+            return text_compare.operation_similarity_scores(self.query, self.layouts)
+
+    def test_pair_scores(self):
+        names = [text_compare.preprocess_text(name) for name in OPERATION_NAMES]
+        matrix = text_compare.fuzz_score_matrix(names, names)
+        loop = np.array([[text_compare.get_similarity_score(a, b) for b in OPERATION_NAMES] for a in OPERATION_NAMES])
+        self.assertGreaterEqual((matrix - loop).min(), -0.2 - 1e-4)
+        np.testing.assert_allclose(np.diag(matrix), 100)
+
+    def test_layout_scores(self):
+        matrix, loop = self.scores("matrix"), self.scores("loop")
+        difference = matrix - loop
+        self.assertGreaterEqual(difference.min(), -0.2 - 1e-4)
+        self.assertLessEqual(difference.max(), 2.5)
+        self.assertEqual(set(np.argsort(-matrix)[:5]), set(np.argsort(-loop)[:5]))
+
+    def test_empty_layout_scores_zero(self):
+        with mock.patch.object(settings, "OB_PAIR_CACHE_SIZE", 0):
+            scores = text_compare.operation_similarity_scores(self.query, [[], self.layouts[0]])
+        self.assertEqual(scores[0], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
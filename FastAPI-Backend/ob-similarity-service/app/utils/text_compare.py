@@ -3,10 +3,13 @@ from sklearn.metrics.pairwise import cosine_similarity
 import numpy as np
 from Levenshtein import distance as levenshtein_distance
 from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rapid_fuzz, process as rapid_process, utils as rapid_utils
 from app.utils.data_transform import (
     get_operation_machine_list,
     get_operation_machine_list_db,
 )
+from app.utils import score_cache
+from config import settings
 import concurrent.futures
 
 
@@ -273,21 +276,150 @@ def extract_operation_sequence(operation_machine_list):
     """
     return [preprocess_text(op[0]) for op in operation_machine_list]
 
-def compare_ob_v3(operation_machine_list, database_records):
-    # Operation-name similarity (existing logic)
-    operation_name_similarity_scores = []
+# ----------------------------------------------------------------------------------------
+# Operation-name score matrix
+# ----------------------------------------------------------------------------------------
 
-    for operation_data in operation_machine_list:
-        operation_name = operation_data[0]
-        scores = []
+# The five scorers of fuzz_similarity, with the processing fuzzywuzzy applies to each:
+# ratio and partial_ratio compare the strings as given, the token and W ratios run
+# full_process (lowercase, punctuation to spaces) first.
+MATRIX_SCORERS = (
+    (rapid_fuzz.ratio, None),
+    (rapid_fuzz.partial_ratio, None),
+    (rapid_fuzz.token_sort_ratio, rapid_utils.default_process),
+    (rapid_fuzz.token_set_ratio, rapid_utils.default_process),
+    (rapid_fuzz.WRatio, rapid_utils.default_process),
+)
 
-        for record in database_records:
-            operation_name_ref = record[0]
-            scores.append(get_similarity_score(operation_name, operation_name_ref))
+# Upper bound on query x reference cells scored per cdist call (float32, ~16 MB)
+MAX_MATRIX_CELLS = 4_000_000
 
-        operation_name_similarity_scores.append(max(scores))
 
-    avg_operation_name_similarity = np.mean(operation_name_similarity_scores)
+def fuzz_score_matrix(queries, references):
+    """
+    fuzz_similarity of every query against every reference (both preprocessed),
+    as a len(queries) x len(references) float32 matrix.
+
+    Every scorer runs as one rapidfuzz cdist call (in C, on OB_SCORE_WORKERS
+    threads) instead of one Python call per pair. Scores are rounded to integers
+    like fuzzywuzzy's before they are averaged. ratio, token_sort_ratio and
+    token_set_ratio give fuzzywuzzy's scores. rapidfuzz's partial_ratio finds the
+    best alignment where fuzzywuzzy's takes the first good one, so it scores the
+    same or higher; WRatio can come out 1 lower because fuzzywuzzy rounds its
+    partial scores before scaling them.
+
+    Tolerance against get_similarity_score (OB_SCORE_ENGINE=loop): a pair's score
+    is at most 0.2 lower and can be several points higher; a layout's
+    operation_similarity_score is between 0.2 lower and 2.5 higher. Checked on
+    fixed operation names in test_text_compare.py.
+    """
+    total = np.zeros((len(queries), len(references)), dtype=np.float32)
+    if not queries or not references:
+        return total
+
+    for scorer, processor in MATRIX_SCORERS:
+        scores = rapid_process.cdist(
+            queries,
+            references,
+            scorer=scorer,
+            processor=processor,
+            dtype=np.float32,
+            workers=settings.OB_SCORE_WORKERS,
+        )
+        total += np.rint(scores)
+    return total / len(MATRIX_SCORERS)
+
+
+def operation_score_matrix(query_names, reference_names):
+    """
+    fuzz_similarity of every query name against every reference name (see
+    fuzz_score_matrix), with pair scores served from the cross-request pair
+    cache (score_cache) unless OB_PAIR_CACHE_SIZE=0.
+    OB_SCORE_ENGINE=loop scores with get_similarity_score instead.
+    """
+    queries = [preprocess_text(name) for name in query_names]
+    references = [preprocess_text(name) for name in reference_names]
+    if not queries or not references:
+        return np.zeros((len(queries), len(references)), dtype=np.float32)
+    if settings.OB_PAIR_CACHE_SIZE > 0:
+        return score_cache.cached_score_matrix(queries, references, fuzz_score_matrix)
+    return fuzz_score_matrix(queries, references)
+
+
+def warm_score_cache(operation_names, counts):
+    """Intern the corpus operation names and pre-score the most used ones (see score_cache.warm)."""
+    totals = {}
+    for name, count in zip(operation_names, counts):
+        name = preprocess_text(name)
+        totals[name] = totals.get(name, 0) + count
+    names = list(totals)
+    return score_cache.warm(names, [totals[name] for name in names], fuzz_score_matrix)
+
+
+def _best_match_means(query_names, reference_lists):
+    # Score one chunk of reference OBs: best match of every query name within each
+    # OB (row max over its columns), averaged over the query names
+    lengths = np.array([len(names) for names in reference_lists])
+    scores = np.zeros(len(reference_lists))
+    if not query_names or not lengths.any():
+        return scores
+
+    matrix = operation_score_matrix(
+        query_names, [name for names in reference_lists for name in names]
+    )
+    non_empty = lengths > 0
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[non_empty]
+    best = np.maximum.reduceat(matrix, starts, axis=1)
+    scores[non_empty] = best.mean(axis=0)
+    return scores
+
+
+def operation_similarity_scores(operation_machine_list, reference_op_lists):
+    """
+    Operation-name similarity of the query OB to each reference OB: for every
+    query operation the best score against the OB's operations, averaged.
+
+    Args:
+        operation_machine_list: (operation name, machine name) of the query OB
+        reference_op_lists: one (operation name, machine name) list per reference OB
+
+    Returns:
+        One score (0-100) per reference OB; an empty OB scores 0
+    """
+    query_names = [op[0] for op in operation_machine_list]
+    reference_names = [[op[0] for op in ops] for ops in reference_op_lists]
+
+    if settings.OB_SCORE_ENGINE == "loop":
+        return np.array(
+            [
+                np.mean([max(get_similarity_score(q, r) for r in names) for q in query_names])
+                if names
+                else 0.0
+                for names in reference_names
+            ]
+        )
+
+    # All reference OBs go through one matrix, cut into chunks so a large
+    # catalog does not allocate queries x all operations at once
+    max_columns = max(1, MAX_MATRIX_CELLS // max(1, len(query_names)))
+    scores = []
+    chunk, columns = [], 0
+    for names in reference_names:
+        if chunk and columns + len(names) > max_columns:
+            scores.append(_best_match_means(query_names, chunk))
+            chunk, columns = [], 0
+        chunk.append(names)
+        columns += len(names)
+    scores.append(_best_match_means(query_names, chunk))
+    return np.concatenate(scores)
+
+
+def compare_ob_v3(operation_machine_list, database_records, avg_operation_name_similarity=None):
+    # Operation-name similarity (existing logic), unless already scored in a batch
+    if avg_operation_name_similarity is None:
+        avg_operation_name_similarity = operation_similarity_scores(
+            operation_machine_list, [database_records]
+        )[0]
 
     # Sequence similarity (NEW)
     seq1 = extract_operation_sequence(operation_machine_list)
@@ -312,13 +444,21 @@ def compare_ob_v3(operation_machine_list, database_records):
 
 def get_ob_similarity_score_v3(operation_data, database_records):
     operation_machine_list = get_operation_machine_list(operation_data)
-    result = []
+    db_op_lists = [
+        get_operation_machine_list_db(record["operation_data"])
+        for record in database_records
+    ]
 
-    for record in database_records:
-        db_op_list = get_operation_machine_list_db(record["operation_data"])
+    # Operation-name scores of all records from one score matrix
+    operation_scores = operation_similarity_scores(operation_machine_list, db_op_lists)
+
+    result = []
 
+    for record, db_op_list, operation_score in zip(
+        database_records, db_op_lists, operation_scores
+    ):
         similarity_scores = compare_ob_v3(
-            operation_machine_list, db_op_list
+            operation_machine_list, db_op_list, float(operation_score)
         )
 
         result.append(
@@ -9,6 +9,15 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = "development"
     CLIENT_URL: str = "http://localhost:3000"
     DATABASE_URL: str | None = None
+    # OB search: "matrix" scores operation names with rapidfuzz cdist, "loop" with
+    # the per-pair fuzzywuzzy scorer (slower, for comparison)
+    OB_SCORE_ENGINE: str = "matrix"
+    OB_SCORE_WORKERS: int = -1  # cdist threads per scorer call; -1 = all cores
+    # Cross-request cache of operation-name pair scores (0 disables it)
+    OB_PAIR_CACHE_SIZE: int = 500_000  # pairs kept, LRU per shard
+    OB_PAIR_CACHE_SHARDS: int = 16
+    OB_VOCABULARY_SIZE: int = 100_000  # interned operation names; later names are not cached
+    OB_PAIR_CACHE_WARM_NAMES: int = 200  # most used corpus names pre-scored at startup (0 = intern only)
 
     model_config = {
         "env_file": ".env",